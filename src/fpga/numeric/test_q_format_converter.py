@@ -1,13 +1,27 @@
 import cocotb
 from cocotb.clock import Clock
 from cocotb.triggers import Timer, RisingEdge, FallingEdge
+from cocotb.queue import Queue
 from cocotbext.axi import AxiStreamSource, AxiStreamSink, AxiStreamBus, AxiStreamFrame
 import cocotb_test.simulator
 import pytest
+from functools import cache
 from itertools import product
 import random
+import json
 import os
+import sys
 import math
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from tbkit import runner
+from tbkit.pauses import drive_pauses, pause_pattern
+from tbkit.protocol import ProtocolMonitor, checked_modules
+
+MULTI_INSTANCES = json.loads(os.getenv("Q_FORMAT_INSTANCES", "null"))  # Parameter sets of a multi-instance top-level
+OUTCOMES_ENV = "Q_FORMAT_OUTCOMES"  # File receiving the failure of each configuration of a multi-instance top-level
+PAUSE_THROUGHPUT = 0.9  # Fraction of cycles the source and sink are not paused
 
 # --8<-- [start:metrics]
 class QFormatMetrics:
@@ -33,76 +47,214 @@ class QFormatMetrics:
         return data / (2**self.N)
 # --8<-- [end:metrics]
 
-@cocotb.test()
-async def q_format_converter_tb(dut):
-    # Create a clock
-    cocotb.start_soon(Clock(dut.aclk, 10, units='ns').start())
+    def to_fixed_point_array(self, values : np.ndarray):
+        """Vectorized `to_fixed_point` with identical saturate/wrap semantics"""
+        values = np.asarray(values, dtype=np.float64)
+        wrapped = np.mod(values, 2**self.M)
+        wrapped = np.where(values >= 0, wrapped, wrapped - 2**self.M)
+        data = np.floor(wrapped * (2**self.N)).astype(np.int64)
+        if not self.allow_overflow:
+            data[values > 2**self.M - 2**(-self.N)] = 2**(self.M+self.N) - 1
+            data[values < -2**self.M] = -2**(self.M+self.N)
+        return data
 
-    # Create AXI Stream interfaces
-    source = AxiStreamSource(AxiStreamBus.from_prefix(dut, 's_axis'), dut.aclk, dut.aresetn, reset_active_level=False)
-    sink = AxiStreamSink(AxiStreamBus.from_prefix(dut, 'm_axis'), dut.aclk, dut.aresetn, reset_active_level=False)
+    def to_float_array(self, data : np.ndarray):
+        """Vectorized `to_float`"""
+        return np.asarray(data, dtype=np.int64) / (2**self.N)
 
-    # Set up the Pause generators to simulate random pauses in the stream
-    source.set_pause_generator(iter(lambda: random.random() < 0.1, None))
-    sink.set_pause_generator(iter(lambda: random.random() < 0.1, None))
+    def pack(self, data : np.ndarray, width_bytes : int):
+        """Pack signed integers into little-endian `tdata` beats of `width_bytes` each"""
+        data = np.asarray(data, dtype=np.int64)
+        if width_bytes in (1, 2, 4, 8):
+            return data.astype(f"<i{width_bytes}").tobytes()
+        # Two's complement truncation of the 64-bit representation
+        return data.astype("<i8").view(np.uint8).reshape(-1, 8)[:, :width_bytes].tobytes()
 
-    # Reset DUT
+    def unpack(self, tdata : bytes, width_bytes : int):
+        """Decode `tdata` into signed integers, sign extended from bit M+N"""
+        if width_bytes in (1, 2, 4, 8):
+            raw = np.frombuffer(tdata, dtype=f"<u{width_bytes}")  # Zero-copy view
+        else:
+            beats = np.frombuffer(tdata, dtype=np.uint8).reshape(-1, width_bytes)
+            padded = np.zeros((len(beats), 8), dtype=np.uint8)
+            padded[:, :width_bytes] = beats
+            raw = padded.view("<u8").ravel()
+        data = raw.astype(np.int64)
+        sign = 2**(self.M + self.N)
+        data[data >= sign] -= 2 * sign
+        return data
+
+class ConverterTB:
+    """Source, sink and golden model around one q_format_converter, its ports named `<prefix>s_axis_*` and `<prefix>m_axis_*`"""
+    def __init__(self, dut, M_IN, N_IN, M_OUT, N_OUT, ALLOW_OVERFLOW, prefix=""):
+        # Create AXI Stream interfaces
+        self.source = AxiStreamSource(AxiStreamBus.from_prefix(dut, f'{prefix}s_axis'), dut.aclk, dut.aresetn, reset_active_level=False)
+        self.sink = AxiStreamSink(AxiStreamBus.from_prefix(dut, f'{prefix}m_axis'), dut.aclk, dut.aresetn, reset_active_level=False)
+
+        # Random pauses in the stream, only waking when the pause state changes
+        for port in (self.source, self.sink):
+            pattern = pause_pattern("bernoulli", PAUSE_THROUGHPUT)
+            cocotb.start_soon(drive_pauses(dut.aclk, pattern, lambda pause, port=port: setattr(port, "pause", pause)))
+
+        # Define Q format metrics
+        self.M_IN = M_IN
+        self.N_IN = N_IN
+        self.q_in = QFormatMetrics(M=M_IN, N=N_IN, allow_overflow=False)
+        self.q_out = QFormatMetrics(M=M_OUT, N=N_OUT, allow_overflow=ALLOW_OVERFLOW)
+
+        self.input_data_width_bytes = len(self.source.bus.tdata) // 8
+        self.output_data_width_bytes = len(self.sink.bus.tdata) // 8
+
+    async def run(self):
+        """Stream every input value through the converter and check the outputs"""
+        source, sink = self.source, self.sink
+        q_in, q_out = self.q_in, self.q_out
+        input_data_width_bytes = self.input_data_width_bytes
+        output_data_width_bytes = self.output_data_width_bytes
+
+        # Generate test data
+        min_value = -2**(self.M_IN + self.N_IN)
+        max_value = 2**(self.M_IN + self.N_IN) - 1
+        rng = np.random.default_rng(random.getrandbits(64))
+        test_data = rng.permutation(np.arange(min_value, max_value + 1, dtype=np.int64))
+
+        # Randomly divide test data into frames of 1 to 10 values
+        frame_sizes = rng.integers(1, 10, size=len(test_data), endpoint=True)
+        frame_bounds = np.cumsum(frame_sizes)
+        frame_bounds = frame_bounds[:np.searchsorted(frame_bounds, len(test_data))]
+        frame_bounds = np.concatenate(([0], frame_bounds, [len(test_data)]))
+
+        # Compute the golden model and encode the stimulus in one pass
+        send_data = q_in.pack(test_data, input_data_width_bytes)
+        expected_data = q_out.to_fixed_point_array(q_in.to_float_array(test_data))
+
+        # Stream frames through the DUT without draining it between frames: the
+        # producer keeps a few frames queued in the source, the consumer hands
+        # received frames to the checker in order
+        source.queue_occupancy_limit_frames = 16
+        received_frames = Queue()
+        bounds = list(zip(frame_bounds[:-1].tolist(), frame_bounds[1:].tolist()))
+
+        async def producer():
+            for start, end in bounds:
+                await source.send(AxiStreamFrame(send_data[start * input_data_width_bytes:end * input_data_width_bytes]))
+
+        async def consumer():
+            for _ in bounds:
+                await received_frames.put(await sink.recv())
+
+        async def checker():
+            for start, end in bounds:
+                received_frame = await received_frames.get()
+                received_data = q_out.unpack(received_frame.tdata, output_data_width_bytes)
+
+                # Compare received data with expected data
+                assert len(received_data) == end - start, f"Frame length mismatch: expected {end - start} values, got {len(received_data)}"
+                mismatches = np.flatnonzero(received_data != expected_data[start:end])
+                if mismatches.size:
+                    i = mismatches[0]
+                    send_value = test_data[start + i]
+                    send_bytes = send_data[(start + i) * input_data_width_bytes:(start + i + 1) * input_data_width_bytes]
+                    received_bytes = received_frame.tdata[i * output_data_width_bytes:(i + 1) * output_data_width_bytes]
+                    expected_value = expected_data[start + i]
+                    received_value = received_data[i]
+                    assert received_value == expected_value, f"Mismatch at value {send_value}({send_bytes.hex()}): expected {expected_value}, got {received_value}({received_bytes.hex()})"\
+                                                             f" ({mismatches.size} mismatches in frame)"
+
+        producer_task = cocotb.start_soon(producer())
+        consumer_task = cocotb.start_soon(consumer())
+        await checker()
+        await producer_task
+        await consumer_task
+
+async def reset(dut):
     dut.aresetn.value = 0
     await Timer(20, units='ns')
     dut.aresetn.value = 1
 
-    # Define Q format metrics
-    q_in = QFormatMetrics(M=dut.M_IN.value, N=dut.N_IN.value, allow_overflow=False)
-    q_out = QFormatMetrics(M=dut.M_OUT.value, N=dut.N_OUT.value, allow_overflow=dut.ALLOW_OVERFLOW.value)
-
-    # Generate test data
-    min_value = -2**(dut.M_IN.value + dut.N_IN.value)
-    max_value = 2**(dut.M_IN.value + dut.N_IN.value) - 1
-    test_data = list(range(min_value, max_value + 1))
-
-    # Randomly divide test data into frames
-    random.shuffle(test_data)
-    frames = []
-    while test_data:
-        frame_size = random.randint(1, 10)  # Random frame size between 1 and 10
-        frame_data = test_data[:frame_size]
-        test_data = test_data[frame_size:]
-        frames.append(frame_data)
-
-    input_data_width_bytes = len(dut.s_axis_tdata.value) // 8
-    output_data_width_bytes = len(dut.m_axis_tdata.value) // 8
-
-    # Send frames and verify output
-    for frame in frames:
-        # Send frame
-        send_frame = bytearray().join([value.to_bytes(input_data_width_bytes, byteorder='little', signed=True) for value in frame])
-        await source.send(AxiStreamFrame(send_frame))
-
-        # Receive and verify frame
-        received_frame = await sink.recv()
-
-        # Compare received data with expected data
-        expected_data = [q_out.to_fixed_point(q_in.to_float(value)) for value in frame]
-        for i in range(len(expected_data)):
-            send_value = frame[i]
-            send_data = send_frame[i * input_data_width_bytes:(i + 1) * input_data_width_bytes]
-            received_data = received_frame.tdata[i * output_data_width_bytes:(i + 1) * output_data_width_bytes]
-            received_value = int.from_bytes(received_data, byteorder='little', signed=False)
-            if received_value >= 2**(dut.M_OUT.value + dut.N_OUT.value):
-                received_value -= 2**(dut.M_OUT.value + dut.N_OUT.value + 1)
-            expected_value = expected_data[i]
-            assert received_value == expected_value, f"Mismatch at value {send_value}({send_data.hex()}): expected {expected_value}, got {received_value}({received_data.hex()})"
-
-@pytest.mark.parametrize("M_IN,N_IN,M_OUT,N_OUT,ALLOW_OVERFLOW",
+@cocotb.test(skip=MULTI_INSTANCES is not None)
+async def q_format_converter_tb(dut):
+    # Create a clock
+    cocotb.start_soon(Clock(dut.aclk, 10, units='ns').start())
+
+    tb = ConverterTB(dut, dut.M_IN.value, dut.N_IN.value, dut.M_OUT.value, dut.N_OUT.value, dut.ALLOW_OVERFLOW.value)
+    ProtocolMonitor.attach(dut)
+
+    # Reset DUT
+    await reset(dut)
+
+    await tb.run()
+
+@cocotb.test(skip=MULTI_INSTANCES is None)
+async def q_format_converter_multi_tb(dut):
+    """Check every instance of a multi-instance top-level concurrently, reporting failures per configuration"""
+    cocotb.start_soon(Clock(dut.aclk, 10, units='ns').start())
+
+    tbs = [ConverterTB(dut, *parameters, prefix=instance_prefix(i)) for i, parameters in enumerate(MULTI_INSTANCES)]
+
+    # The HDL protocol checkers of all instances, a violation names the instance of its configuration
+    checked = [module for i in range(len(tbs)) for module in checked_modules(getattr(dut, f"{instance_prefix(i)}inst"))]
+    if checked:
+        ProtocolMonitor(checked)
+
+    await reset(dut)
+
+    failures = {}
+
+    async def run(i, tb):
+        # Keep a failing instance from aborting the others
+        try:
+            await tb.run()
+        except Exception as e:
+            failures[i] = e
+
+    tasks = [cocotb.start_soon(run(i, tb)) for i, tb in enumerate(tbs)]
+    for task in tasks:
+        await task
+
+    for i, e in sorted(failures.items()):
+        dut._log.error(f"FAIL {parameter_name(*MULTI_INSTANCES[i])}: {e}")
+    if os.getenv(OUTCOMES_ENV):
+        with open(os.getenv(OUTCOMES_ENV), "w") as f:
+            json.dump({parameter_name(*parameters): str(failures.get(i, "")) for i, parameters in enumerate(MULTI_INSTANCES)}, f)
+    dut._log.info(f"{len(tbs) - len(failures)} of {len(tbs)} configurations passed")
+    assert not failures, f"{len(failures)} of {len(tbs)} configurations failed: " \
+                         + ", ".join(parameter_name(*MULTI_INSTANCES[i]) for i in sorted(failures))
+
+@pytest.mark.parametrize("M,N,ALLOW_OVERFLOW",
     list(product(
-        [0, 3, 7],  # M_IN
-        [0, 3, 7],  # N_IN
-        [0, 3, 7],  # M_OUT
-        [0, 3, 7],  # N_OUT
+        [0, 3, 7],  # M
+        [0, 3, 7],  # N
         [0, 1]  # ALLOW_OVERFLOW
     ))
 )
-def test_q_format_converter(M_IN, N_IN, M_OUT, N_OUT, ALLOW_OVERFLOW):
+def test_q_format_metrics_array(M, N, ALLOW_OVERFLOW):
+    """Check the vectorized model against the scalar one, no simulator required"""
+    q_in = QFormatMetrics(M=7, N=7, allow_overflow=False)
+    q_out = QFormatMetrics(M=M, N=N, allow_overflow=ALLOW_OVERFLOW)
+
+    data = np.arange(-2**14, 2**14, dtype=np.int64)
+    expected = [q_out.to_fixed_point(q_in.to_float(int(value))) for value in data]
+    assert q_out.to_fixed_point_array(q_in.to_float_array(data)).tolist() == expected
+
+    width_bytes = (M + N + 1 + 7) // 8
+    packed = b"".join(value.to_bytes(width_bytes, byteorder='little', signed=True) for value in expected)
+    assert q_out.pack(expected, width_bytes) == packed
+
+    # The DUT zero-pads the output above the sign bit
+    received = b"".join((value % 2**(M + N + 1)).to_bytes(width_bytes, byteorder='little') for value in expected)
+    assert q_out.unpack(received, width_bytes).tolist() == expected
+
+Q_FORMAT_PARAMETERS = list(product(
+    [0, 3, 7],  # M_IN
+    [0, 3, 7],  # N_IN
+    [0, 3, 7],  # M_OUT
+    [0, 3, 7],  # N_OUT
+    [0, 1]  # ALLOW_OVERFLOW
+))
+
+def simulator_args(M_IN, N_IN, M_OUT, N_OUT, ALLOW_OVERFLOW):
+    """Arguments of `cocotb_test.simulator.run` for one parameter set"""
     module = os.path.splitext(os.path.basename(__file__))[0]
     dut = "q_format_converter"
     toplevel = dut
@@ -119,9 +271,156 @@ def test_q_format_converter(M_IN, N_IN, M_OUT, N_OUT, ALLOW_OVERFLOW):
         'ALLOW_OVERFLOW': ALLOW_OVERFLOW
     }
 
-    cocotb_test.simulator.run(
+    return dict(
         verilog_sources=verilog_sources,
         toplevel=toplevel,
         module=module,
         parameters=parameters,
     )
+
+PARAMETER_NAMES = ['M_IN', 'N_IN', 'M_OUT', 'N_OUT', 'ALLOW_OVERFLOW']
+
+# Multi-instance top-levels the configurations are split into, 0 simulates each configuration on its own
+Q_FORMAT_BATCHES = int(os.getenv("Q_FORMAT_BATCHES", 3))
+
+def instance_prefix(i):
+    return f"c{i}_"
+
+def parameter_name(M_IN, N_IN, M_OUT, N_OUT, ALLOW_OVERFLOW):
+    return f"Q{M_IN}.{N_IN}->Q{M_OUT}.{N_OUT}" + (" overflow" if ALLOW_OVERFLOW else "")
+
+def multi_instance_verilog(name, parameter_sets):
+    """Source of a top-level with one q_format_converter per parameter set, its ports prefixed by `instance_prefix`"""
+    aligned = lambda width: (width + 7) // 8 * 8
+    declarations = ["input  wire aclk", "input  wire aresetn"]
+    comments = {}
+    instances = []
+    for i, parameters in enumerate(parameter_sets):
+        M_IN, N_IN, M_OUT, N_OUT, ALLOW_OVERFLOW = parameters
+        prefix = instance_prefix(i)
+        comments[len(declarations)] = f"// {prefix}inst: {parameter_name(*parameters)}"
+        declarations += [
+            f"input  wire [{aligned(M_IN + N_IN + 1) - 1}:0] {prefix}s_axis_tdata",
+            f"output wire {prefix}s_axis_tready",
+            f"input  wire {prefix}s_axis_tvalid",
+            f"input  wire {prefix}s_axis_tlast",
+            f"output wire [{aligned(M_OUT + N_OUT + 1) - 1}:0] {prefix}m_axis_tdata",
+            f"input  wire {prefix}m_axis_tready",
+            f"output wire {prefix}m_axis_tvalid",
+            f"output wire {prefix}m_axis_tlast",
+        ]
+        overrides = ", ".join(f".{key}({value})" for key, value in zip(PARAMETER_NAMES, parameters))
+        connections = [f".{bus}_{signal}({prefix}{bus}_{signal})"
+                       for bus in ("s_axis", "m_axis") for signal in ("tdata", "tready", "tvalid", "tlast")]
+        instances += [f"    q_format_converter #({overrides}) {prefix}inst (", "        .aclk(aclk),", "        .aresetn(aresetn),"]
+        instances += [f"        {connection}" + ("," if j < len(connections) - 1 else "") for j, connection in enumerate(connections)]
+        instances += ["    );"]
+
+    lines = [f"module {name} ("]
+    for j, declaration in enumerate(declarations):
+        if j in comments:
+            lines += ["", f"    {comments[j]}"]
+        lines.append(f"    {declaration}" + ("," if j < len(declarations) - 1 else ""))
+    lines += [");", ""] + instances + ["", "endmodule", ""]
+    return "\n".join(lines)
+
+def q_format_batches(batches=Q_FORMAT_BATCHES):
+    """Parameter sets split round-robin, so each batch gets a share of the long configurations"""
+    return [Q_FORMAT_PARAMETERS[i::batches] for i in range(batches)]
+
+def batch_simulator_args(batch, batches=Q_FORMAT_BATCHES):
+    """Arguments of `cocotb_test.simulator.run` for a top-level instantiating a batch of parameter sets"""
+    module = os.path.splitext(os.path.basename(__file__))[0]
+    toplevel = f"q_format_converter_batch_{batch}_of_{batches}"
+    parameter_sets = q_format_batches(batches)[batch]
+
+    source = multi_instance_verilog(toplevel, parameter_sets)
+    wrapper = os.path.join(runner.build_root(), "q_format", f"{toplevel}.v")
+    os.makedirs(os.path.dirname(wrapper), exist_ok=True)
+    # Only touch the wrapper when it changes, it is part of the build cache key
+    if not os.path.isfile(wrapper) or open(wrapper).read() != source:
+        with open(wrapper, "w") as f:
+            f.write(source)
+
+    verilog_sources = [
+        wrapper,
+        os.path.join(os.path.dirname(__file__), "q_format_converter.v"),
+    ]
+
+    return dict(
+        verilog_sources=verilog_sources,
+        toplevel=toplevel,
+        module=module,
+        extra_env={
+            "Q_FORMAT_INSTANCES": json.dumps(parameter_sets),
+            OUTCOMES_ENV: os.path.join(os.path.dirname(wrapper), f"{toplevel}.json"),
+        },
+    )
+
+@cache
+def batch_outcomes(batch, batches=Q_FORMAT_BATCHES):
+    """Simulate a batch once per session, returning the failure of each configuration by name and the simulation error"""
+    kwargs = batch_simulator_args(batch, batches)
+    path = kwargs["extra_env"][OUTCOMES_ENV]
+    if os.path.exists(path):
+        os.remove(path)  # Outcomes of a previous run
+
+    error = ""
+    try:
+        runner.run(**kwargs)
+    except (SystemExit, Exception) as e:
+        error = str(e) or type(e).__name__
+
+    outcomes = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            outcomes = json.load(f)
+    return outcomes, error
+
+def test_verilator_args(monkeypatch, tmp_path):
+    # Verilator builds come from runner.run, like the other simulators, no simulator required
+    monkeypatch.setenv("SIM", "verilator")
+    monkeypatch.setenv("SIM_BUILD", str(tmp_path))
+    batches = [runner.simulation_args(**batch_simulator_args(batch)) for batch in range(Q_FORMAT_BATCHES)]
+    for args in batches + [runner.simulation_args(**simulator_args(0, 3, 7, 0, 1))]:
+        assert "-O3" in args["compile_args"] and args["timescale"] == "1ns/1ps"
+        assert all(os.path.isfile(path) for path in args["verilog_sources"])
+    assert all(args["verilog_sources"][0].startswith(str(tmp_path)) for args in batches)  # Generated top-levels
+
+def test_multi_instance_verilog(monkeypatch, tmp_path):
+    monkeypatch.setenv("SIM_BUILD", str(tmp_path))
+    batches = q_format_batches(4)
+    assert sorted(parameters for batch in batches for parameters in batch) == sorted(Q_FORMAT_PARAMETERS)
+    assert max(map(len, batches)) - min(map(len, batches)) <= 1
+
+    source = multi_instance_verilog("top", [(0, 3, 7, 0, 1), (7, 7, 0, 0, 0)])
+    assert source.startswith("module top (") and source.count("q_format_converter #(") == 2
+    assert "q_format_converter #(.M_IN(0), .N_IN(3), .M_OUT(7), .N_OUT(0), .ALLOW_OVERFLOW(1)) c0_inst (" in source
+    assert "input  wire [7:0] c0_s_axis_tdata," in source and "output wire [7:0] c0_m_axis_tdata," in source
+    assert "input  wire [15:0] c1_s_axis_tdata," in source and "output wire c1_m_axis_tlast\n);" in source
+
+    kwargs = batch_simulator_args(1, 4)
+    wrapper = kwargs["verilog_sources"][0]
+    assert kwargs["toplevel"] == "q_format_converter_batch_1_of_4" and wrapper.startswith(str(tmp_path))
+    assert json.loads(kwargs["extra_env"]["Q_FORMAT_INSTANCES"]) == [list(parameters) for parameters in batches[1]]
+    with open(wrapper) as f:
+        assert f.read() == multi_instance_verilog(kwargs["toplevel"], batches[1])
+    mtime = os.stat(wrapper).st_mtime_ns
+    assert batch_simulator_args(1, 4) == kwargs and os.stat(wrapper).st_mtime_ns == mtime  # Cache key unchanged
+
+@pytest.mark.parametrize("parameters", Q_FORMAT_PARAMETERS, ids=lambda parameters: parameter_name(*parameters).replace(" ", "-"))
+def test_q_format_converter(parameters):
+    """Check one configuration, simulated with the others of its batch unless Q_FORMAT_BATCHES=0"""
+    if not Q_FORMAT_BATCHES:
+        runner.run(**simulator_args(*parameters))
+        return
+    batch = Q_FORMAT_PARAMETERS.index(parameters) % Q_FORMAT_BATCHES  # See q_format_batches
+    outcomes, error = batch_outcomes(batch)
+    name = parameter_name(*parameters)
+    assert name in outcomes, f"Batch {batch} of {Q_FORMAT_BATCHES} reported no outcomes: {error}"
+    assert not outcomes[name], f"{name}: {outcomes[name]}"
+
+if __name__ == "__main__":
+    sys.exit(runner.main([batch_simulator_args(batch) for batch in range(Q_FORMAT_BATCHES)]
+                         or [simulator_args(*parameters) for parameters in Q_FORMAT_PARAMETERS],
+                         sweeps={"single": [simulator_args(*parameters) for parameters in Q_FORMAT_PARAMETERS]}))
\ No newline at end of file
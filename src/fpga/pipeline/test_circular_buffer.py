@@ -6,142 +6,75 @@ import cocotb.utils
 import cocotb_test.simulator
 import pytest
 import random
-import queue
+import itertools
+import json
 import logging
+import math
 import os
+import sys
+import time
 from enum import Enum
 from functools import partial
 
-class TB(object):
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from tbkit import runner, results
+from tbkit.axis import AxisTB
+from tbkit.capture import dump_on_failure
+from tbkit.coverage import INPUT_STALL_BINS, until_covered
+from tbkit.driver import AxisStreamDriver
+from tbkit.metrics import LatencyTracker
+from tbkit.scoreboard import AxisScoreboard
+from tbkit.stimulus import iter_random_frames
+
+SOAK_FRAMES = int(os.getenv("SOAK_FRAMES", 0))  # Frames streamed by the soak test, 0 skips it
+SCALING_POINT = json.loads(os.getenv("SCALING_POINT", "null"))  # Parameters of the scaling sweep, see scaling_configurations
+COVERAGE_FRAMES = int(os.getenv("COVERAGE_FRAMES", 0))  # Bound of the opt-in coverage-driven test if coverage never saturates, 0 skips it
+
+class TB(AxisTB):
+    coverage_exclude = INPUT_STALL_BINS  # The buffer overwrites instead of stalling its input
+
     def __init__(self, dut, clk_period_ns=10):
-        self.dut = dut
-    
-        self.width_bytes = len(dut.s_axis_tdata.value) // 8
+        super().__init__(dut, clk_period_ns)
+
         self.buffer_size = dut.BUFFER_SIZE.value
         self.tid_width_bits = dut.TID_WIDTH.value
 
-        self.input_throughput = 1.0
-        self.output_throughput = 1.0
-
-        self.log = logging.getLogger("cocotb.tb")
-        self.log.setLevel(logging.INFO)
-        self.clk_period_ns = clk_period_ns
-
-        cocotb.start_soon(Clock(dut.aclk, self.clk_period_ns, units="ns").start())
-
-        self.source = AxiStreamSource(AxiStreamBus.from_prefix(dut, "s_axis"), dut.aclk, dut.aresetn, reset_active_level=False)
-        self.sink = AxiStreamSink(AxiStreamBus.from_prefix(dut, "m_axis"), dut.aclk, dut.aresetn, reset_active_level=False)
-
-    def set_input_throughput(self, throughput):
-        """Set the input throughput in frames per second"""
-        self.input_throughput = throughput
-        if throughput < 1.0:
-            self.source.set_pause_generator(iter(lambda: random.random() < 1.0 - throughput, None))
-        else:
-            self.source.set_pause_generator(iter(lambda: False, None))
-        
-    def set_output_throughput(self, throughput):
-        """Set the output throughput in frames per second"""
-        self.output_throughput = throughput
-        if throughput < 1.0:
-            self.sink.set_pause_generator(iter(lambda: random.random() < 1.0 - throughput, None))
-        else:
-            self.sink.set_pause_generator(iter(lambda: False, None))
-
-    async def wait_for_input_handshake(self):
-        event = RisingEdge(self.dut.aclk)
-        while True:
-            await event
-            if self.dut.s_axis_tvalid.value and self.dut.s_axis_tready:
-                return cocotb.utils.get_sim_time(units="ns")
-    
-    async def wait_for_output_handshake(self):
-        event = RisingEdge(self.dut.aclk)
-        while True:
-            await event
-            if self.dut.m_axis_tvalid.value and self.dut.m_axis_tready:
-                return cocotb.utils.get_sim_time(units="ns")
-
-    async def wait_for_input_pause(self):
-        """Wait for the input stream to pause"""
-        event = RisingEdge(self.dut.aclk)
-        while True:
-            await event
-            if not self.dut.s_axis_tvalid.value or not self.dut.s_axis_tready.value:
-                return cocotb.utils.get_sim_time(units="ns")
-    
-    async def wait_for_output_pause(self):
-        """Wait for the output stream to pause"""
-        event = RisingEdge(self.dut.aclk)
-        while True:
-            await event
-            if not self.dut.m_axis_tvalid.value or not self.dut.m_axis_tready.value:
-                return cocotb.utils.get_sim_time(units="ns")
-
-    async def reset(self):
-        self.dut.aresetn.setimmediatevalue(1)
-        await RisingEdge(self.dut.aclk)
-        await RisingEdge(self.dut.aclk)
-        self.dut.aresetn.value = 0
-        await RisingEdge(self.dut.aclk)
-        await RisingEdge(self.dut.aclk)
-        self.dut.aresetn.value = 1
-        await RisingEdge(self.dut.aclk)
-        await RisingEdge(self.dut.aclk)
-
 class PipelineMetrics:
     """Class to store and calculate all performance metrics for the pipeline buffer"""
     def __init__(self, tb : TB):
         self.tb = tb
-        self.time_out_threshold_ns = 1000  # Time threshold in ns for output hold time
+        self.max_frame_beats = 1  # Longest frame sent, scales the receive timeout
         self.frame_count = 0
         self.total_bytes = 0
-        self.frame_queue = queue.Queue()
+        self.scoreboard = AxisScoreboard(tb.width_bytes, log=tb.log)
+        self.latency = LatencyTracker(tb)
     
-    def send_frame(self, frame):
+    def send_frame(self, frame, id):
         """Record a frame sent to the pipeline"""
-        id = random.randint(0, 2**self.tb.tid_width_bits - 1)
-        self.frame_queue.put((frame, id))
+        self.max_frame_beats = max(self.max_frame_beats, math.ceil(len(frame) / self.tb.width_bytes))
+        self.scoreboard.expect(frame, tid=id, context=self.latency.ingress(frame))
         self.tb.source.send_nowait(AxiStreamFrame(frame, tid=id))
 
     async def receive_frame(self, allow_overflow=False):
         """Record a frame received from the pipeline"""
-        if self.frame_queue.empty():
+        if self.scoreboard.empty():
             raise RuntimeError("Received frame without a corresponding sent frame")
-        await self.tb.sink.wait(self.time_out_threshold_ns, "ns")
-        frame = await self.tb.sink.recv()
+        await self.tb.wait_sink(self.max_frame_beats)
+        frame = await self.tb.sink.recv(compact=False)
         self.frame_count += 1
         self.total_bytes += len(frame)
-        [exp_data, exp_id] = self.frame_queue.get()
-        if exp_data != frame.tdata:
-            if allow_overflow:
-                if len(exp_data) > len(frame.tdata):
-                    self.tb.log.info(f"Overflow detected: expected {len(exp_data)} bytes, received {len(frame.tdata)} bytes")
-                exp_data = exp_data[:len(frame.tdata) - self.tb.width_bytes]  # Truncate expected data to match received frame size
-                data = frame.tdata[:len(exp_data)]
-                if exp_data != data:
-                    raise ValueError(f"Received frame does not match expected frame:"\
-                                f"{exp_data.hex()} != {data.hex()}")
-            else:
-                raise ValueError(f"Received frame does not match expected frame:"\
-                                f"{exp_data.hex()} != {frame.tdata.hex()}")
-        
-        if type(frame.tid) is list:
-            for id in frame.tid:
-                if id != exp_id:
-                    raise ValueError(f"Received frame ID {id} does not match expected ID {exp_id}")
-        else:
-            if frame.tid != exp_id:
-                raise ValueError(f"Received frame ID {frame.tid} does not match expected ID {exp_id}")
-
-
-def generate_random_frames(num=1, size=1, width_bytes=4):
-    """Generate a list of random frames with the specified size and width in bytes"""
-    return [bytes(random.getrandbits(8) for _ in range(size * width_bytes)) for _ in range(num)]
+        expected = self.scoreboard.check(frame, allow_truncation=allow_overflow)
+        self.latency.egress(frame, expected.context)
+
 
+def random_stimulus(tb, num, size):
+    """Random frames paired with random IDs, generated lazily so a replayed trace skips them"""
+    for frame in iter_random_frames(num=num, size=size, width_bytes=tb.width_bytes):
+        yield frame, random.randint(0, 2**tb.tid_width_bits - 1)
 
 
 @cocotb.test()
+@dump_on_failure
 async def run_test_continuous(dut):
     tb = TB(dut)
     metrics = PipelineMetrics(tb)
@@ -153,18 +86,18 @@ async def run_test_continuous(dut):
     tb.set_input_throughput(1.0)
     tb.set_output_throughput(1.0)
 
-    # Generate random frames
-    frames = generate_random_frames(num=100, size=tb.buffer_size, width_bytes=tb.width_bytes)
-
-    # Send frames to the pipeline
-    for frame in frames:
-        metrics.send_frame(frame)
+    # Send random frames to the pipeline
+    for frame, id in tb.stimulus(random_stimulus(tb, num=100, size=tb.buffer_size)):
+        metrics.send_frame(frame, id)
 
     # Receive frames from the pipeline
-    for _ in range(len(frames)):
+    while not metrics.scoreboard.empty():
         await metrics.receive_frame(False)
 
+    metrics.latency.log_summary(tb.log)
+
 @cocotb.test()
+@dump_on_failure
 async def run_test_small_frames(dut):
     tb = TB(dut)
     metrics = PipelineMetrics(tb)
@@ -176,19 +109,17 @@ async def run_test_small_frames(dut):
     tb.set_input_throughput(1.0)
     tb.set_output_throughput(1.0)
 
-    # Generate random frames
     for _ in range(10):
-        frames = generate_random_frames(num=10, size=random.randint(2, tb.buffer_size), width_bytes=tb.width_bytes)
-
-        # Send frames to the pipeline
-        for frame in frames:
-            metrics.send_frame(frame)
+        # Send random frames to the pipeline
+        for frame, id in tb.stimulus(random_stimulus(tb, num=10, size=random.randint(2, tb.buffer_size))):
+            metrics.send_frame(frame, id)
 
         # Receive frames from the pipeline
-        for _ in range(len(frames)):
+        while not metrics.scoreboard.empty():
             await metrics.receive_frame(False)
 
 @cocotb.test()
+@dump_on_failure
 async def run_test_signal_cycle_frames(dut):
     tb = TB(dut)
     metrics = PipelineMetrics(tb)
@@ -200,35 +131,30 @@ async def run_test_signal_cycle_frames(dut):
     tb.set_input_throughput(1.0)
     tb.set_output_throughput(1.0)
 
-    send_frame_num = 1000
-
-    # Generate random frames
-    frames = generate_random_frames(num=send_frame_num, size=1, width_bytes=tb.width_bytes)
+    # The buffer drops frames, so frames are matched by ID and only checked for ID consistency
+    scoreboard = AxisScoreboard(tb.width_bytes, lossy=True, check_data=False)
+    latency = LatencyTracker(tb)
 
-    for frame in frames:
-        id = random.randint(0, 2**tb.tid_width_bits - 1)
+    for frame, id in tb.stimulus(random_stimulus(tb, num=1000, size=1)):
+        scoreboard.expect(frame, tid=id, context=latency.ingress(frame))
         tb.source.send_nowait(AxiStreamFrame(frame, tid=id))
 
-    await tb.sink.wait(1000, "ns")
-
+    # Receive frames until the buffer is empty, the dropped frames never come
     recv_frame_num = 0
 
-    while True:
-        await tb.sink.wait(1000, "ns")
-        if tb.sink.empty():
-            tb.log.info("No more frames to receive, exiting")
-            break
-        frame = await tb.sink.recv()
+    async for frame in tb.drain(lossy=True):
         recv_frame_num += 1
-        if type(frame.tid) is list:
-            for id in frame.tid:
-                if id != frame.tid[0]:
-                    raise ValueError(f"Received frame ID {id} does not the same ID {frame.tid[0]}")
+        expected = scoreboard.check(frame)
+        latency.egress(frame, expected.context)
+    tb.log.info("No more frames to receive, exiting")
 
-    tb.log.info(f"Sent {send_frame_num} frames, received {recv_frame_num} frames")
-    tb.log.info(f"Loss Rate: {(send_frame_num - recv_frame_num) / send_frame_num * 100}%")
+    tb.log.info(f"Sent {scoreboard.sent} frames, received {recv_frame_num} frames")
+    tb.log.info(f"Loss Rate: {(scoreboard.sent - recv_frame_num) / scoreboard.sent * 100}%")
+    scoreboard.log_summary(tb.log)
+    latency.log_summary(tb.log)
 
 @cocotb.test()
+@dump_on_failure
 async def run_test_overflow(dut):
     tb = TB(dut)
     metrics = PipelineMetrics(tb)
@@ -240,19 +166,17 @@ async def run_test_overflow(dut):
     tb.set_input_throughput(1.0)
     tb.set_output_throughput(1.0)
 
-    # Generate random frames
     for _ in range(10):
-        frames = generate_random_frames(num=10, size=random.randint(1, 5*tb.buffer_size), width_bytes=tb.width_bytes)
-
-        # Send frames to the pipeline
-        for frame in frames:
-            metrics.send_frame(frame)
+        # Send random frames to the pipeline
+        for frame, id in tb.stimulus(random_stimulus(tb, num=10, size=random.randint(1, 5*tb.buffer_size))):
+            metrics.send_frame(frame, id)
 
         # Receive frames from the pipeline
-        for _ in range(len(frames)):
+        while not metrics.scoreboard.empty():
             await metrics.receive_frame(True)
 
 @cocotb.test()
+@dump_on_failure
 async def run_test_pause(dut):
     tb = TB(dut)
 
@@ -263,36 +187,147 @@ async def run_test_pause(dut):
     tb.set_input_throughput(0.8)
     tb.set_output_throughput(0.3)
 
-    send_frame_num = 1000
-
-    # Generate random frames
-    frames = generate_random_frames(num=send_frame_num, size=tb.buffer_size, width_bytes=tb.width_bytes)
+    # The buffer drops frames, so frames are matched by ID and only checked for ID consistency
+    scoreboard = AxisScoreboard(tb.width_bytes, lossy=True, check_data=False)
+    latency = LatencyTracker(tb)
 
-    for frame in frames:
-        id = random.randint(0, 2**tb.tid_width_bits - 1)
+    for frame, id in tb.stimulus(random_stimulus(tb, num=1000, size=tb.buffer_size)):
+        scoreboard.expect(frame, tid=id, context=latency.ingress(frame))
         tb.source.send_nowait(AxiStreamFrame(frame, tid=id))
 
-    await tb.sink.wait(1000, "ns")
+    # Receive frames until the buffer is empty, the dropped frames never come
+    recv_frame_num = 0
+
+    async for frame in tb.drain(lossy=True):
+        recv_frame_num += 1
+        expected = scoreboard.check(frame)
+        latency.egress(frame, expected.context)
+    tb.log.info("No more frames to receive, exiting")
+
+    tb.log.info(f"Sent {scoreboard.sent} frames, received {recv_frame_num} frames")
+    tb.log.info(f"Loss Rate: {(scoreboard.sent - recv_frame_num) / scoreboard.sent * 100}%")
+    scoreboard.log_summary(tb.log)
+    latency.log_summary(tb.log)
+
+@cocotb.test(skip=not SOAK_FRAMES)
+@dump_on_failure
+async def run_test_soak(dut):
+    """Stream SOAK_FRAMES frames with a bounded number of frames in flight"""
+    tb = TB(dut)
+    scoreboard = AxisScoreboard(tb.width_bytes)
+    latency = LatencyTracker(tb)
+
+    await tb.reset()
+
+    frames = iter_random_frames(num=SOAK_FRAMES, size=tb.buffer_size, width_bytes=tb.width_bytes)
+    driver = AxisStreamDriver(tb, scoreboard, frames, max_in_flight=16, latency=latency, tid=lambda: random.randint(0, 2**tb.tid_width_bits - 1))
+    await driver.run()
+
+    end_time = tb.output_monitor.last_handshake() + tb.clk_period_ns
+    output_throughput_MBs, output_utilization = tb.throughput(tb.output_monitor, 0, end_time)
+
+    tb.log.info(f"==== Soak Test Results ====")
+    tb.log.info(f"Total Time: {end_time} ns")
+    tb.log.info(f"Total Frames Processed: {driver.frame_count}")
+    tb.log.info(f"Total Bytes Processed: {driver.total_bytes}")
+    tb.log.info(f"Output Throughput: {output_throughput_MBs:.2f} MB/s")
+    tb.log.info(f"Output Utilization: {output_utilization:.2f}%")
+    scoreboard.log_summary(tb.log)
+    latency.log_summary(tb.log)
+    tb.log.info(f"==============================================")
+
+@cocotb.test(skip=not COVERAGE_FRAMES)
+@dump_on_failure
+async def run_test_coverage(dut):
+    """Stream random frames under random pauses until every coverage bin is saturated"""
+    tb = TB(dut)
+
+    # The buffer drops frames, so frames are matched by ID and only checked for ID consistency
+    scoreboard = AxisScoreboard(tb.width_bytes, lossy=True, check_data=False)
+
+    await tb.reset()
+
+    tb.set_input_throughput(0.8)
+    tb.set_output_throughput(0.5)
+
+    # Dropped frames never leave the scoreboard, so the source queue bounds the frames in flight instead
+    tb.source.queue_occupancy_limit_frames = 4
+    stimulus = until_covered(tb.stimulus(random_stimulus(tb, num=COVERAGE_FRAMES, size=tb.buffer_size)), tb.coverage, tb.log)
+
+    async def producer():
+        for frame, id in stimulus:
+            scoreboard.expect(frame, tid=id)
+            await tb.source.send(AxiStreamFrame(frame, tid=id))
+
+    producer_task = cocotb.start_soon(producer())
 
     recv_frame_num = 0
 
-    while True:
-        await tb.sink.wait(1000, "ns")
-        if tb.sink.empty():
-            tb.log.info("No more frames to receive, exiting")
-            break
-        frame = await tb.sink.recv()
+    async for frame in tb.drain(lossy=True):
         recv_frame_num += 1
-        if type(frame.tid) is list:
-            for id in frame.tid:
-                if id != frame.tid[0]:
-                    raise ValueError(f"Received frame ID {id} does not the same ID {frame.tid[0]}")
+        scoreboard.check(frame)
 
-    tb.log.info(f"Sent {send_frame_num} frames, received {recv_frame_num} frames")
-    tb.log.info(f"Loss Rate: {(send_frame_num - recv_frame_num) / send_frame_num * 100}%")
+    await producer_task
 
-def test_circular_buffer():
-    """Run the test suite for the circular buffer"""
+    tb.log.info(f"Sent {scoreboard.sent} frames, received {recv_frame_num} frames")
+    if tb.coverage is not None:
+        tb.coverage.log_summary(tb.log)
+        results.record("Coverage", dict(tb.coverage.metrics(), frames=scoreboard.sent))
+        if not tb.coverage.covered:
+            tb.log.warning(f"Coverage below goal after {scoreboard.sent} frames: {', '.join(tb.coverage.missing())}")
+
+@cocotb.test(skip=SCALING_POINT is None)
+@dump_on_failure
+async def run_test_scaling(dut):
+    """Full-rate throughput with frames filling the buffer, at the parameters of a scaling sweep point"""
+    tb = TB(dut)
+    metrics = PipelineMetrics(tb)
+
+    await tb.reset()
+
+    tb.set_input_throughput(1.0)
+    tb.set_output_throughput(1.0)
+
+    wall_start_s = time.perf_counter()
+    sim_start_ns = cocotb.utils.get_sim_time("ns")
+
+    for frame, id in tb.stimulus(random_stimulus(tb, num=16, size=tb.buffer_size)):
+        metrics.send_frame(frame, id)
+
+    input_start_time = await tb.wait_for_input_handshake()
+    while not metrics.scoreboard.empty():
+        await metrics.receive_frame(False)
+    input_end_time = tb.input_monitor.last_handshake() + tb.clk_period_ns
+    output_end_time = tb.output_monitor.last_handshake() + tb.clk_period_ns
+
+    wall_time_s = time.perf_counter() - wall_start_s
+    sim_cycles_per_s = (cocotb.utils.get_sim_time("ns") - sim_start_ns) / tb.clk_period_ns / wall_time_s
+
+    input_throughput_MBs, input_utilization = tb.throughput(tb.input_monitor, input_start_time, input_end_time)
+    output_throughput_MBs, output_utilization = tb.throughput(tb.output_monitor, input_start_time, output_end_time)
+
+    tb.log.info(f"==== Scaling Test Results ====")
+    tb.log.info(f"Total Time: {output_end_time - input_start_time} ns")
+    tb.log.info(f"Input Throughput: {input_throughput_MBs:.2f} MB/s")
+    tb.log.info(f"Output Throughput: {output_throughput_MBs:.2f} MB/s")
+    tb.log.info(f"Output Utilization: {output_utilization:.2f}%")
+    metrics.latency.log_summary(tb.log)
+    tb.log.info(f"Testbench Overhead: {wall_time_s:.2f} s wall time, {sim_cycles_per_s:.0f} cycles/s")
+    tb.log.info(f"==============================================")
+
+    results.record("Scaling", {
+        "total_time_ns": output_end_time - input_start_time,
+        "input_throughput_MBs": input_throughput_MBs,
+        "input_utilization": input_utilization,
+        "output_throughput_MBs": output_throughput_MBs,
+        "output_utilization": output_utilization,
+        **results.latency_metrics(metrics.latency.summary()),
+        "wall_time_s": wall_time_s,
+        "sim_cycles_per_s": sim_cycles_per_s,
+    }, point=SCALING_POINT)
+
+def simulator_args(parameters=None):
+    """Arguments of `cocotb_test.simulator.run` for the circular buffer"""
     dut = "axis_circular_buffer"
     module = os.path.splitext(os.path.basename(__file__))[0]
     toplevel = dut
@@ -301,8 +336,42 @@ def test_circular_buffer():
         os.path.join(os.path.dirname(__file__), f"{dut}.v"),
     ]
 
-    cocotb_test.simulator.run(
+    return dict(
         verilog_sources=verilog_sources,
         toplevel=toplevel,
         module=module,
-    )
\ No newline at end of file
+        parameters=parameters,
+    )
+
+SCALING_WIDTHS = [32, 64, 128, 256, 512]
+SCALING_BUFFER_SIZES = [4, 16, 64, 256, 1024]
+
+def scaling_configurations():
+    """One configuration per DATA_WIDTH and BUFFER_SIZE"""
+    configurations = []
+    for width, buffer_size in itertools.product(SCALING_WIDTHS, SCALING_BUFFER_SIZES):
+        point = {"DATA_WIDTH": width, "BUFFER_SIZE": buffer_size}
+        configurations.append(dict(
+            simulator_args(point),
+            testcase="run_test_scaling",
+            extra_env={"SCALING_POINT": json.dumps(point)},
+        ))
+    return configurations
+
+def test_verilator_args(monkeypatch, tmp_path):
+    # Verilator builds come from runner.run, like the other simulators, no simulator required
+    monkeypatch.setenv("SIM", "verilator")
+    monkeypatch.setenv("SIM_BUILD", str(tmp_path))
+    for configuration in [simulator_args()] + scaling_configurations():
+        args = runner.simulation_args(**configuration)
+        assert args["compile_args"][:2] == ["-O3", "-Wno-fatal"] and "--threads" not in args["compile_args"]
+        assert all(os.path.isfile(path) for path in args["verilog_sources"])
+        assert args["parameters"] == configuration["parameters"]  # Passed to Verilator as -G overrides
+
+def test_circular_buffer():
+    """Run the test suite for the circular buffer"""
+    runner.run(**simulator_args())
+
+if __name__ == "__main__":
+    sys.exit(runner.main([simulator_args()], sweeps={"scaling": scaling_configurations()},
+                         surface_metrics=("output_utilization", "latency_p50_ns", "sim_cycles_per_s")))
\ No newline at end of file
@@ -6,142 +6,149 @@ import cocotb.utils
 import cocotb_test.simulator
 import pytest
 import random
-import queue
+import itertools
+import json
 import logging
+import math
 import os
+import sys
+from array import array
 from enum import Enum
 from functools import partial
-
-class TB(object):
+from types import SimpleNamespace
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from tbkit import runner, results, models
+from tbkit.axis import AxisTB, AxisHandshakeMonitor
+from tbkit.capture import dump_on_failure
+from tbkit.coverage import until_covered
+from tbkit.driver import AxisStreamDriver
+from tbkit.metrics import LatencyTracker
+from tbkit.scoreboard import AxisScoreboard
+
+SWEEP_POINT = json.loads(os.getenv("SWEEP_POINT", "null"))  # Gate ratio of the gating sweep, see sweep_configurations
+CHARACTERIZATION_POINT = json.loads(os.getenv("CHARACTERIZATION_POINT", "null"))  # Duty and burst of the characterization, see characterization_configurations
+COVERAGE_FRAMES = int(os.getenv("COVERAGE_FRAMES", 0))  # Bound of the opt-in coverage-driven test if coverage never saturates, 0 skips it
+
+class TB(AxisTB):
     def __init__(self, dut, clk_period_ns=10):
-        self.dut = dut
-    
-        self.width_bytes = len(dut.s_axis_tdata.value) // 8
-
-        self.input_throughput = 1.0
-        self.output_throughput = 1.0
-
-        self.log = logging.getLogger("cocotb.tb")
-        self.log.setLevel(logging.INFO)
-        self.clk_period_ns = clk_period_ns
-
-        cocotb.start_soon(Clock(dut.aclk, self.clk_period_ns, units="ns").start())
-
-        self.source = AxiStreamSource(AxiStreamBus.from_prefix(dut, "s_axis"), dut.aclk, dut.aresetn, reset_active_level=False)
-        self.sink = AxiStreamSink(AxiStreamBus.from_prefix(dut, "m_axis"), dut.aclk, dut.aresetn, reset_active_level=False)
+        super().__init__(dut, clk_period_ns)
 
+        self.gate_throughput = 1.0
         self.dut.enable.setimmediatevalue(1)
-        self._enable_pause_generator = None
-        self._enable_pause_cr = None
-
-    def set_input_throughput(self, throughput):
-        """Set the input throughput in frames per second"""
-        self.input_throughput = throughput
-        if throughput < 1.0:
-            self.source.set_pause_generator(iter(lambda: random.random() < 1.0 - throughput, None))
-        else:
-            self.source.set_pause_generator(iter(lambda: False, None))
-        
-    def set_output_throughput(self, throughput):
-        """Set the output throughput in frames per second"""
-        self.output_throughput = throughput
-        if throughput < 1.0:
-            self.sink.set_pause_generator(iter(lambda: random.random() < 1.0 - throughput, None))
+        self.gate_edges = [(0, True)]  # (first rising edge sampling it, enable) of each enable change
+
+    def set_gate_throughput(self, throughput, model=None, **kwargs):
+        """Set the fraction of cycles the gate is enabled"""
+        self.gate_throughput = throughput
+        self.set_pauses("enable", self._enable_pause, throughput, model, **kwargs)
+
+    def configured_rate(self):
+        return min(super().configured_rate(), self.gate_throughput)
+
+    def _enable_pause(self, pause):
+        self.dut.enable.value = int(not pause)
+        if self.gate_edges[-1][1] == pause:
+            now = cocotb.utils.get_sim_time(units="ns")
+            self.gate_edges.append(((math.floor(now / self.clk_period_ns) + 1) * self.clk_period_ns, not pause))
+
+def gate_intervals(edges, start, end):
+    """[open, close) intervals of the enable timeline within [start, end)"""
+    intervals = []
+    for (time, enabled), (next_time, _) in zip(edges, edges[1:] + [(end, None)]):
+        low, high = max(time, start), min(next_time, end)
+        if enabled and low < high:
+            intervals.append((low, high))
+    return intervals
+
+def gate_metrics(tb, frame_beats, start, end):
+    """Cost of the gate over [start, end), with the source and sink never paused
+
+    The output could then carry one beat per enabled cycle, so the ideal is
+    the enable duty times the link rate and every enabled cycle without an
+    output beat is a bubble of the gate.
+    """
+    clk = tb.clk_period_ns
+    monitor = tb.output_monitor
+    intervals = gate_intervals(tb.gate_edges, start, end)
+    transitions = [(time, enabled) for time, enabled in tb.gate_edges[1:] if start < time < end]
+
+    window_cycles = round((end - start) / clk)
+    enabled_cycles = sum(round((high - low) / clk) for low, high in intervals)
+    beats = monitor.handshakes(start, end)
+    enabled_beats = sum(monitor.handshakes(low, high) for low, high in intervals)
+
+    # Gate response: cycles from the first enabled cycle to the first output beat of each opening
+    responses = []
+    missed = 0
+    for low, high in intervals:
+        if low == start:
+            continue
+        time = monitor.beat_time(monitor.beats(low - clk))
+        if time is not None and time < high:
+            responses.append(round((time - low) / clk))
         else:
-            self.sink.set_pause_generator(iter(lambda: False, None))
-
-    def set_gate_throughput(self, throughput):
-        """Set the gate throughput in frames per second"""
-        if self._enable_pause_cr is not None:
-            self._enable_pause_cr.kill()
-            self._enable_pause_cr = None
-
-        self._enable_pause_generator = iter(lambda: random.random() < 1.0 - throughput, None)
-        self._enable_pause_cr = cocotb.start_soon(self._enable_pause())
-
-    async def _enable_pause(self):
-        event = RisingEdge(self.dut.aclk)
-
-        for val in self._enable_pause_generator:
-            await event
-            self.dut.enable.value = val
-
-
-    async def wait_for_input_handshake(self):
-        event = RisingEdge(self.dut.aclk)
-        while True:
-            await event
-            if self.dut.s_axis_tvalid.value and self.dut.s_axis_tready:
-                return cocotb.utils.get_sim_time(units="ns")
-    
-    async def wait_for_output_handshake(self):
-        event = RisingEdge(self.dut.aclk)
-        while True:
-            await event
-            if self.dut.m_axis_tvalid.value and self.dut.m_axis_tready:
-                return cocotb.utils.get_sim_time(units="ns")
-
-    async def wait_for_input_pause(self):
-        """Wait for the input stream to pause"""
-        event = RisingEdge(self.dut.aclk)
-        while True:
-            await event
-            if not self.dut.s_axis_tvalid.value or not self.dut.s_axis_tready.value:
-                return cocotb.utils.get_sim_time(units="ns")
-    
-    async def wait_for_output_pause(self):
-        """Wait for the output stream to pause"""
-        event = RisingEdge(self.dut.aclk)
-        while True:
-            await event
-            if not self.dut.m_axis_tvalid.value or not self.dut.m_axis_tready.value:
-                return cocotb.utils.get_sim_time(units="ns")
-
-    async def reset(self):
-        self.dut.aresetn.setimmediatevalue(1)
-        await RisingEdge(self.dut.aclk)
-        await RisingEdge(self.dut.aclk)
-        self.dut.aresetn.value = 0
-        await RisingEdge(self.dut.aclk)
-        await RisingEdge(self.dut.aclk)
-        self.dut.aresetn.value = 1
-        await RisingEdge(self.dut.aclk)
-        await RisingEdge(self.dut.aclk)
+            missed += 1
+
+    # Frames held at a boundary: the gate closed with the output inside a frame
+    boundaries = set(itertools.accumulate(frame_beats))
+    held = sum(1 for time, enabled in transitions if not enabled and monitor.beats(time) not in boundaries)
+
+    duty = enabled_cycles / window_cycles if window_cycles else 0.0
+    link_MBs = tb.width_bytes / 2**20 / (clk / 1e9)
+    lost = enabled_cycles - beats
+    return {
+        "gate_duty": duty,
+        "ideal_throughput_MBs": duty * link_MBs,
+        "gate_efficiency": beats / enabled_cycles * 100 if enabled_cycles else 0.0,
+        "gate_transitions": len(transitions),
+        "gate_bubbles": enabled_cycles - enabled_beats,
+        "cycles_lost": lost,
+        "cycles_lost_per_transition": lost / len(transitions) if transitions else 0.0,
+        "gate_response_cycles_mean": sum(responses) / len(responses) if responses else 0.0,
+        "gate_response_cycles_max": max(responses, default=0),
+        "gate_openings_missed": missed,
+        "frames_held": held,
+    }
+
+def gate_pattern(duty, burst):
+    """Throughput and period of a duty_cycle enable with bursts of `burst` cycles, the nearest to `duty`
+
+    A burst needs at least one off cycle after it, so short bursts cannot
+    reach high duties, e.g. bursts of one cycle are at most half enabled.
+    """
+    off = max(1, round(burst * (1.0 - duty) / duty))
+    return burst / (burst + off), burst + off
 
 class PipelineMetrics:
     """Class to store and calculate all performance metrics for the pipeline buffer"""
     def __init__(self, tb : TB):
         self.tb = tb
-        self.time_out_threshold_ns = 1000  # Time threshold in ns for output hold time
+        self.max_frame_beats = 1  # Longest frame sent, scales the receive timeout
         self.frame_count = 0
         self.total_bytes = 0
-        self.frame_queue = queue.Queue()
+        self.scoreboard = AxisScoreboard(tb.width_bytes)
+        self.latency = LatencyTracker(tb)
     
     def send_frame(self, frame):
         """Record a frame sent to the pipeline"""
-        self.frame_queue.put(frame)
+        self.max_frame_beats = max(self.max_frame_beats, math.ceil(len(frame) / self.tb.width_bytes))
+        self.scoreboard.expect(frame, context=self.latency.ingress(frame))
         self.tb.source.send_nowait(AxiStreamFrame(frame))
 
     async def receive_frame(self):
         """Record a frame received from the pipeline"""
-        if self.frame_queue.empty():
+        if self.scoreboard.empty():
             raise RuntimeError("Received frame without a corresponding sent frame")
-        await self.tb.sink.wait(self.time_out_threshold_ns, "ns")
-        if self.tb.sink.empty():
-            raise RuntimeError("Timeout waiting for frame from sink")
+        await self.tb.wait_sink(self.max_frame_beats)
         frame = await self.tb.sink.recv()
         self.frame_count += 1
         self.total_bytes += len(frame)
-        expected = self.frame_queue.get()
-        if expected != frame.tdata:
-            raise ValueError(f"Received frame does not match expected frame:"\
-                              f"{expected.hex()} != {frame.tdata.hex()}")
-
+        expected = self.scoreboard.check(frame)
+        self.latency.egress(frame, expected.context)
 
-def generate_random_frames(num=1, size=1, width_bytes=4):
-    """Generate a list of random frames with the specified size and width in bytes"""
-    return [bytes(random.getrandbits(8) for _ in range(size * width_bytes)) for _ in range(num)]
 
+@dump_on_failure
 async def enable_protocol_checker(dut):
     valid_dly = 0
     enable_dly = 0
@@ -155,7 +162,7 @@ async def enable_protocol_checker(dut):
         enable_dly = dut.enable.value
 
 
-async def throughput_test(dut, name, input_throughput, gate_throughput, output_throughput):
+async def throughput_test(dut, name, input_throughput, gate_throughput, output_throughput, point=None):
     """Run a throughput test with specified input and output throughput"""
     tb = TB(dut)
 
@@ -163,9 +170,10 @@ async def throughput_test(dut, name, input_throughput, gate_throughput, output_t
 
     await tb.reset()
 
-    cocotb.start_soon(enable_protocol_checker(dut))
+    if tb.protocol is None:
+        cocotb.start_soon(enable_protocol_checker(dut))  # Checked in HDL otherwise
 
-    frames = generate_random_frames(num=64, size=256, width_bytes=tb.width_bytes)
+    frames = list(tb.random_frames(num=64, size=256))
 
     for frame in frames:
         metrics.send_frame(frame)
@@ -181,25 +189,18 @@ async def throughput_test(dut, name, input_throughput, gate_throughput, output_t
     tb.log.info(f"Output Start at {output_start_time} ns")
 
     await tb.source.wait()
-    input_end_time = cocotb.utils.get_sim_time(units="ns")
+    input_end_time = tb.input_monitor.last_handshake() + tb.clk_period_ns
     tb.log.info(f"Input End at {input_end_time} ns")
 
-    while not metrics.frame_queue.empty():
+    while not metrics.scoreboard.empty():
         await metrics.receive_frame()
-    output_end_time = cocotb.utils.get_sim_time(units="ns")
+    output_end_time = tb.output_monitor.last_handshake() + tb.clk_period_ns
     tb.log.info(f"Output End at {output_end_time} ns")
 
     total_time_ns = output_end_time - input_start_time
 
-    ideal_throughput_MBs = (tb.width_bytes / 2**20) / (tb.clk_period_ns / 1e9)
-
-    input_total_time_ns = input_end_time - input_start_time
-    input_throughput_MBs = (metrics.total_bytes / 2**20) / (input_total_time_ns / 1e9)
-    input_utilization = input_throughput_MBs / ideal_throughput_MBs * 100
-
-    output_total_time_ns = output_end_time - output_start_time
-    output_throughput_MBs = (metrics.total_bytes / 2**20) / (output_total_time_ns / 1e9)
-    output_utilization = output_throughput_MBs / ideal_throughput_MBs * 100
+    input_throughput_MBs, input_utilization = tb.throughput(tb.input_monitor, input_start_time, input_end_time)
+    output_throughput_MBs, output_utilization = tb.throughput(tb.output_monitor, output_start_time, output_end_time)
 
     tb.log.info(f"==== {name} Throughput Test Results ====")
     tb.log.info(f"Total Time: {total_time_ns} ns")
@@ -209,26 +210,139 @@ async def throughput_test(dut, name, input_throughput, gate_throughput, output_t
     tb.log.info(f"Input Utilization: {input_utilization:.2f}%")
     tb.log.info(f"Output Throughput: {output_throughput_MBs:.2f} MB/s")
     tb.log.info(f"Output Utilization: {output_utilization:.2f}%")
+    metrics.latency.log_summary(tb.log)
     tb.log.info(f"==============================================")
 
+    measured = {
+        "total_time_ns": total_time_ns,
+        "input_throughput_MBs": input_throughput_MBs,
+        "input_utilization": input_utilization,
+        "output_throughput_MBs": output_throughput_MBs,
+        "output_utilization": output_utilization,
+        **results.latency_metrics(metrics.latency.summary()),
+    }
+    results.record(name, measured, point=point)
+
+    # Differential reference: the transaction-level model under the same kind of pauses
+    if dut._name in models.MODELS:
+        frame_sizes = [math.ceil(len(frame) / tb.width_bytes) for frame in frames]
+        estimated = models.estimate(dut._name, frame_sizes, input_throughput, output_throughput, gate_throughput,
+                                    model=tb.pause_model, width_bytes=tb.width_bytes, clk_period_ns=tb.clk_period_ns)
+        models.log_comparison(tb.log, measured, estimated)
+
 @cocotb.test()
+@dump_on_failure
 async def run_test_continuous_throughput(dut):
     await throughput_test(dut, "Continuous", 1.0, 0.5, 1.0)
     
 @cocotb.test()
+@dump_on_failure
 async def run_test_input_limited_throughput(dut):
     await throughput_test(dut, "Input Limited", 0.7, 0.5, 1.0)
 
 @cocotb.test()
+@dump_on_failure
 async def run_test_output_limited_throughput(dut):
     await throughput_test(dut, "Output Limited", 1.0, 0.5, 0.7)
 
 @cocotb.test()
+@dump_on_failure
 async def run_test_balanced_limited_throughput(dut):
     await throughput_test(dut, "Balanced Limited", 0.7, 0.5, 0.7)
-    
-def test_pipeline_throughput():
-    """Run throughput tests for different pipeline modules"""
+
+@cocotb.test(skip=SWEEP_POINT is None)
+@dump_on_failure
+async def run_test_gate_sweep(dut):
+    gate_throughput = SWEEP_POINT["gate_throughput"]
+    await throughput_test(dut, f"Gate Sweep {gate_throughput:.2f}", 1.0, gate_throughput, 1.0, point=SWEEP_POINT)
+
+@cocotb.test(skip=CHARACTERIZATION_POINT is None)
+@dump_on_failure
+async def run_test_gate_characterization(dut):
+    """Efficiency of the gate under periodic enable bursts, input and output at full throughput"""
+    duty, burst = CHARACTERIZATION_POINT["gate_duty"], CHARACTERIZATION_POINT["gate_burst"]
+    name = f"Gate Characterization {duty:.2f} x {burst}"
+    tb = TB(dut)
+
+    metrics = PipelineMetrics(tb)
+
+    await tb.reset()
+
+    if tb.protocol is None:
+        cocotb.start_soon(enable_protocol_checker(dut))  # Checked in HDL otherwise
+
+    frames = list(tb.random_frames(num=64, size=256))
+
+    for frame in frames:
+        metrics.send_frame(frame)
+
+    tb.set_input_throughput(1.0)
+    tb.set_output_throughput(1.0)
+    gate_throughput, period = gate_pattern(duty, burst)
+    if not math.isclose(gate_throughput, duty):
+        tb.log.warning(f"Bursts of {burst} cycles cannot reach duty {duty}, running at {gate_throughput:.3f}")
+    tb.set_gate_throughput(gate_throughput, model="duty_cycle", period=period)
+
+    output_start_time = await tb.wait_for_output_handshake()
+
+    while not metrics.scoreboard.empty():
+        await metrics.receive_frame()
+    output_end_time = tb.output_monitor.last_handshake() + tb.clk_period_ns
+
+    output_throughput_MBs, output_utilization = tb.throughput(tb.output_monitor, output_start_time, output_end_time)
+    frame_beats = [math.ceil(len(frame) / tb.width_bytes) for frame in frames]
+    gate = gate_metrics(tb, frame_beats, output_start_time, output_end_time)
+
+    tb.log.info(f"==== {name} Results ====")
+    tb.log.info(f"Enable: {burst} cycles on, {period - burst} off (duty {gate['gate_duty']:.3f})")
+    tb.log.info(f"Output Throughput: {output_throughput_MBs:.2f} MB/s of {gate['ideal_throughput_MBs']:.2f} MB/s ideal")
+    tb.log.info(f"Gate Efficiency: {gate['gate_efficiency']:.2f}%")
+    tb.log.info(f"Gate Transitions: {gate['gate_transitions']}, Bubbles: {gate['gate_bubbles']}, "
+                f"Cycles Lost per Transition: {gate['cycles_lost_per_transition']:.2f}")
+    tb.log.info(f"Gate Response: {gate['gate_response_cycles_mean']:.2f} cycles mean, "
+                f"{gate['gate_response_cycles_max']} max, {gate['gate_openings_missed']} openings without output")
+    tb.log.info(f"Frames Held at a Gate Boundary: {gate['frames_held']} of {len(frames)}")
+    tb.log.info(f"==============================================")
+
+    results.record(name, {
+        "output_throughput_MBs": output_throughput_MBs,
+        "output_utilization": output_utilization,
+        **gate,
+    }, point=CHARACTERIZATION_POINT)
+
+@cocotb.test(skip=not COVERAGE_FRAMES)
+@dump_on_failure
+async def run_test_coverage(dut):
+    """Stream random frames under random pauses and gating until every coverage bin is saturated"""
+    tb = TB(dut)
+    scoreboard = AxisScoreboard(tb.width_bytes)
+
+    await tb.reset()
+
+    if tb.protocol is None:
+        cocotb.start_soon(enable_protocol_checker(dut))  # Checked in HDL otherwise
+
+    tb.set_input_throughput(0.8)
+    tb.set_output_throughput(0.5)
+    tb.set_gate_throughput(0.5)
+
+    frames = until_covered(tb.random_frames(num=COVERAGE_FRAMES, size=16), tb.coverage, tb.log)
+    driver = AxisStreamDriver(tb, scoreboard, frames, max_in_flight=16)
+    await driver.run()
+
+    tb.log.info(f"Total Frames Processed: {driver.frame_count}")
+    if tb.coverage is not None:
+        tb.coverage.log_summary(tb.log)
+        results.record("Coverage", dict(tb.coverage.metrics(), frames=driver.frame_count))
+        if not tb.coverage.covered:
+            tb.log.warning(f"Coverage below goal after {driver.frame_count} frames: {', '.join(tb.coverage.missing())}")
+
+GATE_GRID = [0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0]
+GATE_DUTY_GRID = [0.2, 0.25, 0.5, 0.8]
+GATE_BURST_GRID = [1, 2, 4, 8, 16, 64]  # Enabled cycles per burst
+
+def simulator_args():
+    """Arguments of `cocotb_test.simulator.run` for the gating module"""
     dut = "axis_gating"
     module = os.path.splitext(os.path.basename(__file__))[0]
     toplevel = dut
@@ -237,8 +351,94 @@ def test_pipeline_throughput():
         os.path.join(os.path.dirname(__file__), f"{dut}.v"),
     ]
 
-    cocotb_test.simulator.run(
+    return dict(
         verilog_sources=verilog_sources,
         toplevel=toplevel,
         module=module,
-    )
\ No newline at end of file
+    )
+
+def sweep_configurations():
+    """One configuration per gate-enable ratio, input and output at full throughput"""
+    return [dict(
+        simulator_args(),
+        variant=f"gate_{gate_throughput}",
+        testcase="run_test_gate_sweep",
+        extra_env={"SWEEP_POINT": json.dumps({"gate_throughput": gate_throughput})},
+    ) for gate_throughput in GATE_GRID]
+
+def characterization_points():
+    """(duty, burst) points of the grids the enable bursts realize exactly
+
+    Points a burst cannot reach, e.g. duty 0.8 with bursts of one cycle, are
+    dropped instead of being measured at another duty under their label.
+    """
+    return [(duty, burst) for duty in GATE_DUTY_GRID for burst in GATE_BURST_GRID
+            if math.isclose(gate_pattern(duty, burst)[0], duty)]
+
+def characterization_configurations():
+    """One configuration per enable duty cycle and burst length, input and output at full throughput"""
+    return [dict(
+        simulator_args(),
+        variant=f"gate_{duty}x{burst}",
+        testcase="run_test_gate_characterization",
+        extra_env={"CHARACTERIZATION_POINT": json.dumps({"gate_duty": duty, "gate_burst": burst})},
+    ) for duty, burst in characterization_points()]
+
+def test_gate_pattern():
+    assert gate_pattern(0.25, 4) == (0.25, 16)
+    assert gate_pattern(0.8, 1) == (0.5, 2)  # At least one off cycle per burst
+    points = characterization_points()
+    assert (0.8, 1) not in points and (0.8, 2) not in points and (0.8, 4) in points
+    for duty, burst in points:
+        throughput, period = gate_pattern(duty, burst)
+        assert math.isclose(throughput, duty) and round(throughput * period) == burst
+
+def test_gate_metrics():
+    # Enable 4 cycles on, 4 off, output beats in every enabled cycle but the first of each reopening
+    clk = 10
+    edges = [(0, True)]
+    valid = []
+    for cycle in range(80):
+        enabled = cycle % 8 < 4
+        if enabled != edges[-1][1]:
+            edges.append((cycle * clk, enabled))
+        valid.append(enabled and (cycle == 0 or cycle % 8 != 0))
+
+    # Timeline queries only, without starting the monitor coroutine
+    monitor = AxisHandshakeMonitor.__new__(AxisHandshakeMonitor)
+    monitor.clk_period_ns = clk
+    monitor.times = array("d")
+    monitor.states = array("B")
+    monitor._beats_before = array("q")
+    for cycle, beat in enumerate(valid + [False]):
+        state = monitor.HANDSHAKE if beat else monitor.READY
+        if not monitor.states or monitor.states[-1] != state:
+            monitor.times.append(cycle * clk)
+            monitor.states.append(state)
+
+    tb = SimpleNamespace(clk_period_ns=clk, width_bytes=4, output_monitor=monitor, gate_edges=edges)
+    gate = gate_metrics(tb, [10] * 30, 0, 80 * clk)
+    assert gate["gate_duty"] == 0.5 and gate["gate_efficiency"] == 31 / 40 * 100
+    assert (gate["gate_transitions"], gate["gate_bubbles"], gate["cycles_lost"]) == (19, 9, 9)
+    assert (gate["gate_response_cycles_mean"], gate["gate_response_cycles_max"], gate["gate_openings_missed"]) == (1, 1, 0)
+    assert gate["frames_held"] == 9  # Closings after 4, 7, ..., 31 beats, the one after 10 between frames
+
+def test_verilator_args(monkeypatch, tmp_path):
+    # Verilator builds come from runner.run, like the other simulators, no simulator required
+    monkeypatch.setenv("SIM", "verilator")
+    monkeypatch.setenv("VERILATOR_THREADS", "4")
+    monkeypatch.setenv("SIM_BUILD", str(tmp_path))
+    for configuration in [simulator_args()] + sweep_configurations() + characterization_configurations():
+        args = runner.simulation_args(**configuration)
+        assert "--threads" in args["compile_args"] and args["timescale"] == "1ns/1ps"
+        assert all(os.path.isfile(path) for path in args["verilog_sources"])
+        assert args["toplevel"] == "axis_gating" and args.get("extra_env") == configuration.get("extra_env")
+
+def test_pipeline_throughput():
+    """Run throughput tests for different pipeline modules"""
+    runner.run(**simulator_args())
+
+if __name__ == "__main__":
+    sys.exit(runner.main([simulator_args()], sweeps={"gate": sweep_configurations(), "characterization": characterization_configurations()},
+                         surface_metrics=("output_utilization", "latency_p50_ns", "gate_efficiency",
+                                          "gate_response_cycles_mean", "cycles_lost_per_transition")))
\ No newline at end of file
@@ -6,124 +6,70 @@ import cocotb.utils
 import cocotb_test.simulator
 import pytest
 import random
-import queue
+import itertools
+import json
 import logging
+import math
 import os
+import sys
+import time
 from enum import Enum
 from functools import partial
 
-class TB(object):
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from tbkit import runner, results, models
+from tbkit.chain import chain_modules, chain_stages, generate_chain
+from tbkit.axis import AxisTB
+from tbkit.capture import dump_on_failure
+from tbkit.coverage import until_covered
+from tbkit.driver import AxisStreamDriver
+from tbkit.metrics import LatencyTracker
+from tbkit.scoreboard import AxisScoreboard
+from tbkit.stimulus import iter_random_frames
+
+SOAK_FRAMES = int(os.getenv("SOAK_FRAMES", 0))  # Frames streamed by the soak test, 0 skips it
+COVERAGE_FRAMES = int(os.getenv("COVERAGE_FRAMES", 0))  # Bound of the opt-in coverage-driven test if coverage never saturates, 0 skips it
+SWEEP_POINT = json.loads(os.getenv("SWEEP_POINT", "null"))  # Grid point of the throughput sweep, see sweep_configurations
+SCALING_POINT = json.loads(os.getenv("SCALING_POINT", "null"))  # Parameters of the scaling sweep, see scaling_configurations
+CHAIN = json.loads(os.getenv("CHAIN", "null"))  # Modules of a chained DUT, see chain_simulator_args
+
+class TB(AxisTB):
     def __init__(self, dut, clk_period_ns=10):
-        self.dut = dut
-    
-        self.width_bytes = len(dut.s_axis_tdata.value) // 8
-
-        self.input_throughput = 1.0
-        self.output_throughput = 1.0
-
-        self.log = logging.getLogger("cocotb.tb")
-        self.log.setLevel(logging.INFO)
-        self.clk_period_ns = clk_period_ns
-
-        cocotb.start_soon(Clock(dut.aclk, self.clk_period_ns, units="ns").start())
-
-        self.source = AxiStreamSource(AxiStreamBus.from_prefix(dut, "s_axis"), dut.aclk, dut.aresetn, reset_active_level=False)
-        self.sink = AxiStreamSink(AxiStreamBus.from_prefix(dut, "m_axis"), dut.aclk, dut.aresetn, reset_active_level=False)
+        super().__init__(dut, clk_period_ns)
 
         if hasattr(dut, "enable"):
             self.dut.enable.setimmediatevalue(1)
 
-    def set_input_throughput(self, throughput):
-        """Set the input throughput in frames per second"""
-        self.input_throughput = throughput
-        if throughput < 1.0:
-            self.source.set_pause_generator(iter(lambda: random.random() < 1.0 - throughput, None))
-        else:
-            self.source.set_pause_generator(iter(lambda: False, None))
-        
-    def set_output_throughput(self, throughput):
-        """Set the output throughput in frames per second"""
-        self.output_throughput = throughput
-        if throughput < 1.0:
-            self.sink.set_pause_generator(iter(lambda: random.random() < 1.0 - throughput, None))
-        else:
-            self.sink.set_pause_generator(iter(lambda: False, None))
-
-    async def wait_for_input_handshake(self):
-        event = RisingEdge(self.dut.aclk)
-        while True:
-            await event
-            if self.dut.s_axis_tvalid.value and self.dut.s_axis_tready:
-                return cocotb.utils.get_sim_time(units="ns")
-    
-    async def wait_for_output_handshake(self):
-        event = RisingEdge(self.dut.aclk)
-        while True:
-            await event
-            if self.dut.m_axis_tvalid.value and self.dut.m_axis_tready:
-                return cocotb.utils.get_sim_time(units="ns")
-
-    async def wait_for_input_pause(self):
-        """Wait for the input stream to pause"""
-        event = RisingEdge(self.dut.aclk)
-        while True:
-            await event
-            if not self.dut.s_axis_tvalid.value or not self.dut.s_axis_tready.value:
-                return cocotb.utils.get_sim_time(units="ns")
-    
-    async def wait_for_output_pause(self):
-        """Wait for the output stream to pause"""
-        event = RisingEdge(self.dut.aclk)
-        while True:
-            await event
-            if not self.dut.m_axis_tvalid.value or not self.dut.m_axis_tready.value:
-                return cocotb.utils.get_sim_time(units="ns")
-
-    async def reset(self):
-        self.dut.aresetn.setimmediatevalue(1)
-        await RisingEdge(self.dut.aclk)
-        await RisingEdge(self.dut.aclk)
-        self.dut.aresetn.value = 0
-        await RisingEdge(self.dut.aclk)
-        await RisingEdge(self.dut.aclk)
-        self.dut.aresetn.value = 1
-        await RisingEdge(self.dut.aclk)
-        await RisingEdge(self.dut.aclk)
-
 class PipelineMetrics:
     """Class to store and calculate all performance metrics for the pipeline buffer"""
     def __init__(self, tb : TB):
         self.tb = tb
-        self.time_out_threshold_ns = 1000  # Time threshold in ns for output hold time
+        self.max_frame_beats = 1  # Longest frame sent, scales the receive timeout
         self.frame_count = 0
         self.total_bytes = 0
-        self.frame_queue = queue.Queue()
+        self.scoreboard = AxisScoreboard(tb.width_bytes)
+        self.latency = LatencyTracker(tb)
     
     def send_frame(self, frame):
         """Record a frame sent to the pipeline"""
-        self.frame_queue.put(frame)
+        self.max_frame_beats = max(self.max_frame_beats, math.ceil(len(frame) / self.tb.width_bytes))
+        self.scoreboard.expect(frame, context=self.latency.ingress(frame))
         self.tb.source.send_nowait(AxiStreamFrame(frame))
 
     async def receive_frame(self):
         """Record a frame received from the pipeline"""
-        if self.frame_queue.empty():
+        if self.scoreboard.empty():
             raise RuntimeError("Received frame without a corresponding sent frame")
-        await self.tb.sink.wait(self.time_out_threshold_ns, "ns")
+        await self.tb.wait_sink(self.max_frame_beats)
         frame = await self.tb.sink.recv()
         self.frame_count += 1
         self.total_bytes += len(frame)
-        expected = self.frame_queue.get()
-        if expected != frame.tdata:
-            raise ValueError(f"Received frame does not match expected frame:"\
-                              f"{expected.hex()} != {frame.tdata.hex()}")
-
-
-def generate_random_frames(num=1, size=1, width_bytes=4):
-    """Generate a list of random frames with the specified size and width in bytes"""
-    return [bytes(random.getrandbits(8) for _ in range(size * width_bytes)) for _ in range(num)]
+        expected = self.scoreboard.check(frame)
+        self.latency.egress(frame, expected.context)
 
 
 @cocotb.test()
+@dump_on_failure
 async def run_test_startup_and_recovery(dut):
     tb = TB(dut)
 
@@ -131,7 +77,7 @@ async def run_test_startup_and_recovery(dut):
 
     await tb.reset()
 
-    frames = generate_random_frames(num=16, size=256, width_bytes=tb.width_bytes)
+    frames = list(tb.random_frames(num=16, size=256))
 
     for frame in frames:
         metrics.send_frame(frame)
@@ -176,7 +122,7 @@ async def run_test_startup_and_recovery(dut):
 
     await metrics.receive_frame()
 
-    while not metrics.frame_queue.empty():
+    while not metrics.scoreboard.empty():
         await metrics.receive_frame()
 
     tb.log.info(f"==== Startup and Recovery Test Results ====")
@@ -187,7 +133,13 @@ async def run_test_startup_and_recovery(dut):
     tb.log.info(f"Total Bytes Processed: {metrics.total_bytes}")
     tb.log.info(f"==============================================")
 
-async def throughput_test(dut, name, input_throughput, output_throughput):
+    results.record("Startup and Recovery", {
+        "startup_latency_ns": start_up_latency,
+        "output_hold_time_ns": output_hold_time,
+        "input_capacity_ns": input_capacity,
+    })
+
+async def throughput_test(dut, name, input_throughput, output_throughput, point=None):
     """Run a throughput test with specified input and output throughput"""
     tb = TB(dut)
 
@@ -195,7 +147,10 @@ async def throughput_test(dut, name, input_throughput, output_throughput):
 
     await tb.reset()
 
-    frames = generate_random_frames(num=16, size=256, width_bytes=tb.width_bytes)
+    frames = list(tb.random_frames(num=16, size=256))
+
+    wall_start_s = time.perf_counter()
+    sim_start_ns = cocotb.utils.get_sim_time("ns")
 
     for frame in frames:
         metrics.send_frame(frame)
@@ -210,25 +165,20 @@ async def throughput_test(dut, name, input_throughput, output_throughput):
     tb.log.info(f"Output Start at {output_start_time} ns")
 
     await tb.source.wait()
-    input_end_time = cocotb.utils.get_sim_time(units="ns")
+    input_end_time = tb.input_monitor.last_handshake() + tb.clk_period_ns
     tb.log.info(f"Input End at {input_end_time} ns")
 
-    while not metrics.frame_queue.empty():
+    while not metrics.scoreboard.empty():
         await metrics.receive_frame()
-    output_end_time = cocotb.utils.get_sim_time(units="ns")
+    output_end_time = tb.output_monitor.last_handshake() + tb.clk_period_ns
     tb.log.info(f"Output End at {output_end_time} ns")
 
     total_time_ns = output_end_time - input_start_time
+    wall_time_s = time.perf_counter() - wall_start_s
+    sim_cycles_per_s = (cocotb.utils.get_sim_time("ns") - sim_start_ns) / tb.clk_period_ns / wall_time_s
 
-    ideal_throughput_MBs = (tb.width_bytes / 2**20) / (tb.clk_period_ns / 1e9)
-
-    input_total_time_ns = input_end_time - input_start_time
-    input_throughput_MBs = (metrics.total_bytes / 2**20) / (input_total_time_ns / 1e9)
-    input_utilization = input_throughput_MBs / ideal_throughput_MBs * 100
-
-    output_total_time_ns = output_end_time - output_start_time
-    output_throughput_MBs = (metrics.total_bytes / 2**20) / (output_total_time_ns / 1e9)
-    output_utilization = output_throughput_MBs / ideal_throughput_MBs * 100
+    input_throughput_MBs, input_utilization = tb.throughput(tb.input_monitor, input_start_time, input_end_time)
+    output_throughput_MBs, output_utilization = tb.throughput(tb.output_monitor, output_start_time, output_end_time)
 
     tb.log.info(f"==== {name} Throughput Test Results ====")
     tb.log.info(f"Total Time: {total_time_ns} ns")
@@ -238,36 +188,164 @@ async def throughput_test(dut, name, input_throughput, output_throughput):
     tb.log.info(f"Input Utilization: {input_utilization:.2f}%")
     tb.log.info(f"Output Throughput: {output_throughput_MBs:.2f} MB/s")
     tb.log.info(f"Output Utilization: {output_utilization:.2f}%")
+    metrics.latency.log_summary(tb.log)
+    tb.log.info(f"Testbench Overhead: {wall_time_s:.2f} s wall time, {sim_cycles_per_s:.0f} cycles/s")
     tb.log.info(f"==============================================")
 
+    measured = {
+        "total_time_ns": total_time_ns,
+        "input_throughput_MBs": input_throughput_MBs,
+        "input_utilization": input_utilization,
+        "output_throughput_MBs": output_throughput_MBs,
+        "output_utilization": output_utilization,
+        **results.latency_metrics(metrics.latency.summary()),
+    }
+    results.record(name, dict(measured, wall_time_s=wall_time_s, sim_cycles_per_s=sim_cycles_per_s), point=point)
+
+    # Differential reference: the transaction-level model under the same kind of pauses
+    duts = CHAIN or [dut._name]
+    if all(module in models.MODELS for module in duts):
+        frame_sizes = [math.ceil(len(frame) / tb.width_bytes) for frame in frames]
+        estimated = models.estimate(duts, frame_sizes, input_throughput, output_throughput,
+                                    model=tb.pause_model, width_bytes=tb.width_bytes, clk_period_ns=tb.clk_period_ns)
+        models.log_comparison(tb.log, measured, estimated)
+
 @cocotb.test()
+@dump_on_failure
 async def run_test_continuous_throughput(dut):
     await throughput_test(dut, "Continuous", 1.0, 1.0)
     
 @cocotb.test()
+@dump_on_failure
 async def run_test_input_limited_throughput(dut):
     await throughput_test(dut, "Input Limited", 0.7, 1.0)
 
 @cocotb.test()
+@dump_on_failure
 async def run_test_output_limited_throughput(dut):
     await throughput_test(dut, "Output Limited", 1.0, 0.7)
 
 @cocotb.test()
+@dump_on_failure
 async def run_test_balanced_limited_throughput(dut):
     await throughput_test(dut, "Balanced Limited", 0.7, 0.7)
-    
-@pytest.mark.parametrize("dut", [
+
+@cocotb.test(skip=SWEEP_POINT is None)
+@dump_on_failure
+async def run_test_throughput_sweep(dut):
+    input_throughput = SWEEP_POINT["input_throughput"]
+    output_throughput = SWEEP_POINT["output_throughput"]
+    await throughput_test(dut, f"Sweep {input_throughput:.2f}/{output_throughput:.2f}",
+                          input_throughput, output_throughput, point=SWEEP_POINT)
+
+@cocotb.test(skip=SCALING_POINT is None)
+@dump_on_failure
+async def run_test_scaling(dut):
+    """Full-rate throughput at the parameters of a scaling sweep point"""
+    await throughput_test(dut, "Scaling", 1.0, 1.0, point=SCALING_POINT)
+
+@cocotb.test(skip=not SOAK_FRAMES)
+@dump_on_failure
+async def run_test_soak(dut):
+    """Stream SOAK_FRAMES frames with a bounded number of frames in flight"""
+    tb = TB(dut)
+    scoreboard = AxisScoreboard(tb.width_bytes)
+    latency = LatencyTracker(tb)
+
+    await tb.reset()
+
+    frames = iter_random_frames(num=SOAK_FRAMES, size=256, width_bytes=tb.width_bytes)
+    driver = AxisStreamDriver(tb, scoreboard, frames, max_in_flight=16, latency=latency)
+    await driver.run()
+
+    end_time = tb.output_monitor.last_handshake() + tb.clk_period_ns
+    output_throughput_MBs, output_utilization = tb.throughput(tb.output_monitor, 0, end_time)
+
+    tb.log.info(f"==== Soak Test Results ====")
+    tb.log.info(f"Total Time: {end_time} ns")
+    tb.log.info(f"Total Frames Processed: {driver.frame_count}")
+    tb.log.info(f"Total Bytes Processed: {driver.total_bytes}")
+    tb.log.info(f"Output Throughput: {output_throughput_MBs:.2f} MB/s")
+    tb.log.info(f"Output Utilization: {output_utilization:.2f}%")
+    scoreboard.log_summary(tb.log)
+    latency.log_summary(tb.log)
+    tb.log.info(f"==============================================")
+
+@cocotb.test()
+@dump_on_failure
+async def run_test_drain(dut):
+    """Drain frames sent under pauses until the pipeline is idle with every beat out"""
+    tb = TB(dut)
+    scoreboard = AxisScoreboard(tb.width_bytes)
+
+    await tb.reset()
+
+    tb.set_input_throughput(0.7)
+    tb.set_output_throughput(0.5)
+
+    frames = list(tb.random_frames(num=16, size=16))
+    for frame in frames:
+        scoreboard.expect(frame)
+        tb.source.send_nowait(AxiStreamFrame(frame))
+
+    async for frame in tb.drain():
+        scoreboard.check(frame)
+    assert scoreboard.empty(), f"{scoreboard.pending} frames still pending after the drain"
+
+    # Already idle: nothing left to send and every accepted beat came out
+    idle_time = await tb.wait_idle()
+    assert tb.input_monitor.beats(idle_time) == tb.output_monitor.beats(idle_time) == 16 * 16
+    assert tb.sink.empty()
+
+@cocotb.test(skip=not COVERAGE_FRAMES)
+@dump_on_failure
+async def run_test_coverage(dut):
+    """Stream random frames under random pauses until every coverage bin is saturated"""
+    tb = TB(dut)
+    scoreboard = AxisScoreboard(tb.width_bytes)
+
+    await tb.reset()
+
+    tb.set_input_throughput(0.8)
+    tb.set_output_throughput(0.5)
+
+    frames = until_covered(tb.random_frames(num=COVERAGE_FRAMES, size=16), tb.coverage, tb.log)
+    driver = AxisStreamDriver(tb, scoreboard, frames, max_in_flight=16)
+    await driver.run()
+
+    tb.log.info(f"Total Frames Processed: {driver.frame_count}")
+    if tb.coverage is not None:
+        tb.coverage.log_summary(tb.log)
+        results.record("Coverage", dict(tb.coverage.metrics(), frames=driver.frame_count))
+        if not tb.coverage.covered:
+            tb.log.warning(f"Coverage below goal after {driver.frame_count} frames: {', '.join(tb.coverage.missing())}")
+
+PIPELINE_MODULES = [
     "axis_half_buffer",
     "axis_prefetch",
     "axis_skid_buffer",
     "axis_fifo_pipeline",
     "axis_gating"
-])
-def test_pipeline_throughput(dut):
-    """Run throughput tests for different pipeline modules"""
-    module = os.path.splitext(os.path.basename(__file__))[0]
-    toplevel = dut
-
+]
+
+def xpm_libraries():
+    """Whether to simulate the XPM FIFO with the vendor libraries or the behavioral stand-in
+
+    Verilator cannot load the vendor libraries, `XPM_LIBRARIES=0` selects the
+    stand-in for other simulators too.
+    """
+    default = "0" if runner.simulator_name() == "verilator" else "1"
+    return os.getenv("XPM_LIBRARIES", default) == "1"
+
+# Chains of pipeline modules from input to output, as they are composed in designs
+PIPELINE_CHAINS = {
+    "chain_skid_gating_prefetch": ["axis_skid_buffer", "axis_gating", "axis_prefetch"],
+    "chain_half_skid": ["axis_half_buffer", "axis_skid_buffer"],
+    "chain_skid_skid_skid": ["axis_skid_buffer", "axis_skid_buffer", "axis_skid_buffer"],
+}
+
+def module_sources(dut):
+    """Verilog sources and simulator arguments of one pipeline module"""
     verilog_sources = [
         os.path.join(os.path.dirname(__file__), f"{dut}.v"),
     ]
@@ -275,23 +353,125 @@ def test_pipeline_throughput(dut):
     sim_args = []
 
     if (dut == "axis_fifo_pipeline"):
-        sim_args.extend(["-L","unisims_ver",
-                         "-L","unimacro_ver",
-                         "-L","secureip",
-                         "-L","xpm",
-                         f"{toplevel}.glbl"
-                        ])
-
-        verilog_sources.append(
-            os.path.join(os.path.dirname(__file__), "glbl.v")
-        )
+        if xpm_libraries():
+            sim_args.extend(["-L","unisims_ver",
+                             "-L","unimacro_ver",
+                             "-L","secureip",
+                             "-L","xpm",
+                             f"{dut}.glbl"
+                            ])
+
+            verilog_sources.append(
+                os.path.join(os.path.dirname(__file__), "glbl.v")
+            )
+        else:
+            verilog_sources.append(
+                os.path.join(os.path.dirname(__file__), "xpm_fifo_sync.v")
+            )
         verilog_sources.append(
             os.path.join(os.path.dirname(__file__), "pipeline.v")
         )
 
-    cocotb_test.simulator.run(
+    return verilog_sources, sim_args
+
+def simulator_args(dut):
+    """Arguments of `cocotb_test.simulator.run` for one pipeline module"""
+    module = os.path.splitext(os.path.basename(__file__))[0]
+    toplevel = dut
+
+    verilog_sources, sim_args = module_sources(dut)
+
+    return dict(
         verilog_sources=verilog_sources,
         toplevel=toplevel,
         module=module,
         sim_args=sim_args,
-    )
\ No newline at end of file
+    )
+
+def chain_simulator_args(chain):
+    """Arguments of `cocotb_test.simulator.run` for a generated wrapper chaining pipeline modules"""
+    module = os.path.splitext(os.path.basename(__file__))[0]
+    toplevel = chain
+    stages = PIPELINE_CHAINS[chain]
+
+    wrapper = generate_chain(chain, stages, os.path.join(runner.build_root(), "chains", f"{chain}.v"))
+
+    verilog_sources = [wrapper]
+    sim_args = []
+    for dut in chain_modules(stages):
+        dut_sources, dut_sim_args = module_sources(dut)
+        verilog_sources.extend(source for source in dut_sources if source not in verilog_sources)
+        sim_args.extend(dut_sim_args)
+
+    return dict(
+        verilog_sources=verilog_sources,
+        toplevel=toplevel,
+        module=module,
+        sim_args=sim_args,
+        extra_env={"CHAIN": json.dumps([dut for dut, _ in chain_stages(stages)])},
+    )
+
+THROUGHPUT_GRID = [0.2, 0.4, 0.6, 0.8, 1.0]
+
+def sweep_configurations():
+    """One configuration per pipeline module or chain and point of the input/output throughput grid"""
+    configurations = []
+    duts = [simulator_args(dut) for dut in PIPELINE_MODULES] + [chain_simulator_args(chain) for chain in PIPELINE_CHAINS]
+    for kwargs in duts:
+        for input_throughput, output_throughput in itertools.product(THROUGHPUT_GRID, repeat=2):
+            point = {"input_throughput": input_throughput, "output_throughput": output_throughput}
+            configurations.append(dict(
+                kwargs,
+                variant=f"in_{input_throughput}-out_{output_throughput}",
+                testcase="run_test_throughput_sweep",
+                extra_env=dict(kwargs.get("extra_env") or {}, SWEEP_POINT=json.dumps(point)),
+            ))
+    return configurations
+
+SCALING_WIDTHS = [32, 64, 128, 256, 512]
+SCALING_DEPTHS = [16, 64, 256, 1024, 4096]  # The XPM FIFO needs at least 16 entries
+
+def scaling_configurations():
+    """One configuration per pipeline module and DATA_WIDTH, and FIFO_DEPTH of the FIFO pipeline"""
+    configurations = []
+    for dut in PIPELINE_MODULES:
+        depths = SCALING_DEPTHS if dut == "axis_fifo_pipeline" else [None]
+        for width, depth in itertools.product(SCALING_WIDTHS, depths):
+            point = {"DATA_WIDTH": width}
+            if dut == "axis_fifo_pipeline":
+                parameters = {"INPUT_WIDTH": width, "OUTPUT_WIDTH": width, "FIFO_DEPTH": depth}
+                point["FIFO_DEPTH"] = depth
+            else:
+                parameters = {"DATA_WIDTH": width}
+            configurations.append(dict(
+                simulator_args(dut),
+                parameters=parameters,
+                testcase="run_test_scaling",
+                extra_env={"SCALING_POINT": json.dumps(point)},
+            ))
+    return configurations
+
+def test_sweep_points(monkeypatch, tmp_path):
+    # Each sweep sets the point of its own test only, whatever the testcase filter
+    monkeypatch.setenv("SIM_BUILD", str(tmp_path))
+    for configurations, testcase, variable in [(sweep_configurations(), "run_test_throughput_sweep", "SWEEP_POINT"),
+                                               (scaling_configurations(), "run_test_scaling", "SCALING_POINT")]:
+        for configuration in configurations:
+            points = {name for name in configuration["extra_env"] if name.endswith("_POINT")}
+            assert configuration["testcase"] == testcase and points == {variable}
+
+@pytest.mark.parametrize("dut", PIPELINE_MODULES)
+def test_pipeline_throughput(dut):
+    """Run throughput tests for different pipeline modules"""
+    runner.run(**simulator_args(dut))
+
+@pytest.mark.parametrize("chain", PIPELINE_CHAINS)
+def test_pipeline_chain_throughput(chain):
+    """Run the throughput and startup tests on chains of pipeline modules"""
+    runner.run(**chain_simulator_args(chain))
+
+if __name__ == "__main__":
+    sys.exit(runner.main([simulator_args(dut) for dut in PIPELINE_MODULES]
+                         + [chain_simulator_args(chain) for chain in PIPELINE_CHAINS],
+                         sweeps={"throughput": sweep_configurations(), "scaling": scaling_configurations()},
+                         surface_metrics=("output_utilization", "latency_p50_ns", "sim_cycles_per_s")))
\ No newline at end of file
@@ -0,0 +1,148 @@
+// Behavioral stand-in for the Xilinx XPM synchronous FIFO
+//
+// Same parameters and ports as xpm_fifo_sync, so designs can simulate
+// without the vendor libraries (e.g. on Verilator). Only the behavior the
+// testbenches rely on is modeled: standard or first-word fall-through reads,
+// full/empty, data counts and reset busy flags. ECC, programmable flags and
+// the exact latency of the vendor FIFO are not modeled; in fwft mode a
+// written word is readable on the next cycle.
+module xpm_fifo_sync #(
+    parameter        CASCADE_HEIGHT      = 0,
+    parameter        DOUT_RESET_VALUE    = "0",
+    parameter        ECC_MODE            = "no_ecc",
+    parameter        FIFO_MEMORY_TYPE    = "auto",
+    parameter integer FIFO_READ_LATENCY   = 1,
+    parameter integer FIFO_WRITE_DEPTH    = 2048,
+    parameter integer FULL_RESET_VALUE    = 0,
+    parameter integer PROG_EMPTY_THRESH   = 10,
+    parameter integer PROG_FULL_THRESH    = 10,
+    parameter integer RD_DATA_COUNT_WIDTH = 1,
+    parameter integer READ_DATA_WIDTH     = 32,
+    parameter        READ_MODE           = "std",
+    parameter integer SIM_ASSERT_CHK      = 0,
+    parameter        USE_ADV_FEATURES    = "0707",
+    parameter integer WAKEUP_TIME         = 0,
+    parameter integer WRITE_DATA_WIDTH    = 32,
+    parameter integer WR_DATA_COUNT_WIDTH = 1
+) (
+    input wire wr_clk,
+    input wire rst,
+    input wire sleep,
+
+    input  wire [WRITE_DATA_WIDTH-1:0]    din,
+    input  wire                           wr_en,
+    output wire                           full,
+    output wire                           almost_full,
+    output wire                           prog_full,
+    output wire [WR_DATA_COUNT_WIDTH-1:0] wr_data_count,
+    output reg                            wr_ack,
+    output reg                            overflow,
+
+    output wire [READ_DATA_WIDTH-1:0]     dout,
+    input  wire                           rd_en,
+    output wire                           empty,
+    output wire                           almost_empty,
+    output wire                           prog_empty,
+    output wire [RD_DATA_COUNT_WIDTH-1:0] rd_data_count,
+    output reg                            data_valid,
+    output reg                            underflow,
+
+    input  wire injectdbiterr,
+    input  wire injectsbiterr,
+    output wire dbiterr,
+    output wire sbiterr,
+
+    output wire wr_rst_busy,
+    output wire rd_rst_busy
+);
+
+    localparam integer AddrWidth  = FIFO_WRITE_DEPTH > 1 ? $clog2(FIFO_WRITE_DEPTH) : 1;
+    localparam integer CountWidth = $clog2(FIFO_WRITE_DEPTH + 1);
+    localparam         Fwft       = READ_MODE == "fwft";
+
+    // Reset Busy, held for a few cycles after reset like the vendor FIFO
+    reg [3:0] rst_busy;
+
+    always @(posedge wr_clk) begin
+        if (rst) begin
+            rst_busy <= 4'b1111;
+        end else begin
+            rst_busy <= {rst_busy[2:0], 1'b0};
+        end
+    end
+
+    assign wr_rst_busy = rst_busy[3];
+    assign rd_rst_busy = rst_busy[3];
+
+    // Storage
+    reg [WRITE_DATA_WIDTH-1 : 0] mem [0 : FIFO_WRITE_DEPTH-1];
+
+    reg [ AddrWidth-1 : 0] w_ptr;
+    reg [ AddrWidth-1 : 0] r_ptr;
+    reg [CountWidth-1 : 0] count;
+
+    wire write;
+    wire read;
+
+    assign full  = rst_busy[3] ? FULL_RESET_VALUE : (count == FIFO_WRITE_DEPTH);
+    assign empty = (count == 0);
+
+    assign write = wr_en && !full && !rst_busy[3];
+    assign read  = rd_en && !empty && !rst_busy[3];
+
+    always @(posedge wr_clk) begin
+        if (rst) begin
+            w_ptr <= 0;
+            r_ptr <= 0;
+            count <= 0;
+        end else begin
+            if (write) begin
+                mem[w_ptr] <= din;
+                w_ptr      <= (w_ptr == FIFO_WRITE_DEPTH - 1) ? 0 : w_ptr + 1;
+            end
+            if (read) begin
+                r_ptr <= (r_ptr == FIFO_WRITE_DEPTH - 1) ? 0 : r_ptr + 1;
+            end
+            count <= count + write - read;
+        end
+    end
+
+    // Read Data
+    reg [READ_DATA_WIDTH-1 : 0] dout_std;
+
+    always @(posedge wr_clk) begin
+        if (rst) begin
+            dout_std <= 0;
+        end else if (read) begin
+            dout_std <= mem[r_ptr];
+        end
+    end
+
+    assign dout = Fwft ? mem[r_ptr] : dout_std;
+
+    // Status
+    always @(posedge wr_clk) begin
+        if (rst) begin
+            wr_ack     <= 0;
+            overflow   <= 0;
+            data_valid <= 0;
+            underflow  <= 0;
+        end else begin
+            wr_ack     <= write;
+            overflow   <= wr_en && full;
+            data_valid <= read;
+            underflow  <= rd_en && empty;
+        end
+    end
+
+    assign almost_full   = (count >= FIFO_WRITE_DEPTH - 1);
+    assign almost_empty  = (count <= 1);
+    assign prog_full     = (count >= PROG_FULL_THRESH);
+    assign prog_empty    = (count <= PROG_EMPTY_THRESH);
+    assign wr_data_count = count;
+    assign rd_data_count = count;
+
+    assign dbiterr = 1'b0;
+    assign sbiterr = 1'b0;
+
+endmodule
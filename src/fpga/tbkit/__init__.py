@@ -0,0 +1 @@
+"""Shared cocotb testbench infrastructure for the modules under src/fpga"""
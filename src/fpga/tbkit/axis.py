@@ -0,0 +1,526 @@
+"""AXI-Stream testbench base, whole-beat source and sink, and event-driven handshake monitor"""
+import logging
+import math
+import os
+from array import array
+from bisect import bisect_right
+
+import cocotb
+import cocotb.utils
+from cocotb.clock import Clock
+from cocotb.triggers import RisingEdge, Edge, First, Event, NextTimeStep, ReadOnly, Timer
+from cocotbext.axi import AxiStreamSource, AxiStreamSink, AxiStreamBus, AxiStreamFrame
+
+from .capture import SignalCapture, capture_cycles
+from .coverage import AxisCoverage, coverage_goal
+from .pauses import pause_pattern, drive_pauses
+from .profiler import SimProfiler, profiling_enabled
+from .protocol import ProtocolMonitor
+from .stimulus import iter_random_frames
+from .trace import open_trace
+
+
+class AxisHandshakeMonitor:
+    """Record the handshake state of one AXI-Stream interface as a timeline
+
+    Instead of waking on every clock edge, the monitor sleeps until tvalid or
+    tready changes and then samples the next rising edge, so a stream that
+    keeps streaming or keeps stalling costs no Python wakeups. Only state
+    transitions are stored: entry i holds the time of the rising edge and the
+    state sampled there, which lasts until entry i + 1. An `AxisCoverage`
+    passed to the monitor is sampled at the same edges, the monitor then also
+    waking on the signals it covers.
+    """
+    IDLE = 0b00  # tvalid low, tready low
+    VALID = 0b01  # tvalid high, tready low: stall
+    READY = 0b10  # tvalid low, tready high
+    HANDSHAKE = 0b11
+
+    def __init__(self, clock, tvalid, tready, clk_period_ns, coverage=None):
+        self.clock = clock
+        self.tvalid = tvalid
+        self.tready = tready
+        self.clk_period_ns = clk_period_ns
+        self.coverage = coverage  # AxisCoverage sampled at the same edges, see tbkit.coverage
+
+        self.times = array("d")
+        self.states = array("B")
+        self._beats_before = array("q")  # Beats transferred before each entry
+
+        self._waiters = []
+        self._clock_edge = RisingEdge(clock)
+        self._cr = cocotb.start_soon(self._run())
+
+    def _sample(self):
+        return (str(self.tvalid.value) == "1") | (str(self.tready.value) == "1") << 1
+
+    def _record(self, time, state):
+        self.times.append(time)
+        self.states.append(state)
+
+        if self._waiters:
+            waiters = self._waiters
+            self._waiters = []
+            for predicate, event in waiters:
+                if predicate(state):
+                    event.set(time)
+                else:
+                    self._waiters.append((predicate, event))
+
+    async def _run(self):
+        signals = [self.tvalid, self.tready] + (self.coverage.watched if self.coverage is not None else [])
+        change = First(*(Edge(signal) for signal in {id(signal): signal for signal in signals}.values()))
+        while True:
+            await self._clock_edge
+            time = cocotb.utils.get_sim_time(units="ns")
+            state = self._sample()
+            if not self.states or state != self.states[-1]:
+                self._record(time, state)
+            if self.coverage is not None:
+                self.coverage.sample(time)
+            await change
+
+    @property
+    def state(self):
+        """Last recorded state"""
+        return self.states[-1] if self.states else None
+
+    async def wait_for(self, predicate):
+        """Wait for the next rising edge whose state satisfies predicate and return its time in ns"""
+        await self._clock_edge
+        if predicate(self._sample()):
+            return cocotb.utils.get_sim_time(units="ns")
+
+        event = Event()
+        self._waiters.append((predicate, event))
+        await event.wait()
+        return event.data
+
+    async def wait_for_handshake(self):
+        return await self.wait_for(lambda state: state == self.HANDSHAKE)
+
+    async def wait_for_pause(self):
+        return await self.wait_for(lambda state: state != self.HANDSHAKE)
+
+    def cycles(self, state, start, end=None):
+        """Number of clock edges in [start, end) sampled in the given state"""
+        if end is None:
+            end = cocotb.utils.get_sim_time(units="ns")
+        total = 0.0
+        i = max(bisect_right(self.times, start) - 1, 0)
+        while i < len(self.times) and self.times[i] < end:
+            if self.states[i] == state:
+                segment_end = self.times[i + 1] if i + 1 < len(self.times) else end
+                total += min(segment_end, end) - max(self.times[i], start)
+            i += 1
+        return round(total / self.clk_period_ns)
+
+    def handshakes(self, start, end=None):
+        """Number of beats transferred in [start, end)"""
+        return self.cycles(self.HANDSHAKE, start, end)
+
+    def _index_beats(self):
+        """Extend the beats transferred before each entry to the new entries"""
+        beats_before = self._beats_before
+        while len(beats_before) < len(self.times):
+            i = len(beats_before)
+            beats = 0
+            if i > 0 and self.states[i - 1] == self.HANDSHAKE:
+                beats = round((self.times[i] - self.times[i - 1]) / self.clk_period_ns)
+            beats_before.append(beats_before[i - 1] + beats if i > 0 else 0)
+        return beats_before
+
+    def beat_time(self, n):
+        """Time of the n-th beat (counted from 0) since the monitor started, None if still pending"""
+        beats_before = self._index_beats()
+
+        i = bisect_right(beats_before, n) - 1
+        if i < 0 or self.states[i] != self.HANDSHAKE:
+            return None
+        time = self.times[i] + (n - beats_before[i]) * self.clk_period_ns
+        if i + 1 == len(self.times) and time > cocotb.utils.get_sim_time(units="ns"):
+            return None
+        return time
+
+    def beats(self, end=None):
+        """Number of beats transferred at or before end since the monitor started"""
+        if end is None:
+            end = cocotb.utils.get_sim_time(units="ns")
+        beats_before = self._index_beats()
+        i = bisect_right(self.times, end) - 1
+        if i < 0:
+            return 0
+        beats = beats_before[i]
+        if self.states[i] == self.HANDSHAKE:
+            beats += math.floor((end - self.times[i]) / self.clk_period_ns) + 1
+        return beats
+
+    def last_handshake(self, end=None):
+        """Time of the last beat transferred at or before end"""
+        if end is None:
+            end = cocotb.utils.get_sim_time(units="ns")
+        i = bisect_right(self.times, end) - 1
+        while i >= 0:
+            if self.states[i] == self.HANDSHAKE:
+                if i + 1 < len(self.times) and self.times[i + 1] <= end:
+                    return self.times[i + 1] - self.clk_period_ns
+                return self.times[i] + math.floor((end - self.times[i]) / self.clk_period_ns) * self.clk_period_ns
+            i -= 1
+        return None
+
+
+class BeatAxiStreamSource(AxiStreamSource):
+    """AxiStreamSource packing each beat with one int.from_bytes instead of a loop over byte lanes
+
+    Same behavior as cocotbext-axi, except frames are logged at debug level:
+    formatting every frame at wide data widths costs more than sending it.
+    """
+    async def _run(self):
+        if self.byte_size != 8:
+            return await super()._run()
+
+        frame = None
+        frame_offset = 0
+        self.active = False
+
+        has_tready = hasattr(self.bus, "tready")
+        has_tvalid = hasattr(self.bus, "tvalid")
+        has_tlast = hasattr(self.bus, "tlast")
+        has_tkeep = hasattr(self.bus, "tkeep")
+        has_tid = hasattr(self.bus, "tid")
+        has_tdest = hasattr(self.bus, "tdest")
+        has_tuser = hasattr(self.bus, "tuser")
+
+        clock_edge_event = RisingEdge(self.clock)
+
+        while True:
+            await clock_edge_event
+
+            # read handshake signals
+            tready_sample = (not has_tready) or self.bus.tready.value
+            tvalid_sample = (not has_tvalid) or self.bus.tvalid.value
+
+            if (tready_sample and tvalid_sample) or not tvalid_sample:
+                if not frame and not self.queue.empty():
+                    frame = self.queue.get_nowait()
+                    self.dequeue_event.set()
+                    self.queue_occupancy_bytes -= len(frame)
+                    self.queue_occupancy_frames -= 1
+                    self.current_frame = frame
+                    frame.sim_time_start = cocotb.utils.get_sim_time()
+                    frame.sim_time_end = None
+                    self.log.debug("TX frame: %s", frame)
+                    frame.normalize()
+                    self.active = True
+                    frame_offset = 0
+
+                if frame and not self.pause:
+                    end = min(frame_offset + self.byte_lanes, len(frame.tdata))
+                    last = end - 1
+
+                    self.bus.tdata.value = int.from_bytes(bytes(frame.tdata[frame_offset:end]), "little")
+                    if has_tvalid:
+                        self.bus.tvalid.value = 1
+                    if has_tlast:
+                        self.bus.tlast.value = int(end >= len(frame.tdata))
+                    if has_tkeep:
+                        keep = frame.tkeep[frame_offset:end]
+                        self.bus.tkeep.value = sum((k & 1) << i for i, k in enumerate(keep))
+                    if has_tid:
+                        self.bus.tid.value = frame.tid[last]
+                    if has_tdest:
+                        self.bus.tdest.value = frame.tdest[last]
+                    if has_tuser:
+                        self.bus.tuser.value = frame.tuser[last]
+
+                    frame_offset = end
+                    if frame_offset >= len(frame.tdata):
+                        frame.sim_time_end = cocotb.utils.get_sim_time()
+                        frame.handle_tx_complete()
+                        frame = None
+                        self.current_frame = None
+                else:
+                    if has_tvalid:
+                        self.bus.tvalid.value = 0
+                    if has_tlast:
+                        self.bus.tlast.value = 0
+                    self.active = bool(frame)
+                    if not frame and self.queue.empty():
+                        self.idle_event.set()
+                        self.active_event.clear()
+
+                        await self.active_event.wait()
+
+
+class BeatAxiStreamSink(AxiStreamSink):
+    """AxiStreamSink reading each beat once and unpacking it with int.to_bytes
+
+    cocotbext-axi reads tdata from the simulator once per byte lane; at 512
+    bits that is 64 reads per beat. Frames are logged at debug level.
+    """
+    async def _run(self):
+        if self.byte_size != 8:
+            return await super()._run()
+
+        frame = None
+        self.active = False
+
+        has_tready = hasattr(self.bus, "tready")
+        has_tvalid = hasattr(self.bus, "tvalid")
+        has_tlast = hasattr(self.bus, "tlast")
+        has_tkeep = hasattr(self.bus, "tkeep")
+        has_tid = hasattr(self.bus, "tid")
+        has_tdest = hasattr(self.bus, "tdest")
+        has_tuser = hasattr(self.bus, "tuser")
+
+        lanes = self.byte_lanes
+        clock_edge_event = RisingEdge(self.clock)
+
+        wake_event = self.wake_event.wait()
+
+        while True:
+            pause_sample = bool(self.pause)
+
+            await clock_edge_event
+
+            # read handshake signals
+            tready_sample = (not has_tready) or self.bus.tready.value
+            tvalid_sample = (not has_tvalid) or self.bus.tvalid.value
+
+            if tready_sample and tvalid_sample:
+                if not frame:
+                    frame = AxiStreamFrame(bytearray(), [], [], [], [])
+                    frame.sim_time_start = cocotb.utils.get_sim_time()
+                    self.active = True
+
+                frame.tdata.extend(int(self.bus.tdata.value).to_bytes(lanes, "little"))
+                if has_tkeep:
+                    keep = int(self.bus.tkeep.value)
+                    frame.tkeep.extend((keep >> i) & 1 for i in range(lanes))
+                if has_tid:
+                    frame.tid.extend([int(self.bus.tid.value)] * lanes)
+                if has_tdest:
+                    frame.tdest.extend([int(self.bus.tdest.value)] * lanes)
+                if has_tuser:
+                    frame.tuser.extend([int(self.bus.tuser.value)] * lanes)
+
+                if not has_tlast or self.bus.tlast.value:
+                    frame.sim_time_end = cocotb.utils.get_sim_time()
+                    self.log.debug("RX frame: %s", frame)
+
+                    self.queue_occupancy_bytes += len(frame)
+                    self.queue_occupancy_frames += 1
+
+                    self.queue.put_nowait(frame)
+                    self.active_event.set()
+
+                    frame = None
+            else:
+                self.active = bool(frame)
+
+            if has_tready:
+                paused = self.full() or pause_sample
+                self.bus.tready.value = not paused
+
+                if (not tvalid_sample or paused) and (pause_sample == bool(self.pause)):
+                    self.wake_event.clear()
+                    await wake_event
+            else:
+                if not tvalid_sample:
+                    self.wake_event.clear()
+                    await wake_event
+
+
+class AxisTB(object):
+    """Clock, source, sink and handshake monitors around a DUT with s_axis and m_axis ports"""
+    coverage_exclude = ()  # Coverage bins of states the DUT never reaches
+
+    def __init__(self, dut, clk_period_ns=10):
+        self.dut = dut
+
+        self.width_bytes = len(dut.s_axis_tdata.value) // 8
+
+        self.input_throughput = 1.0
+        self.output_throughput = 1.0
+        self.pause_model = os.getenv("PAUSE_MODEL", "bernoulli")  # Default model of all pause patterns
+        self._pause_crs = {}
+
+        self.trace = open_trace()  # Stimulus trace selected by the TRACE environment variable, closed when the test ends
+        self._trace_calls = {}
+
+        self.log = logging.getLogger("cocotb.tb")
+        self.log.setLevel(logging.INFO)
+        self.clk_period_ns = clk_period_ns
+
+        # Opt-in scheduler profile, logged when the test returns
+        self.profiler = SimProfiler(clk_period_ns, self.log).start() if profiling_enabled() else None
+
+        cocotb.start_soon(Clock(dut.aclk, self.clk_period_ns, units="ns").start())
+
+        self.source = BeatAxiStreamSource(AxiStreamBus.from_prefix(dut, "s_axis"), dut.aclk, dut.aresetn, reset_active_level=False)
+        self.sink = BeatAxiStreamSink(AxiStreamBus.from_prefix(dut, "m_axis"), dut.aclk, dut.aresetn, reset_active_level=False)
+
+        # Interface states hit so far, tests can stop their stimulus once every bin is saturated
+        goal = coverage_goal()
+        self.coverage = AxisCoverage.axis(dut, self.clk_period_ns, goal, self.coverage_exclude) if goal else None
+
+        self.input_monitor = AxisHandshakeMonitor(dut.aclk, dut.s_axis_tvalid, dut.s_axis_tready, self.clk_period_ns)
+        self.output_monitor = AxisHandshakeMonitor(dut.aclk, dut.m_axis_tvalid, dut.m_axis_tready, self.clk_period_ns,
+                                                   coverage=self.coverage)
+
+        # Last cycles of the interfaces, written out when a test decorated with dump_on_failure fails
+        depth = capture_cycles()
+        self.capture = SignalCapture.axis(dut, self.clk_period_ns, depth) if depth else None
+
+        # Fails the test on the first violation flagged by the HDL protocol checkers, if the DUT was built with them
+        self.protocol = ProtocolMonitor.attach(dut, self.log)
+
+    def set_pauses(self, name, apply, throughput, model=None, **kwargs):
+        """Drive apply(pause) from a pause pattern, replacing the previous pattern of the same name
+
+        model defaults to `pause_model` and kwargs go to the pattern, see
+        `tbkit.pauses`.
+        """
+        cr = self._pause_crs.pop(name, None)
+        if cr is not None:
+            cr.kill()
+        pattern = pause_pattern(model or self.pause_model, throughput, **kwargs)
+        if self.trace is not None:
+            pattern = self.trace.pauses(self._trace_name(name), pattern)
+        self._pause_crs[name] = cocotb.start_soon(drive_pauses(self.dut.aclk, pattern, apply))
+
+    def _trace_name(self, kind):
+        count = self._trace_calls[kind] = self._trace_calls.get(kind, -1) + 1
+        return f"{kind}.{count}"
+
+    def stimulus(self, frames):
+        """(data, tid) pairs to send, recorded or replayed instead when tracing
+
+        Pass a lazy iterator: on replay it is never run.
+        """
+        if self.trace is None:
+            return frames
+        return self.trace.frames(self._trace_name("frames"), frames)
+
+    def random_frames(self, num, size):
+        """Lazy random frames of `size` beats without tid, recorded or replayed when tracing"""
+        frames = ((frame, None) for frame in iter_random_frames(num=num, size=size, width_bytes=self.width_bytes))
+        return (frame for frame, _ in self.stimulus(frames))
+
+    def set_input_throughput(self, throughput, model=None, **kwargs):
+        """Set the fraction of cycles the source is not paused"""
+        self.input_throughput = throughput
+        self.source.clear_pause_generator()
+        self.set_pauses("input", lambda pause: setattr(self.source, "pause", pause), throughput, model, **kwargs)
+
+    def set_output_throughput(self, throughput, model=None, **kwargs):
+        """Set the fraction of cycles the sink is not paused"""
+        self.output_throughput = throughput
+        self.sink.clear_pause_generator()
+        self.set_pauses("output", lambda pause: setattr(self.sink, "pause", pause), throughput, model, **kwargs)
+
+    async def wait_for_input_handshake(self):
+        return await self.input_monitor.wait_for_handshake()
+
+    async def wait_for_output_handshake(self):
+        return await self.output_monitor.wait_for_handshake()
+
+    async def wait_for_input_pause(self):
+        """Wait for the input stream to pause"""
+        return await self.input_monitor.wait_for_pause()
+
+    async def wait_for_output_pause(self):
+        """Wait for the output stream to pause"""
+        return await self.output_monitor.wait_for_pause()
+
+    def throughput(self, monitor, start, end):
+        """Throughput in MB/s and utilization in % of a monitored interface over [start, end)"""
+        beats = monitor.handshakes(start, end)
+        throughput_MBs = (beats * self.width_bytes / 2**20) / ((end - start) / 1e9)
+        utilization = beats / ((end - start) / self.clk_period_ns) * 100
+        return throughput_MBs, utilization
+
+    def configured_rate(self):
+        """Output beats per cycle the configured throughputs allow at most"""
+        return min(self.input_throughput, self.output_throughput)
+
+    def drain_timeout_ns(self, beats=1, margin=4, min_cycles=100):
+        """Time without output after which `beats` beats still expected are considered stuck
+
+        Scaled from the slower of the rate the configured throughputs allow
+        and the output beat rate observed so far, instead of a fixed time.
+        """
+        now = cocotb.utils.get_sim_time(units="ns")
+        first = self.output_monitor.beat_time(0)
+        rate = self.configured_rate()
+        if first is not None and now > first:
+            done = self.output_monitor.beats(now)
+            rate = min(rate, done / ((now - first) / self.clk_period_ns + 1))  # Beats per cycle
+        rate = max(rate, 0.01)
+        return (margin * beats / rate + min_cycles) * self.clk_period_ns
+
+    async def wait_sink(self, beats=1, budgets=4):
+        """Wait for a frame in the sink, warning after each `drain_timeout_ns` and failing after `budgets` of them"""
+        for budget in range(budgets):
+            timeout_ns = self.drain_timeout_ns(beats)
+            await self.sink.wait(timeout_ns, "ns")
+            if not self.sink.empty():
+                return
+            self.log.warning(f"No frame from sink for {timeout_ns:.0f} ns ({budget + 1} of {budgets} timeout budgets)")
+        raise RuntimeError("Timeout waiting for frame from sink")
+
+    async def wait_idle(self, lossy=False, settle_cycles=2):
+        """Wait until the pipeline is provably empty and return the time in ns
+
+        The source must have nothing left to send and m_axis_tvalid must be
+        low. A lossless DUT must also have output every beat it accepted. A
+        lossy DUT may drop beats, so it is empty once m_axis_tvalid stays low
+        for settle_cycles cycles. Fails when beats stay inside a lossless DUT
+        without output for `drain_timeout_ns`.
+        """
+        output_valid = lambda state: state & AxisHandshakeMonitor.VALID
+        while True:
+            await self.source.wait()
+            time = await self.output_monitor.wait_for(lambda state: not output_valid(state))
+            await ReadOnly()  # Both monitors sampled the edge
+            if not self.source.idle():
+                continue
+            occupancy = self.input_monitor.beats(time) - self.output_monitor.beats(time)
+            if not lossy and occupancy <= 0:
+                break
+
+            timeout_ns = settle_cycles * self.clk_period_ns if lossy else self.drain_timeout_ns(occupancy)
+            valid = cocotb.start_soon(self.output_monitor.wait_for(output_valid))
+            await First(valid, Timer(timeout_ns, "ns"))
+            if valid.done():
+                continue
+            valid.kill()
+            if lossy:
+                break
+            raise RuntimeError(f"Pipeline stalled with {occupancy} beats inside for {timeout_ns:.0f} ns")
+
+        await NextTimeStep()  # Leave the read-only phase
+        return time
+
+    async def drain(self, lossy=False, settle_cycles=2):
+        """Yield the received frames until the pipeline is idle and the sink holds no frame"""
+        idle = cocotb.start_soon(self.wait_idle(lossy, settle_cycles))
+        while True:
+            if not self.sink.empty():
+                yield self.sink.recv_nowait(compact=False)
+            elif idle.done():
+                await idle  # Re-raise a stalled pipeline
+                return
+            else:
+                await First(self.sink.active_event.wait(), idle)
+
+    async def reset(self):
+        self.dut.aresetn.setimmediatevalue(1)
+        await RisingEdge(self.dut.aclk)
+        await RisingEdge(self.dut.aclk)
+        self.dut.aresetn.value = 0
+        await RisingEdge(self.dut.aclk)
+        await RisingEdge(self.dut.aclk)
+        self.dut.aresetn.value = 1
+        await RisingEdge(self.dut.aclk)
+        await RisingEdge(self.dut.aclk)
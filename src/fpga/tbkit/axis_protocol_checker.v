@@ -0,0 +1,77 @@
+// AXI-Stream protocol checker of one interface
+//
+// Instantiated on the s_axis and m_axis ports of a DUT by the wrappers of
+// tbkit/protocol.py. Each rule sets one bit of violation at the rising edge
+// where it is broken, held until the next reset, so the testbench only watches
+// for violation to become non-zero instead of checking every cycle in Python.
+module axis_protocol_checker #(
+    parameter integer DATA_WIDTH   = 32,
+    parameter integer ID_WIDTH     = 1,
+    parameter integer CHECK_ENABLE = 0
+) (
+    input wire aclk,
+    input wire aresetn,
+
+    input wire enable,
+
+    input wire [DATA_WIDTH-1:0] tdata,
+    input wire                  tvalid,
+    input wire                  tready,
+    input wire                  tlast,
+    input wire [  ID_WIDTH-1:0] tid,
+
+    output reg [3:0] violation
+);
+
+    // Rules, one bit of violation each
+    localparam integer VALID_DROPPED   = 0;  // tvalid fell before its handshake
+    localparam integer PAYLOAD_CHANGED = 1;  // tdata, tlast or tid changed while stalled
+    localparam integer UNKNOWN         = 2;  // X or Z on the handshake, or on the payload while tvalid is high
+    localparam integer ENABLE_LOW      = 3;  // tvalid rose while enable was low (CHECK_ENABLE only)
+
+    // Previous Cycle
+    reg                  active;  // Out of reset for a cycle
+    reg                  stalled;
+    reg                  tvalid_q;
+    reg                  enable_q;
+    reg [DATA_WIDTH-1:0] tdata_q;
+    reg                  tlast_q;
+    reg [  ID_WIDTH-1:0] tid_q;
+
+    initial begin
+        violation = 0;
+    end
+
+    always @(posedge aclk) begin
+        if (aresetn !== 1'b1) begin
+            active   <= 1'b0;
+            stalled  <= 1'b0;
+            tvalid_q <= 1'b0;
+            enable_q <= 1'b1;
+
+            violation <= 0;  // Each test of a simulation starts checked
+        end else begin
+            active   <= 1'b1;
+            stalled  <= tvalid === 1'b1 && tready !== 1'b1;
+            tvalid_q <= tvalid === 1'b1;
+            enable_q <= enable === 1'b1;
+            tdata_q  <= tdata;
+            tlast_q  <= tlast;
+            tid_q    <= tid;
+
+            if (stalled && tvalid !== 1'b1) begin
+                violation[VALID_DROPPED] <= 1'b1;
+            end
+            if (stalled && tvalid === 1'b1 && {tdata, tlast, tid} !== {tdata_q, tlast_q, tid_q}) begin
+                violation[PAYLOAD_CHANGED] <= 1'b1;
+            end
+            if (active && (^{tvalid, tready} === 1'bx || (tvalid === 1'b1 && ^{tdata, tlast, tid} === 1'bx))) begin
+                violation[UNKNOWN] <= 1'b1;
+            end
+            if (CHECK_ENABLE && tvalid === 1'b1 && !tvalid_q && !enable_q) begin
+                violation[ENABLE_LOW] <= 1'b1;
+            end
+        end
+    end
+
+endmodule
@@ -0,0 +1,260 @@
+"""Content-addressed build cache for `cocotb_test.simulator.run`
+
+A compiled simulation image is keyed by a hash of everything that goes
+into the compile step: the simulator and its version, the toplevel, the
+contents of the Verilog sources and of the files they include, defines,
+parameters, compile arguments and `sim_args`. Runs with the same key share
+one build directory, so changing only the Python testbench never triggers a
+recompile, while changing the RTL or a parameter always does.
+
+Entries live in `sim_build/cache/<key>` and are evicted by age and by total
+size. A simulation holds a shared lock on its entry while it runs, compiles
+and evictions take it exclusively, so an entry is never removed or rebuilt
+under a running simulation. Simulators whose run step rebuilds the image,
+like Verilator rerunning verilator and make, hold the lock exclusively for
+the whole run instead. Outputs of a run, like the waveforms of `WAVES=1`,
+go to its `work_dir`, so runs sharing an entry must each pass their own;
+without one, a run with waves holds the lock exclusively too. Each run logs
+whether it hit the cache. The cache is configured through environment
+variables:
+
+    SIM_CACHE=0              disable the cache
+    SIM_CACHE_SIZE_MB=2048   maximum total size of all entries
+    SIM_CACHE_AGE_DAYS=14    entries unused for longer are removed
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import subprocess
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+
+import cocotb
+import cocotb_test.simulator
+
+try:
+    import fcntl
+except ImportError:  # Windows, entries are not locked
+    fcntl = None
+
+STAMP_FILE = "cache.json"
+
+# Commands printing the version of each simulator supported by cocotb-test
+VERSION_COMMANDS = {
+    "icarus": ["iverilog", "-V"],
+    "verilator": ["verilator", "--version"],
+    "questa": ["vsim", "-version"],
+    "modelsim": ["vsim", "-version"],
+    "ius": ["irun", "-version"],
+    "xcelium": ["xrun", "-version"],
+    "vcs": ["vcs", "-ID"],
+    "ghdl": ["ghdl", "--version"],
+    "nvc": ["nvc", "--version"],
+    "riviera": ["vsimsa", "-version"],
+    "activehdl": ["vsimsa", "-version"],
+}
+
+# Simulators whose run step regenerates the build directory before simulating
+REBUILT_ON_RUN = {"verilator"}
+
+INCLUDE_PATTERN = re.compile(rb'`include\s+"([^"]+)"')
+
+
+@lru_cache(maxsize=None)
+def simulator_version(simulator):
+    """First line printed by the simulator's version command"""
+    try:
+        result = subprocess.run(VERSION_COMMANDS[simulator], capture_output=True, timeout=30)
+    except (KeyError, OSError, subprocess.SubprocessError):
+        return "unknown"
+    output = (result.stdout or result.stderr).decode(errors="replace").strip()
+    return output.splitlines()[0] if output else "unknown"
+
+
+def _flatten(sources):
+    if isinstance(sources, dict):
+        return [path for paths in sources.values() for path in paths]
+    return list(sources or [])
+
+
+def _hash_file(path, hasher, include_dirs, seen):
+    """Hash a source file followed by every file it includes"""
+    path = os.path.abspath(path)
+    if path in seen:
+        return
+    seen.add(path)
+
+    with open(path, "rb") as f:
+        content = f.read()
+    hasher.update(path.encode())
+    hasher.update(hashlib.sha256(content).digest())
+
+    for name in INCLUDE_PATTERN.findall(content):
+        name = name.decode()
+        for directory in [os.path.dirname(path)] + include_dirs:
+            candidate = os.path.join(directory, name)
+            if os.path.isfile(candidate):
+                _hash_file(candidate, hasher, include_dirs, seen)
+                break
+
+
+def cache_key(simulator, **kwargs):
+    """Hash of the compile inputs of a `cocotb_test.simulator.run` call"""
+    include_dirs = [os.path.abspath(path) for path in kwargs.get("includes") or []]
+
+    hasher = hashlib.sha256()
+    seen = set()
+    for path in _flatten(kwargs.get("verilog_sources")) + _flatten(kwargs.get("vhdl_sources")):
+        _hash_file(path, hasher, include_dirs, seen)
+
+    description = {
+        "simulator": simulator,
+        "simulator_version": simulator_version(simulator),
+        "cocotb_version": cocotb.__version__,
+        "toplevel": kwargs.get("toplevel"),
+        "toplevel_lang": kwargs.get("toplevel_lang", "verilog"),
+        "sources": hasher.hexdigest(),
+        "includes": include_dirs,
+        "defines": kwargs.get("defines") or [],
+        "parameters": {key: str(value) for key, value in (kwargs.get("parameters") or {}).items()},
+        "compile_args": kwargs.get("compile_args") or [],
+        "verilog_compile_args": kwargs.get("verilog_compile_args") or [],
+        "vhdl_compile_args": kwargs.get("vhdl_compile_args") or [],
+        "extra_args": kwargs.get("extra_args") or [],
+        "sim_args": kwargs.get("sim_args") or [],
+        "make_args": kwargs.get("make_args") or [],
+        "timescale": kwargs.get("timescale"),
+        "waves": bool(kwargs.get("waves", int(os.getenv("WAVES", 0)))),
+    }
+    digest = hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()
+    return digest[:24], description
+
+
+def _tree_size(path):
+    size = 0
+    for directory, _, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.path.getsize(os.path.join(directory, name))
+            except OSError:
+                pass
+    return size
+
+
+def _touch_tree(path):
+    """Make every file of an entry newer than its sources, so no tool rebuilds it"""
+    now = time.time()
+    for directory, _, files in os.walk(path):
+        for name in files:
+            os.utime(os.path.join(directory, name), (now, now))
+
+
+class BuildCache:
+    """Content-addressed store of simulator build directories"""
+    def __init__(self, root, max_size_bytes=2048 * 2**20, max_age_s=14 * 24 * 3600):
+        self.root = root
+        self.max_size_bytes = max_size_bytes
+        self.max_age_s = max_age_s
+        self.log = logging.getLogger("cocotb")
+
+    @classmethod
+    def from_env(cls, build_root):
+        """Cache configured by the `SIM_CACHE*` environment variables, None if disabled"""
+        if os.getenv("SIM_CACHE", "1") == "0":
+            return None
+        return cls(
+            os.path.join(build_root, "cache"),
+            max_size_bytes=float(os.getenv("SIM_CACHE_SIZE_MB", 2048)) * 2**20,
+            max_age_s=float(os.getenv("SIM_CACHE_AGE_DAYS", 14)) * 24 * 3600,
+        )
+
+    @contextmanager
+    def _lock(self, entry, shared=False, blocking=True):
+        """Shared or exclusive lock of an entry, yields False if non-blocking and already taken"""
+        if fcntl is None:
+            yield True
+            return
+        os.makedirs(self.root, exist_ok=True)
+        path = entry + ".lock"
+        while True:
+            with open(path, "a") as f:
+                try:
+                    fcntl.flock(f, (fcntl.LOCK_SH if shared else fcntl.LOCK_EX) | (0 if blocking else fcntl.LOCK_NB))
+                except BlockingIOError:
+                    yield False
+                    return
+                try:
+                    # An eviction removed the lock file while we waited for it, lock the new one
+                    if not os.path.exists(path) or not os.path.samestat(os.fstat(f.fileno()), os.stat(path)):
+                        continue
+                    yield True
+                    return
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def run(self, simulator, **kwargs):
+        """`cocotb_test.simulator.run` in the cached build directory of its key"""
+        __tracebackhide__ = True  # Hide the traceback when using PyTest.
+
+        key, description = cache_key(simulator, **kwargs)
+        entry = os.path.join(self.root, key)
+        stamp = os.path.join(entry, STAMP_FILE)
+        kwargs["sim_build"] = entry
+        # Run outputs written to the entry itself would be overwritten by concurrent runs
+        shared = simulator not in REBUILT_ON_RUN and (kwargs.get("work_dir") is not None or not description["waves"])
+
+        compiled = False
+        while True:
+            # Compiled entries are simulated under the lock, which keeps evictions and compiles out
+            with self._lock(entry, shared=shared):
+                if os.path.isfile(stamp):
+                    self.log.info(f"Build cache {'miss, compiled' if compiled else 'hit'} {key} for {kwargs['toplevel']}")
+                    _touch_tree(entry)
+                    self.evict(keep=entry)
+                    return cocotb_test.simulator.run(**kwargs)
+
+            with self._lock(entry):
+                if not os.path.isfile(stamp):
+                    compiled = True
+                    shutil.rmtree(entry, ignore_errors=True)  # Leftovers of a failed compile
+                    cocotb_test.simulator.run(**dict(kwargs, compile_only=True))
+                    with open(stamp, "w") as f:
+                        json.dump(description, f, indent=2)
+
+    def evict(self, keep=None):
+        """Remove entries unused for longer than max_age_s, then the oldest ones above max_size_bytes"""
+        if not os.path.isdir(self.root):
+            return
+
+        now = time.time()
+        entries = []
+        for name in os.listdir(self.root):
+            entry = os.path.join(self.root, name)
+            if not os.path.isdir(entry) or entry == keep:
+                continue
+            stamp = os.path.join(entry, STAMP_FILE)
+            last_used = os.path.getmtime(stamp if os.path.isfile(stamp) else entry)
+            entries.append((last_used, entry))
+        entries.sort()
+
+        total_size = sum(_tree_size(entry) for _, entry in entries)
+        if keep is not None:
+            total_size += _tree_size(keep)
+
+        for last_used, entry in entries:
+            if now - last_used <= self.max_age_s and total_size <= self.max_size_bytes:
+                break
+            with self._lock(entry, blocking=False) as locked:
+                if not locked:
+                    continue  # Simulated or compiled by another process
+                size = _tree_size(entry)
+                shutil.rmtree(entry, ignore_errors=True)
+                total_size -= size
+                try:
+                    os.remove(entry + ".lock")
+                except OSError:
+                    pass
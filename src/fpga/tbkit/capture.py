@@ -0,0 +1,175 @@
+"""Failure-windowed waveform capture of AXI-Stream interfaces
+
+Instead of dumping the waveforms of a whole run, `SignalCapture` keeps a
+few interface signals over the last `CAPTURE_CYCLES` cycles (0 by default,
+e.g. `CAPTURE_CYCLES=1024` enables it) and only writes them out as a VCD
+file when a test fails. Passing runs never touch the disk. Like
+`AxisHandshakeMonitor` it sleeps until a signal changes and then samples
+the next rising edge, so it only stores the cycles where a value changes.
+
+Captures register themselves while their test runs. Tests and forked
+checkers decorated with `dump_on_failure` write all live captures to
+`<CAPTURE_DIR>/<test>.vcd` on any error, failed assertion or timeout. A
+failing forked coroutine ends the test without raising in it, so decorate
+checkers started with `cocotb.start_soon` as well:
+
+    @dump_on_failure
+    async def protocol_checker(dut):
+        ...
+
+    @cocotb.test()
+    @dump_on_failure
+    async def run_test(dut):
+        tb = TB(dut)  # AxisTB captures s_axis_*, m_axis_* and enable
+        cocotb.start_soon(protocol_checker(dut))
+"""
+import functools
+import logging
+import os
+from collections import deque
+
+import cocotb
+import cocotb.utils
+from cocotb.triggers import RisingEdge, Edge, First
+
+from .trace import close_traces, current_test_name
+
+CYCLES_ENV = "CAPTURE_CYCLES"
+DIR_ENV = "CAPTURE_DIR"
+
+AXIS_SIGNALS = ["tdata", "tvalid", "tready", "tlast", "tid", "tkeep", "tuser", "tdest"]
+
+_active = []  # Captures started by tests, the ones of finished tests are no longer running
+
+END_CHECKS = []  # Called when a decorated coroutine returns, e.g. by tbkit.protocol to check the last cycles
+
+
+def capture_cycles():
+    """Ring buffer depth selected by the `CAPTURE_CYCLES` environment variable"""
+    return int(os.getenv(CYCLES_ENV, 0))
+
+
+def capture_path(name):
+    return os.path.join(os.getenv(DIR_ENV, "captures"), f"{name}.vcd")
+
+
+class SignalCapture:
+    """Values of some signals over the last `depth` clock cycles, as the cycles where they change"""
+    def __init__(self, clock, signals, clk_period_ns, depth=1024):
+        self.clock = clock
+        self.names = list(signals)
+        self.handles = [signals[name] for name in self.names]
+        self.widths = [len(handle) for handle in self.handles]
+        self.clk_period_ns = clk_period_ns
+        self.depth = depth
+        self.samples = deque()  # (time, values) of each change, held until the next one
+        self.dumped = False
+
+        _active[:] = [capture for capture in _active if not capture._cr.done()]
+        _active.append(self)
+        self._cr = cocotb.start_soon(self._run())
+
+    @classmethod
+    def axis(cls, dut, clk_period_ns, depth=1024, extra=("aresetn", "enable")):
+        """Capture the s_axis and m_axis signals of a DUT, plus the extra ones it has"""
+        names = [f"{bus}_{signal}" for bus in ("s_axis", "m_axis") for signal in AXIS_SIGNALS] + list(extra)
+        signals = {name: getattr(dut, name) for name in names if hasattr(dut, name)}
+        return cls(dut.aclk, signals, clk_period_ns, depth)
+
+    async def _run(self):
+        clock_edge = RisingEdge(self.clock)
+        change = First(*(Edge(handle) for handle in self.handles))
+        while True:
+            await clock_edge
+            # Values sampled at an edge held during the cycle before it
+            self._record(cocotb.utils.get_sim_time("ns") - self.clk_period_ns,
+                         tuple(handle.value.binstr for handle in self.handles))
+            await change
+
+    def _record(self, time, values):
+        if self.samples and values == self.samples[-1][1]:
+            return
+        self.samples.append((time, values))
+        # Drop the changes superseded before the first cycle of the window
+        start = time - (self.depth - 1) * self.clk_period_ns
+        while len(self.samples) > 1 and self.samples[1][0] <= start:
+            self.samples.popleft()
+
+    def write_vcd(self, path, end=None):
+        """Write the captured cycles up to the one starting at `end` (the last one by default), with a reconstructed clock, as a VCD file"""
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        if end is None:
+            end = cocotb.utils.get_sim_time("ns") - self.clk_period_ns
+        start = end - (self.depth - 1) * self.clk_period_ns
+
+        ids = [_vcd_id(i + 1) for i in range(len(self.names))]
+        clock_id = _vcd_id(0)
+        half_period = self.clk_period_ns / 2
+
+        with open(path, "w") as f:
+            f.write("$timescale 1ps $end\n$scope module capture $end\n")
+            f.write(f"$var wire 1 {clock_id} {self.clock._name} $end\n")
+            for name, width, id in zip(self.names, self.widths, ids):
+                f.write(f"$var wire {width} {id} {name} $end\n")
+            f.write("$upscope $end\n$enddefinitions $end\n")
+
+            previous = [None] * len(self.names)
+            samples = list(self.samples)
+            for i, (time, values) in enumerate(samples):
+                next_time = samples[i + 1][0] if i + 1 < len(samples) else end + self.clk_period_ns
+                time = max(time, start)
+                cycles = round((min(next_time, end + self.clk_period_ns) - time) / self.clk_period_ns)
+                for cycle in range(cycles):
+                    cycle_time = time + cycle * self.clk_period_ns
+                    f.write(f"#{round(cycle_time * 1000)}\n1{clock_id}\n")
+                    for j, (value, width, id) in enumerate(zip(values, self.widths, ids)):
+                        if value != previous[j]:
+                            f.write(f"{value}{id}\n" if width == 1 else f"b{value} {id}\n")
+                            previous[j] = value
+                    f.write(f"#{round((cycle_time + half_period) * 1000)}\n0{clock_id}\n")
+        return path
+
+
+def _vcd_id(i):
+    """Short printable VCD identifier of a signal index"""
+    id = ""
+    while True:
+        id += chr(33 + i % 94)
+        i //= 94
+        if i == 0:
+            return id
+
+
+def dump_captures(log=None):
+    """Write the live captures of the running test once, returning their paths"""
+    log = log or logging.getLogger("cocotb.tb")
+    captures = [capture for capture in _active if not capture._cr.done() and not capture.dumped]
+    paths = []
+    for i, capture in enumerate(captures):
+        capture.dumped = True
+        name = current_test_name() + (f".{i}" if i else "")
+        paths.append(capture.write_vcd(capture_path(name)))
+        log.error(f"Last {capture.depth} cycles written to {paths[-1]}")
+    return paths
+
+
+def dump_on_failure(func):
+    """Write the captures of the running test when a coroutine function fails
+
+    When it returns, the `END_CHECKS` run first and may fail it as well.
+    Either way, the stimulus trace being recorded is closed.
+    """
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        try:
+            result = await func(*args, **kwargs)
+            for check in END_CHECKS:
+                check()
+            return result
+        except BaseException:
+            dump_captures()
+            raise
+        finally:
+            close_traces()
+    return wrapper
@@ -0,0 +1,129 @@
+"""Wrapper top-levels chaining pipeline modules
+
+`generate_chain` writes a Verilog module connecting an ordered list of
+pipeline modules m_axis to s_axis, with the s_axis and m_axis ports of the
+first and last stage, so the single-module testbenches run unchanged on the
+chain. Stages are module names or (module, parameters) pairs:
+
+    generate_chain("chain_skid_gating_prefetch",
+                   ["axis_skid_buffer", ("axis_gating", {}), "axis_prefetch"],
+                   "sim_build/chain_skid_gating_prefetch.v")
+
+Every axis_gating stage shares the `enable` input of the wrapper, which only
+exists when the chain has one. The DATA_WIDTH of the wrapper is passed down
+to every stage.
+"""
+import os
+
+# Width parameters of each module, set to the DATA_WIDTH of the wrapper
+WIDTH_PARAMETERS = {
+    "axis_half_buffer": ["DATA_WIDTH"],
+    "axis_prefetch": ["DATA_WIDTH"],
+    "axis_skid_buffer": ["DATA_WIDTH"],
+    "axis_gating": ["DATA_WIDTH"],
+    "axis_fifo_pipeline": ["INPUT_WIDTH", "OUTPUT_WIDTH"],
+}
+
+AXIS_SIGNALS = ["tdata", "tvalid", "tready", "tlast"]
+
+# Connections of the ports beyond the common AXI-Stream ones
+EXTRA_PORTS = {
+    "axis_gating": {"enable": "enable"},
+    "axis_fifo_pipeline": {"overflow": ""},
+}
+
+
+def chain_stages(stages):
+    """Stages as (module, parameters) pairs"""
+    normalized = []
+    for stage in stages:
+        module, parameters = (stage, {}) if isinstance(stage, str) else stage
+        if module not in WIDTH_PARAMETERS:
+            raise ValueError(f"Cannot chain {module}, expected one of {', '.join(WIDTH_PARAMETERS)}")
+        normalized.append((module, dict(parameters)))
+    if not normalized:
+        raise ValueError("A chain needs at least one stage")
+    return normalized
+
+
+def chain_modules(stages):
+    """Distinct modules of a chain, in order"""
+    return list(dict.fromkeys(module for module, _ in chain_stages(stages)))
+
+
+def chain_verilog(name, stages, data_width=32):
+    """Source of a wrapper module chaining the stages"""
+    stages = chain_stages(stages)
+    gated = any(module == "axis_gating" for module, _ in stages)
+
+    lines = [
+        f"module {name} #(",
+        f"    parameter integer DATA_WIDTH = {data_width}",
+        ") (",
+        "    input wire aclk,",
+        "    input wire aresetn,",
+        "",
+    ]
+    if gated:
+        lines += ["    input wire enable,", ""]
+    lines += [
+        "    input  wire [DATA_WIDTH-1:0] s_axis_tdata,",
+        "    input  wire                  s_axis_tvalid,",
+        "    output wire                  s_axis_tready,",
+        "    input  wire                  s_axis_tlast,",
+        "",
+        "    output wire [DATA_WIDTH-1:0] m_axis_tdata,",
+        "    output wire                  m_axis_tvalid,",
+        "    input  wire                  m_axis_tready,",
+        "    output wire                  m_axis_tlast",
+        ");",
+        "",
+        "    // Stage Interfaces, axis_0 is the input and stage i drives axis_i",
+    ]
+    for i in range(1, len(stages)):
+        lines += [
+            f"    wire [DATA_WIDTH-1:0] axis_{i}_tdata;",
+            f"    wire                  axis_{i}_tvalid;",
+            f"    wire                  axis_{i}_tready;",
+            f"    wire                  axis_{i}_tlast;",
+        ]
+
+    def interface(i, signal):
+        if i == 0:
+            return f"s_axis_{signal}"
+        if i == len(stages):
+            return f"m_axis_{signal}"
+        return f"axis_{i}_{signal}"
+
+    for i, (module, parameters) in enumerate(stages):
+        overrides = {width: "DATA_WIDTH" for width in WIDTH_PARAMETERS[module]}
+        overrides.update({key: str(value) for key, value in parameters.items()})
+        ports = [("aclk", "aclk"), ("aresetn", "aresetn")]
+        ports += [(f"s_axis_{signal}", interface(i, signal)) for signal in AXIS_SIGNALS]
+        ports += [(f"m_axis_{signal}", interface(i + 1, signal)) for signal in AXIS_SIGNALS]
+        ports += list(EXTRA_PORTS.get(module, {}).items())
+
+        lines += ["", f"    // Stage {i + 1}: {module}", f"    {module} #("]
+        lines += [f"        .{key}({value})" + ("," if j < len(overrides) - 1 else "")
+                  for j, (key, value) in enumerate(overrides.items())]
+        lines += [f"    ) stage_{i + 1}_inst ("]
+        lines += [f"        .{port}({signal})" + ("," if j < len(ports) - 1 else "")
+                  for j, (port, signal) in enumerate(ports)]
+        lines += ["    );"]
+
+    lines += ["", "endmodule", ""]
+    return "\n".join(lines)
+
+
+def generate_chain(name, stages, path, data_width=32):
+    """Write the wrapper of a chain, only touching the file when it changes"""
+    source = chain_verilog(name, stages, data_width)
+    if os.path.isfile(path):
+        with open(path) as f:
+            if f.read() == source:
+                return path
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(source)
+    return path
@@ -0,0 +1,261 @@
+"""Functional coverage of AXI-Stream interfaces with coverage-driven early stop
+
+`AxisCoverage` covers the handshake, tlast, enable and reset signals of a
+DUT without a coroutine of its own: `AxisTB` hands it to the output
+`AxisHandshakeMonitor`, which also wakes on these signals and samples the
+coverage at the same rising edges as its handshake state. Each sample packs
+the signals, plus whether the input is inside a frame and the enable of the
+previous cycle, into a state code. Each cycle only adds to the counter of its code in a flat
+histogram; the bins are masks over the code, so the bins a code hits are
+precomputed bitmaps and the per-cycle cost does not grow with the bins.
+
+A bin is hit once per episode, i.e. each time the interfaces enter a state
+of the bin, and is saturated after `COVERAGE_GOAL` episodes (default 8, 0
+disables coverage). Tests stop their stimulus as soon as every bin is
+saturated instead of running a fixed number of frames:
+
+    frames = until_covered(iter_random_frames(num=1000, size=16), tb.coverage)
+    await AxisStreamDriver(tb, scoreboard, frames).run()
+    tb.coverage.log_summary(tb.log)
+"""
+import logging
+import os
+from array import array
+
+import cocotb.utils
+from cocotb.triggers import Event
+
+GOAL_ENV = "COVERAGE_GOAL"
+
+# Bits of a state code
+S_VALID = 1 << 0
+S_READY = 1 << 1
+S_LAST = 1 << 2
+M_VALID = 1 << 3
+M_READY = 1 << 4
+M_LAST = 1 << 5
+ENABLE = 1 << 6
+ENABLE_BEFORE = 1 << 7  # enable during the previous cycle
+IN_FRAME = 1 << 8  # a beat without tlast was accepted on the input
+IN_RESET = 1 << 9
+STATE_BITS = 10
+
+SIGNAL_BITS = {
+    "s_axis_tvalid": S_VALID,
+    "s_axis_tready": S_READY,
+    "s_axis_tlast": S_LAST,
+    "m_axis_tvalid": M_VALID,
+    "m_axis_tready": M_READY,
+    "m_axis_tlast": M_LAST,
+    "enable": ENABLE,
+}
+
+
+class CoverBin:
+    """States whose code matches `value` on the bits of `mask`, outside reset"""
+    def __init__(self, name, mask, value, description=""):
+        self.name = name
+        self.mask = mask | IN_RESET
+        self.value = value
+        self.description = description
+
+    def matches(self, code):
+        return code & self.mask == self.value
+
+
+AXIS_BINS = [
+    CoverBin("buffer_full", S_READY, 0, "input not ready, e.g. a full buffer"),
+    CoverBin("full_under_backpressure", S_READY | M_VALID | M_READY, M_VALID, "input not ready while the output is backpressured"),
+    CoverBin("input_stall", S_VALID | S_READY, S_VALID, "input backpressured, e.g. by a full buffer"),
+    CoverBin("output_stall", M_VALID | M_READY, M_VALID, "output backpressured"),
+    CoverBin("both_stalled", S_VALID | S_READY | M_VALID | M_READY, S_VALID | M_VALID, "both sides stalled at once"),
+    CoverBin("output_starved", M_VALID | M_READY, M_READY, "output ready without data"),
+    CoverBin("input_tlast_stall", S_VALID | S_READY | S_LAST, S_VALID | S_LAST, "input tlast backpressured"),
+    CoverBin("output_tlast_stall", M_VALID | M_READY | M_LAST, M_VALID | M_LAST, "output tlast backpressured"),
+]
+
+GATE_BINS = [
+    CoverBin("gate_closed_mid_frame", ENABLE | ENABLE_BEFORE | IN_FRAME, ENABLE_BEFORE | IN_FRAME, "enable falls inside an input frame"),
+    CoverBin("gate_opened_mid_frame", ENABLE | ENABLE_BEFORE | IN_FRAME, ENABLE | IN_FRAME, "enable rises inside an input frame"),
+]
+
+# Bins of states a DUT never reaches, e.g. input_stall of a DUT that is always ready
+INPUT_STALL_BINS = ("buffer_full", "full_under_backpressure", "input_stall", "both_stalled", "input_tlast_stall")
+
+
+def coverage_goal():
+    """Episodes per bin selected by the `COVERAGE_GOAL` environment variable"""
+    return int(os.getenv(GOAL_ENV, 8))
+
+
+class AxisCoverage:
+    """Histogram of the interface states of a DUT and episode counters of its bins
+
+    Sampled by the `AxisHandshakeMonitor` it is passed to, which wakes on the
+    `watched` signals.
+    """
+    def __init__(self, signals, clk_period_ns, bins=AXIS_BINS, goal=8, reset=None):
+        self.names = list(signals)
+        self.handles = [signals[name] for name in self.names]
+        self.bits = [SIGNAL_BITS[name] for name in self.names]
+        self.reset = reset
+        self.watched = self.handles + ([reset] if reset is not None else [])
+        self._init_counters(bins, goal, clk_period_ns, ENABLE if "enable" not in signals else 0)
+
+    @classmethod
+    def axis(cls, dut, clk_period_ns, goal=8, exclude=()):
+        """Cover the s_axis and m_axis interfaces of a DUT, and its gate if it has an enable input"""
+        signals = {name: getattr(dut, name) for name in SIGNAL_BITS if hasattr(dut, name)}
+        bins = AXIS_BINS + (GATE_BINS if "enable" in signals else [])
+        bins = [b for b in bins if b.name not in exclude]
+        return cls(signals, clk_period_ns, bins, goal, reset=getattr(dut, "aresetn", None))
+
+    def _init_counters(self, bins, goal, clk_period_ns, constant=0):
+        self.bins = list(bins)
+        self.goal = goal
+        self.clk_period_ns = clk_period_ns
+        self._constant = constant  # Bits of signals the DUT does not have, held high
+
+        self.counts = array("Q", bytes(8 << STATE_BITS))  # Cycles per state code
+        self.episodes = [0] * len(self.bins)
+        self._hits = [sum(1 << i for i, b in enumerate(self.bins) if b.matches(code)) for code in range(1 << STATE_BITS)]
+        self._pending = (1 << len(self.bins)) - 1 if goal > 0 else 0
+        self.saturated = Event()
+        if not self._pending:
+            self.saturated.set()
+
+        self._code = IN_RESET  # Code of the last cycle counted
+        self._history = 0
+        self._first = self._rest = None
+        self._time = None
+
+    def _sample(self):
+        state = self._constant
+        for handle, bit in zip(self.handles, self.bits):
+            if str(handle.value) == "1":
+                state |= bit
+        if self.reset is not None and str(self.reset.value) != "1":
+            state |= IN_RESET
+        return state
+
+    def sample(self, time):
+        """Sample the signals at the rising edge at `time`, they held since the previous sample"""
+        self._advance(time)
+        self._enter(self._sample(), time)
+
+    def _enter(self, state, time):
+        """Start a run of cycles in `state` at the edge at `time`"""
+        first = state | self._history
+        if state & IN_RESET:
+            history = 0
+        else:
+            in_frame = self._history & IN_FRAME
+            if state & (S_VALID | S_READY) == S_VALID | S_READY:
+                in_frame = 0 if state & S_LAST else IN_FRAME
+            history = in_frame | (ENABLE_BEFORE if state & ENABLE else 0)
+        rest = state | history  # Code of the cycles after the first one of the run
+
+        self._count_episodes(self._code, first)
+        self._count_episodes(first, rest)
+        self._code = rest
+        self._history = history
+        self._first, self._rest = first, rest
+        self._time = time
+
+    def _advance(self, time):
+        """Count the cycles of the current run up to the edge at `time`"""
+        if self._time is None:
+            return
+        cycles = round((time - self._time) / self.clk_period_ns)
+        if cycles <= 0:
+            return
+        self.counts[self._first] += 1
+        self.counts[self._rest] += cycles - 1
+        self._first = self._rest
+        self._time = time
+
+    def _count_episodes(self, before, after):
+        entered = self._hits[after] & ~self._hits[before]
+        if not entered:
+            return
+        i = 0
+        while entered:
+            if entered & 1:
+                self.episodes[i] += 1
+                if self.episodes[i] >= self.goal:
+                    self._pending &= ~(1 << i)
+            entered >>= 1
+            i += 1
+        if not self._pending and not self.saturated.is_set():
+            self.saturated.set()
+
+    @property
+    def covered(self):
+        """Whether every bin reached its goal"""
+        return not self._pending
+
+    def missing(self):
+        """Names of the bins below their goal"""
+        return [b.name for i, b in enumerate(self.bins) if self._pending >> i & 1]
+
+    async def wait(self):
+        """Wait until every bin reached its goal"""
+        await self.saturated.wait()
+
+    def summary(self, time=None):
+        """Episodes and cycles of each bin, the current run counted up to `time` (now by default)"""
+        if self._time is not None:
+            self._advance(time if time is not None else cocotb.utils.get_sim_time(units="ns"))
+        cycles = [0] * len(self.bins)
+        for code, count in enumerate(self.counts):
+            if count:
+                hits = self._hits[code]
+                for i in range(len(self.bins)):
+                    if hits >> i & 1:
+                        cycles[i] += count
+        total = sum(count for code, count in enumerate(self.counts) if not code & IN_RESET)
+        return {
+            "cycles": total,
+            "bins": {b.name: {"episodes": self.episodes[i], "cycles": cycles[i]} for i, b in enumerate(self.bins)},
+            "covered": self.covered,
+        }
+
+    def metrics(self):
+        """Flat metrics of the summary, for `results.record`"""
+        summary = self.summary()
+        metrics = {"coverage_bins_saturated": len(self.bins) - len(self.missing()), "coverage_bins": len(self.bins)}
+        for name, counts in summary["bins"].items():
+            metrics[f"coverage_{name}_episodes"] = counts["episodes"]
+        return metrics
+
+    def log_summary(self, log=None):
+        log = log or logging.getLogger("cocotb.tb")
+        summary = self.summary()
+        log.info(f"==== Coverage (goal {self.goal} episodes per bin) ====")
+        log.info(f"{'Bin':<24}{'Episodes':>10}{'Cycles':>10}{'Share':>8}")
+        for name, counts in summary["bins"].items():
+            share = counts["cycles"] / summary["cycles"] * 100 if summary["cycles"] else 0.0
+            log.info(f"{name:<24}{counts['episodes']:>10}{counts['cycles']:>10}{share:>7.1f}%")
+        if self.covered:
+            log.info(f"All {len(self.bins)} bins saturated")
+        else:
+            log.info(f"Below goal: {', '.join(self.missing())}")
+        log.info(f"==============================================")
+
+
+def until_covered(iterable, coverage, log=None):
+    """Yield from iterable until every bin of coverage reached its goal
+
+    With coverage disabled (None) the iterable is passed through, so the
+    stimulus bound of the test applies.
+    """
+    if coverage is None:
+        yield from iterable
+        return
+    count = 0
+    for item in iterable:
+        if coverage.covered:
+            (log or logging.getLogger("cocotb.tb")).info(f"Coverage saturated after {count} items, stopping stimulus")
+            return
+        yield item
+        count += 1
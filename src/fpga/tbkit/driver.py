@@ -0,0 +1,89 @@
+"""Streaming AXI-Stream driver keeping a bounded number of frames in flight"""
+import math
+
+import cocotb
+from cocotb.triggers import Event
+from cocotbext.axi import AxiStreamFrame
+
+
+class AxisStreamDriver:
+    """Stream frames from an iterator through the DUT in constant memory
+
+    Instead of queueing the whole stimulus up front, the driver pulls a frame
+    from the iterator only when fewer than `max_in_flight` frames are between
+    the source and the sink, and checks every received frame against the
+    scoreboard as soon as the sink completes it. The source queue, the
+    scoreboard and the sink therefore never hold more than `max_in_flight`
+    frames, however long the run is.
+
+    `tid` is an optional callable returning the tid of each new frame.
+    """
+    def __init__(self, tb, scoreboard, frames, max_in_flight=16, latency=None, tid=None):
+        self.tb = tb
+        self.scoreboard = scoreboard
+        self.frames = frames
+        self.max_in_flight = max_in_flight
+        self.latency = latency
+        self.tid = tid
+
+        self.frame_count = 0
+        self.total_bytes = 0
+        self.max_frame_beats = 1
+
+        self._credit = Event()
+
+    async def _produce(self):
+        for frame in self.frames:
+            while self.scoreboard.pending >= self.max_in_flight:
+                self._credit.clear()
+                await self._credit.wait()
+
+            self.max_frame_beats = max(self.max_frame_beats, math.ceil(len(frame) / self.tb.width_bytes))
+            tid = self.tid() if self.tid is not None else None
+            context = self.latency.ingress(frame) if self.latency is not None else None
+            self.scoreboard.expect(frame, tid=tid, context=context)
+            await self.tb.source.send(AxiStreamFrame(frame, tid=tid))
+
+    async def run(self, timeout_ns=None, allow_truncation=False):
+        """Stream every frame of the iterator and return the number of frames received
+
+        Fails if the sink stays idle for timeout_ns while frames are expected,
+        by default `drain_timeout_ns` of the longest frame sent. A lossy DUT
+        idle without output has dropped the frames still pending instead: they
+        stop holding credit, and once all frames are sent the run ends.
+        """
+        producer = cocotb.start_soon(self._produce())
+        sink = self.tb.sink
+
+        while not (producer.done() and self.scoreboard.empty()):
+            if producer.done() and self.scoreboard.lossy:
+                async for frame in self.tb.drain(lossy=True):
+                    self._check(frame, allow_truncation)
+                break
+
+            await sink.wait(timeout_ns or self.tb.drain_timeout_ns(self.max_frame_beats), "ns")
+            if sink.empty():
+                if sink.active:
+                    continue  # Frame still arriving
+                if self.scoreboard.lossy:
+                    # Dropped frames stay pending until a later one is matched, none comes from an idle DUT
+                    await self.tb.wait_idle(lossy=True)
+                    if sink.empty() and not sink.active:
+                        self.scoreboard.drop_pending()
+                        self._credit.set()
+                    continue
+                producer.kill()
+                raise RuntimeError("Timeout waiting for frame from sink")
+
+            self._check(sink.recv_nowait(compact=False), allow_truncation)
+
+        await producer  # Re-raise errors of the frame iterator
+        return self.frame_count
+
+    def _check(self, frame, allow_truncation):
+        self.frame_count += 1
+        self.total_bytes += len(frame)
+        expected = self.scoreboard.check(frame, allow_truncation=allow_truncation)
+        if self.latency is not None:
+            self.latency.egress(frame, expected.context)
+        self._credit.set()
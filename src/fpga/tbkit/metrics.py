@@ -0,0 +1,57 @@
+"""Per-frame performance metrics of AXI-Stream pipelines"""
+import math
+from array import array
+
+import cocotb.utils
+import numpy as np
+
+
+class LatencyTracker:
+    """Per-frame latency from first-beat ingress to last-beat egress
+
+    Ingress is looked up on the input handshake timeline from the beat offset
+    of the frame in the input stream, egress is the time the sink saw the last
+    beat. Matching received frames with sent ones is left to the scoreboard,
+    which carries the start beat returned by `ingress` as context.
+    """
+    def __init__(self, tb):
+        self.tb = tb
+        self.sent_beats = 0
+        self.latencies_ns = array("d")
+
+    def ingress(self, frame):
+        """Record a frame queued to the source, in the order it is sent, and return its start beat"""
+        start_beat = self.sent_beats
+        self.sent_beats += math.ceil(len(frame) / self.tb.width_bytes)
+        return start_beat
+
+    def egress(self, frame, start_beat):
+        """Record a frame received from the sink and return its latency in ns"""
+        ingress_time = self.tb.input_monitor.beat_time(start_beat)
+        egress_time = cocotb.utils.get_time_from_sim_steps(frame.sim_time_end, "ns")
+        latency = egress_time - ingress_time
+        self.latencies_ns.append(latency)
+        return latency
+
+    def summary(self):
+        """Latency distribution in ns: min, p50, p99, max and jitter (standard deviation)"""
+        if not self.latencies_ns:
+            return None
+        latencies = np.array(self.latencies_ns, dtype=np.float64)
+        p50, p99 = np.percentile(latencies, [50, 99])
+        return {
+            "min": float(latencies.min()),
+            "p50": float(p50),
+            "p99": float(p99),
+            "max": float(latencies.max()),
+            "jitter": float(latencies.std()),
+        }
+
+    def log_summary(self, log):
+        summary = self.summary()
+        if summary is None:
+            log.info("Latency: no frames received")
+            return
+        log.info(f"Latency (min/p50/p99/max): {summary['min']:.0f}/{summary['p50']:.0f}/"
+                 f"{summary['p99']:.0f}/{summary['max']:.0f} ns")
+        log.info(f"Latency Jitter: {summary['jitter']:.2f} ns")
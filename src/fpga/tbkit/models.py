@@ -0,0 +1,360 @@
+"""Transaction-level models of the ready/valid behavior of the pipeline modules
+
+Each model mirrors the registers of its RTL module that decide tready and
+tvalid and moves beat tokens instead of data, so a few thousand cycles take
+milliseconds instead of a simulator run. `simulate` drives a model (or a
+chain of models) with a source and a sink that behave like the cocotbext
+ones, paused by the same `tbkit.pauses` patterns as the testbenches, and
+returns throughput and latency in the metric names of `tbkit.results`. That
+makes a model run directly comparable to an RTL run with
+`tbkit.results.compare`.
+
+    python -m tbkit.models axis_half_buffer --input 1.0 --output 0.7
+    python -m tbkit.models axis_skid_buffer axis_gating --gate 0.5
+"""
+import argparse
+import itertools
+import sys
+from dataclasses import dataclass, field
+
+import numpy as np
+
+from .pauses import pause_pattern
+
+
+class HalfBufferModel:
+    """axis_half_buffer: one register, accepts only when empty"""
+    def __init__(self):
+        self.valid = False
+        self.data = None
+
+    def m_valid(self):
+        return self.valid
+
+    def m_beat(self):
+        return self.data
+
+    def s_ready(self, m_ready):
+        return not self.valid
+
+    def clock(self, s_beat, m_handshake, enable=True):
+        if s_beat is not None:
+            self.valid = True
+            self.data = s_beat
+        elif m_handshake:
+            self.valid = False
+
+
+class PrefetchModel(HalfBufferModel):
+    """axis_prefetch: one register, tready passed through combinationally"""
+    def s_ready(self, m_ready):
+        return not self.valid or m_ready
+
+
+class SkidBufferModel:
+    """axis_skid_buffer: output register plus a skid register"""
+    EMPTY, ACTIVE, FULL = range(3)
+
+    def __init__(self):
+        self.state = self.EMPTY
+        self.data = None
+        self.buffer = None
+
+    def m_valid(self):
+        return self.state != self.EMPTY
+
+    def m_beat(self):
+        return self.data
+
+    def s_ready(self, m_ready):
+        return self.state != self.FULL
+
+    def clock(self, s_beat, m_handshake, enable=True):
+        if self.state == self.EMPTY:
+            if s_beat is not None:
+                self.data = s_beat
+                self.state = self.ACTIVE
+        elif self.state == self.ACTIVE:
+            if s_beat is not None and m_handshake:
+                self.data = s_beat
+            elif s_beat is not None:
+                self.buffer = s_beat
+                self.state = self.FULL
+            elif m_handshake:
+                self.state = self.EMPTY
+        elif m_handshake:
+            self.data = self.buffer
+            self.state = self.ACTIVE
+
+
+class GatingModel:
+    """axis_gating: two-entry buffer whose output stalls while enable is low"""
+    EMPTY, ACTIVE, FULL = range(3)
+
+    def __init__(self):
+        self.w_idx = 0
+        self.r_idx = 0
+        self.data = [None, None]
+        self.stall = True
+
+    def _state(self):
+        if self.w_idx == self.r_idx:
+            return self.EMPTY
+        if (self.w_idx ^ self.r_idx) & 1:
+            return self.ACTIVE
+        return self.FULL
+
+    def m_valid(self):
+        return not self.stall and self._state() != self.EMPTY
+
+    def m_beat(self):
+        return self.data[self.r_idx & 1]
+
+    def s_ready(self, m_ready):
+        return self._state() != self.FULL
+
+    def clock(self, s_beat, m_handshake, enable=True):
+        state = self._state()
+        if m_handshake:
+            self.stall = not enable or (state == self.ACTIVE and s_beat is None)
+        elif self.stall and enable and (s_beat is not None or state != self.EMPTY):
+            self.stall = False
+
+        if s_beat is not None:
+            self.data[self.w_idx & 1] = s_beat
+            self.w_idx = (self.w_idx + 1) % 4
+        if m_handshake:
+            self.r_idx = (self.r_idx + 1) % 4
+
+
+class CircularBufferModel:
+    """axis_circular_buffer: always ready double buffer, overwrites the unread buffer"""
+    def __init__(self, buffer_size=16):
+        self.buffer_size = buffer_size
+        self.w_sel = 0
+        self.r_sel = 0
+        self.w_idx = 0
+        self.r_idx = 0
+        self.buffer = [[None] * buffer_size, [None] * buffer_size]
+
+    def m_valid(self):
+        return self.w_sel != self.r_sel or self.w_idx != self.r_idx
+
+    def m_beat(self):
+        return self.buffer[self.r_sel][self.r_idx]
+
+    def s_ready(self, m_ready):
+        return True
+
+    def clock(self, s_beat, m_handshake, enable=True):
+        r_sel = self.r_sel
+        m_last = m_handshake and self.m_beat() is not None and self.m_beat().last
+
+        if s_beat is not None:
+            self.buffer[self.w_sel][self.w_idx] = s_beat
+            if s_beat.last:
+                self.w_sel = 1 - r_sel  # Switch to the unused buffer
+                self.w_idx = 0
+            elif self.w_idx < self.buffer_size - 1:
+                self.w_idx += 1
+
+        if m_handshake:
+            if m_last:
+                self.r_sel = 1 - r_sel
+                self.r_idx = 0
+            elif self.r_idx < self.buffer_size - 1:
+                self.r_idx += 1
+
+
+class ChainModel:
+    """Modules connected m_axis to s_axis, in order from input to output"""
+    def __init__(self, models):
+        self.models = models
+        self._ready = [True] * len(models)
+
+    def m_valid(self):
+        return self.models[-1].m_valid()
+
+    def m_beat(self):
+        return self.models[-1].m_beat()
+
+    def s_ready(self, m_ready):
+        # tready flows backward from the sink, tvalid only depends on registers
+        for i in range(len(self.models) - 1, -1, -1):
+            self._ready[i] = m_ready
+            m_ready = self.models[i].s_ready(m_ready)
+        return m_ready
+
+    def clock(self, s_beat, m_handshake, enable=True):
+        handshakes = [self.models[i].m_valid() and self._ready[i] for i in range(len(self.models))]
+        beats = [model.m_beat() for model in self.models]
+        for i, model in enumerate(self.models):
+            beat = s_beat if i == 0 else (beats[i - 1] if handshakes[i - 1] else None)
+            model.clock(beat, handshakes[i], enable)
+
+
+MODELS = {
+    "axis_half_buffer": HalfBufferModel,
+    "axis_prefetch": PrefetchModel,
+    "axis_skid_buffer": SkidBufferModel,
+    "axis_gating": GatingModel,
+    "axis_circular_buffer": CircularBufferModel,
+}
+
+
+def build_model(duts, **parameters):
+    """Model of a module, or of a chain of modules given as a list"""
+    if isinstance(duts, str):
+        duts = [duts]
+    models = []
+    for dut in duts:
+        if dut not in MODELS:
+            raise ValueError(f"No model of {dut}, expected one of {', '.join(MODELS)}")
+        models.append(MODELS[dut](**parameters) if dut == "axis_circular_buffer" else MODELS[dut]())
+    return models[0] if len(models) == 1 else ChainModel(models)
+
+
+@dataclass(frozen=True)
+class Beat:
+    frame: int
+    last: bool
+
+
+@dataclass
+class ModelResult:
+    """Handshake cycles of a model run"""
+    input_cycles: list = field(default_factory=list)  # Cycle of every input beat
+    output_cycles: list = field(default_factory=list)  # Cycle of every output beat
+    frame_latencies: list = field(default_factory=list)  # Cycles from first input beat to last output beat
+    frames_received: int = 0
+
+    def metrics(self, width_bytes=4, clk_period_ns=10):
+        """Metrics named like the ones `throughput_test` records"""
+        metrics = {}
+        for side, cycles in [("input", self.input_cycles), ("output", self.output_cycles)]:
+            if not cycles:
+                continue
+            span = cycles[-1] + 1 - cycles[0]
+            metrics[f"{side}_utilization"] = len(cycles) / span * 100
+            metrics[f"{side}_throughput_MBs"] = (len(cycles) * width_bytes / 2**20) / (span * clk_period_ns / 1e9)
+        if self.input_cycles and self.output_cycles:
+            metrics["total_time_ns"] = (self.output_cycles[-1] + 1 - self.input_cycles[0]) * clk_period_ns
+        if self.frame_latencies:
+            latencies = np.array(self.frame_latencies, dtype=np.float64) * clk_period_ns
+            p50, p99 = np.percentile(latencies, [50, 99])
+            metrics.update({
+                "latency_min_ns": float(latencies.min()),
+                "latency_p50_ns": float(p50),
+                "latency_p99_ns": float(p99),
+                "latency_max_ns": float(latencies.max()),
+                "latency_jitter_ns": float(latencies.std()),
+            })
+        return metrics
+
+
+def simulate(model, frame_sizes, input_pauses=None, output_pauses=None, gate_pauses=None,
+             idle_cycles=64, max_cycles=10**7):
+    """Stream frames of the given beat counts through a model
+
+    The pause arguments are iterables of per-cycle pause flags, e.g. pause
+    patterns; None never pauses. The run ends once every beat is sent and the
+    output stayed idle for idle_cycles.
+    """
+    never = itertools.repeat(False)
+    input_pauses = iter(input_pauses or never)
+    output_pauses = iter(output_pauses or never)
+    gate_pauses = iter(gate_pauses or never)
+
+    beats = [Beat(frame, beat == size - 1) for frame, size in enumerate(frame_sizes) for beat in range(size)]
+    first_beat_cycle = {}
+    result = ModelResult()
+
+    next_beat = 0
+    s_valid = False
+    idle = 0
+    for cycle in range(max_cycles):
+        m_ready = not next(output_pauses)
+        enable = not next(gate_pauses)
+        in_pause = next(input_pauses)
+
+        # Source drives a new beat at the edge after a handshake, like cocotbext
+        if not s_valid and not in_pause and next_beat < len(beats):
+            s_valid = True
+
+        m_valid = model.m_valid()
+        s_ready = model.s_ready(m_ready)
+        s_handshake = s_valid and s_ready
+        m_handshake = m_valid and m_ready
+
+        s_beat = beats[next_beat] if s_handshake else None
+        if s_handshake:
+            result.input_cycles.append(cycle)
+            first_beat_cycle.setdefault(s_beat.frame, cycle)
+        if m_handshake:
+            result.output_cycles.append(cycle)
+            m_beat = model.m_beat()
+            if m_beat is not None and m_beat.last:
+                result.frames_received += 1
+                result.frame_latencies.append(cycle - first_beat_cycle[m_beat.frame])
+
+        model.clock(s_beat, m_handshake, enable)
+
+        if s_handshake:
+            next_beat += 1
+            s_valid = False
+
+        idle = 0 if (m_handshake or next_beat < len(beats)) else idle + 1
+        if idle >= idle_cycles:
+            break
+
+    return result
+
+
+def estimate(duts, frame_sizes, input_throughput=1.0, output_throughput=1.0, gate_throughput=1.0,
+             model="bernoulli", seed=None, width_bytes=4, clk_period_ns=10, **parameters):
+    """Metrics of a model run with pause patterns like the testbenches use"""
+    patterns = [pause_pattern(model, throughput, seed=None if seed is None else seed + i)
+                for i, throughput in enumerate([input_throughput, output_throughput, gate_throughput])]
+    result = simulate(build_model(duts, **parameters), frame_sizes, *patterns)
+    return result.metrics(width_bytes, clk_period_ns)
+
+
+def deviations(measured, estimated, tolerance=0.05):
+    """Metrics measured on the RTL that differ from the model estimate by more than a relative tolerance"""
+    return {key: (value, estimated[key]) for key, value in measured.items()
+            if key in estimated and abs(value - estimated[key]) > abs(estimated[key]) * tolerance}
+
+
+def log_comparison(log, measured, estimated, tolerance=0.05):
+    """Log the model estimate next to the RTL measurement, warning about deviations"""
+    for key in ("output_utilization", "latency_p50_ns"):
+        if key in measured and key in estimated:
+            log.info(f"Model {key}: {estimated[key]:.2f} (RTL {measured[key]:.2f})")
+    for key, (value, expected) in deviations(measured, estimated, tolerance).items():
+        log.warning(f"RTL {key} {value:.2f} deviates from the model estimate {expected:.2f}")
+
+
+def main(argv=None):
+    """Command line entry, returns the exit status"""
+    parser = argparse.ArgumentParser(description="Estimate throughput and latency of pipeline modules without a simulator")
+    parser.add_argument("duts", nargs="+", choices=sorted(MODELS), help="module, or modules chained in order")
+    parser.add_argument("--input", type=float, default=1.0, help="input throughput")
+    parser.add_argument("--output", type=float, default=1.0, help="output throughput")
+    parser.add_argument("--gate", type=float, default=1.0, help="gate throughput of axis_gating")
+    parser.add_argument("--model", default="bernoulli", help="pause model, see tbkit.pauses")
+    parser.add_argument("--frames", type=int, default=16)
+    parser.add_argument("--size", type=int, default=256, help="beats per frame")
+    parser.add_argument("--buffer-size", type=int, default=16, help="BUFFER_SIZE of axis_circular_buffer")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    metrics = estimate(args.duts, [args.size] * args.frames, args.input, args.output, args.gate,
+                       model=args.model, seed=args.seed, buffer_size=args.buffer_size)
+    print(f"==== {' -> '.join(args.duts)} Model Estimate ====")
+    for key, value in metrics.items():
+        print(f"{key}: {value:.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,137 @@
+"""Seeded pause patterns for AXI-Stream sources, sinks and gate enables
+
+A pattern generates its pause bitmap in blocks with numpy instead of
+calling `random.random()` every cycle. It can be iterated cycle by cycle,
+e.g. by `AxiStreamSource.set_pause_generator`, or consumed as runs of equal
+cycles by `drive_pauses`, which only wakes when the pause state changes.
+
+Models, all parameterized by the throughput (fraction of cycles not paused):
+
+    bernoulli   every cycle pauses independently, memoryless stalls
+    markov      on/off bursts with geometric lengths (mean_burst cycles on),
+                like a DMA engine or network port that stalls in bursts
+    duty_cycle  on for throughput * period cycles, then off for the rest
+    periodic    pauses spread as evenly as possible, e.g. every 4th cycle
+"""
+import itertools
+import random
+from abc import ABC, abstractmethod
+
+import numpy as np
+from cocotb.triggers import ClockCycles
+
+
+class PausePattern(ABC):
+    """Infinite pause bitmap generated block by block from a seeded generator"""
+    def __init__(self, throughput, seed=None, block_cycles=4096):
+        if not 0.0 <= throughput <= 1.0:
+            raise ValueError(f"Throughput {throughput} out of range [0, 1]")
+        self.throughput = throughput
+        self.block_cycles = block_cycles
+        self.rng = np.random.default_rng(random.getrandbits(64) if seed is None else seed)
+
+    @abstractmethod
+    def generate(self, cycles):
+        """Next `cycles` cycles of the bitmap, True where paused"""
+
+    def blocks(self):
+        while True:
+            if self.throughput >= 1.0:
+                yield np.zeros(self.block_cycles, dtype=bool)
+            elif self.throughput <= 0.0:
+                yield np.ones(self.block_cycles, dtype=bool)
+            else:
+                yield self.generate(self.block_cycles)
+
+    def __iter__(self):
+        return itertools.chain.from_iterable(block.tolist() for block in self.blocks())
+
+    def runs(self):
+        """Pause state and length in cycles of each run of equal cycles"""
+        for block in self.blocks():
+            starts = np.flatnonzero(np.diff(block)) + 1
+            starts = np.concatenate(([0], starts))
+            lengths = np.diff(np.append(starts, len(block)))
+            yield from zip(block[starts].tolist(), lengths.tolist())
+
+
+class BernoulliPauses(PausePattern):
+    def generate(self, cycles):
+        return self.rng.random(cycles) >= self.throughput
+
+
+class MarkovPauses(PausePattern):
+    """Two-state on/off chain: on bursts average mean_burst cycles, off bursts match the throughput"""
+    def __init__(self, throughput, mean_burst=16, seed=None, block_cycles=4096):
+        super().__init__(throughput, seed, block_cycles)
+        # Lengthen the bursts when the off bursts would be shorter than a cycle
+        self.mean_on = max(mean_burst, throughput / (1.0 - throughput)) if throughput < 1.0 else mean_burst
+        self.mean_off = self.mean_on * (1.0 - throughput) / throughput if throughput > 0.0 else 1.0
+        self.paused = bool(self.rng.random() >= throughput)  # Start in the stationary distribution
+        self.left = np.zeros(0, dtype=bool)
+
+    def generate(self, cycles):
+        parts = [self.left]
+        total = len(self.left)
+        while total < cycles:
+            runs = max(2, 2 * int(cycles / (self.mean_on + self.mean_off)) + 2)
+            on = self.rng.geometric(1.0 / self.mean_on, runs // 2)
+            off = self.rng.geometric(1.0 / self.mean_off, runs // 2)
+            lengths = np.column_stack((off, on) if self.paused else (on, off)).ravel()
+            states = np.tile([self.paused, not self.paused], runs // 2)
+            parts.append(np.repeat(states, lengths))
+            total += int(lengths.sum())
+        bitmap = np.concatenate(parts)
+        self.left = bitmap[cycles:]
+        return bitmap[:cycles]
+
+
+class DutyCyclePauses(PausePattern):
+    """On for throughput * period cycles, then paused for the rest of the period"""
+    def __init__(self, throughput, period=16, seed=None, block_cycles=4096):
+        super().__init__(throughput, seed, block_cycles)
+        self.period = period
+        self.phase = int(self.rng.integers(period))
+
+    def generate(self, cycles):
+        on = round(self.throughput * self.period)
+        bitmap = (np.arange(self.phase, self.phase + cycles) % self.period) >= on
+        self.phase = (self.phase + cycles) % self.period
+        return bitmap
+
+
+class PeriodicPauses(PausePattern):
+    """Pauses spread evenly, cycle i pauses when floor((i + 1) * (1 - throughput)) steps"""
+    def __init__(self, throughput, seed=None, block_cycles=4096):
+        super().__init__(throughput, seed, block_cycles)
+        self.cycle = 0
+
+    def generate(self, cycles):
+        i = np.arange(self.cycle, self.cycle + cycles + 1, dtype=np.float64)
+        steps = np.floor(i * (1.0 - self.throughput))
+        self.cycle += cycles
+        return np.diff(steps) > 0
+
+
+PAUSE_MODELS = {
+    "bernoulli": BernoulliPauses,
+    "markov": MarkovPauses,
+    "duty_cycle": DutyCyclePauses,
+    "periodic": PeriodicPauses,
+}
+
+
+def pause_pattern(model, throughput, **kwargs):
+    """Pause pattern of a model by name, see PAUSE_MODELS"""
+    try:
+        cls = PAUSE_MODELS[model]
+    except KeyError:
+        raise ValueError(f"Unknown pause model {model}, expected one of {', '.join(PAUSE_MODELS)}") from None
+    return cls(throughput, **kwargs)
+
+
+async def drive_pauses(clock, pattern, apply):
+    """Call apply(pause) at each change of the pattern, sleeping through runs of equal cycles"""
+    for pause, cycles in pattern.runs():
+        apply(pause)
+        await ClockCycles(clock, cycles)
@@ -0,0 +1,188 @@
+"""Opt-in profiler of where the wall time of a cocotb test goes
+
+With `SIM_PROFILE=1`, `AxisTB` starts a `SimProfiler` that wraps the cocotb
+scheduler. Each time a coroutine is resumed the profiler times it and
+attributes that time to the coroutine function and to the type of the
+trigger that woke it. It also counts the simulator callbacks into Python.
+When the test coroutine returns, it logs a per-test summary:
+
+    simulated cycles per wall-clock second
+    share of wall time spent in Python (the rest is the simulator)
+    simulator callbacks and coroutine resumptions per cycle
+    time per coroutine, e.g. BeatAxiStreamSource._run or enable_protocol_checker
+    time per trigger type, e.g. RisingEdge, ReadOnly or Event
+
+The summary is also returned by `summary` for scripted comparisons.
+
+cocotb has no public scheduler hooks, so the profiler wraps the private
+`Scheduler._schedule` and `Scheduler._react` of cocotb 1.x. Without them,
+e.g. after a cocotb update, it logs a warning and profiles nothing instead
+of failing or reporting wrong numbers. The hooks are installed once and
+shared by every profiler started in a test, e.g. by a second `AxisTB`.
+"""
+import logging
+import os
+import time
+
+import cocotb
+import cocotb.utils
+from cocotb.triggers import GPITrigger
+
+try:
+    from cocotb.task import _RunningTest
+except ImportError:  # Test ends are not detected, see SimProfiler.start
+    _RunningTest = None
+
+PROFILE_ENV = "SIM_PROFILE"
+
+HOOKS = ("_schedule", "_react")
+
+_running = []  # Started profilers, timed by the same hooks
+_original = {}  # Class methods of the scheduler bound to it, while the hooks are installed
+_reacting = False  # Inside the event loop of a trigger
+
+
+def profiling_enabled():
+    return os.getenv(PROFILE_ENV, "0") == "1"
+
+
+def hooks_available(scheduler):
+    """Whether the private scheduler methods wrapped by the profiler exist"""
+    return _RunningTest is not None and all(callable(getattr(type(scheduler), name, None)) for name in HOOKS)
+
+
+def _install(scheduler):
+    if _original:
+        return
+    for name in HOOKS:
+        # Class methods, in case the hooks of an aborted test are still installed
+        _original[name] = getattr(type(scheduler), name).__get__(scheduler)
+    _original["scheduler"] = scheduler
+    scheduler._schedule = _timed_schedule
+    scheduler._react = _timed_react
+
+
+def _uninstall():
+    scheduler = _original.pop("scheduler", None)
+    if scheduler is not None:
+        if scheduler.__dict__.get("_react") is _timed_react:
+            del scheduler._schedule, scheduler._react  # Back to the class methods
+    _original.clear()
+
+
+def _timed_react(trigger):
+    """Simulator callbacks are GPI triggers firing outside the event loop, Python triggers fire inside it"""
+    global _reacting
+    if _reacting:
+        return _original["_react"](trigger)
+    _reacting = True
+    start = time.perf_counter()
+    try:
+        return _original["_react"](trigger)
+    finally:
+        _reacting = False
+        elapsed = time.perf_counter() - start
+        callback = isinstance(trigger, GPITrigger)
+        for profiler in list(_running):
+            profiler.callbacks += callback
+            profiler.python_s += elapsed
+
+
+def _timed_schedule(coroutine, trigger=None):
+    start = time.perf_counter()
+    try:
+        return _original["_schedule"](coroutine, trigger)
+    finally:
+        elapsed = time.perf_counter() - start
+        for profiler in list(_running):
+            profiler._record(coroutine, trigger, elapsed)
+        if isinstance(coroutine, _RunningTest) and coroutine.done():
+            for profiler in list(_running):
+                profiler.stop()
+
+
+def _coroutine_name(task):
+    coro = getattr(task, "_coro", task)
+    return getattr(coro, "__qualname__", type(coro).__name__)
+
+
+class SimProfiler:
+    """Scheduler hooks timing coroutines and triggers of the running test"""
+    def __init__(self, clk_period_ns, log=None, top=20):
+        self.clk_period_ns = clk_period_ns
+        self.log = log or logging.getLogger("cocotb.tb")
+        self.top = top
+
+        self.coroutines = {}  # Name: [resumptions, seconds]
+        self.triggers = {}  # Trigger type: [resumptions, seconds]
+        self.callbacks = 0
+        self.python_s = 0.0
+        self._scheduler = None
+
+    def start(self):
+        """Time the scheduler until the running test returns, or log why it cannot"""
+        scheduler = cocotb.scheduler
+        if not hooks_available(scheduler):
+            self.log.warning(f"Profiling unavailable: cocotb {cocotb.__version__} lacks the scheduler hooks it wraps")
+            return self
+        if not _running:
+            _install(scheduler)
+        _running.append(self)
+        self._scheduler = scheduler
+
+        self.start_wall_s = time.perf_counter()
+        self.start_sim_ns = cocotb.utils.get_sim_time("ns")
+        return self
+
+    def stop(self):
+        """Stop timing and log the summary, removing the hooks with the last running profiler"""
+        if self._scheduler is None:
+            return None
+        self._scheduler = None
+        _running.remove(self)
+        if not _running:
+            _uninstall()
+        self.end_wall_s = time.perf_counter()
+        self.end_sim_ns = cocotb.utils.get_sim_time("ns")
+        summary = self.summary()
+        self.log_summary(summary)
+        return summary
+
+    def _record(self, coroutine, trigger, elapsed):
+        for table, key in [(self.coroutines, _coroutine_name(coroutine)),
+                           (self.triggers, type(trigger).__name__ if trigger is not None else "start")]:
+            entry = table.setdefault(key, [0, 0.0])
+            entry[0] += 1
+            entry[1] += elapsed
+
+    def summary(self):
+        """Totals of the profiled run, with coroutines and triggers sorted by time"""
+        wall_s = getattr(self, "end_wall_s", time.perf_counter()) - self.start_wall_s
+        sim_ns = getattr(self, "end_sim_ns", cocotb.utils.get_sim_time("ns")) - self.start_sim_ns
+        cycles = sim_ns / self.clk_period_ns
+        by_time = lambda table: sorted(table.items(), key=lambda item: item[1][1], reverse=True)
+        return {
+            "cycles": cycles,
+            "wall_s": wall_s,
+            "cycles_per_s": cycles / wall_s if wall_s else 0.0,
+            "python_share": self.python_s / wall_s if wall_s else 0.0,
+            "callbacks_per_cycle": self.callbacks / cycles if cycles else 0.0,
+            "resumptions_per_cycle": sum(n for n, _ in self.coroutines.values()) / cycles if cycles else 0.0,
+            "coroutines": by_time(self.coroutines),
+            "triggers": by_time(self.triggers),
+        }
+
+    def log_summary(self, summary):
+        log = self.log
+        log.info(f"==== Profile ====")
+        log.info(f"Simulated Cycles: {summary['cycles']:.0f} in {summary['wall_s']:.2f} s "
+                 f"({summary['cycles_per_s']:.0f} cycles/s)")
+        log.info(f"Python Share: {summary['python_share'] * 100:.1f}% of wall time")
+        log.info(f"Per Cycle: {summary['callbacks_per_cycle']:.2f} simulator callbacks, "
+                 f"{summary['resumptions_per_cycle']:.2f} coroutine resumptions")
+        for title, table in [("Coroutine", summary["coroutines"][:self.top]), ("Trigger", summary["triggers"])]:
+            log.info(f"{title:<48}{'Calls':>10}{'Time (ms)':>12}{'us/Call':>10}{'Share':>8}")
+            for name, (calls, seconds) in table:
+                share = seconds / summary["wall_s"] * 100 if summary["wall_s"] else 0.0
+                log.info(f"{name[:48]:<48}{calls:>10}{seconds * 1e3:>12.1f}{seconds / calls * 1e6:>10.1f}{share:>7.1f}%")
+        log.info(f"==============================================")
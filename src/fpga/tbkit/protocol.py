@@ -0,0 +1,238 @@
+"""AXI-Stream protocol checks in HDL, watched from Python through one signal
+
+`runner.run` replaces every Verilog source defining a module with s_axis and
+m_axis ports by a checked copy: the module is renamed `<name>_core` and a
+wrapper with the original name, parameters and ports instantiates it along
+with an `axis_protocol_checker` on each interface. Testbenches and chain
+wrappers therefore see the same DUT, and every module of a chain is checked.
+The checkers flag these rules in the `<bus>_violation` bits of the wrapper:
+
+    tvalid held until its handshake
+    tdata, tlast and tid stable while stalled
+    no X or Z on the handshake, or on the payload while tvalid is high, out of reset
+    tvalid only rising after a cycle with enable high, for modules with an enable input
+
+`ProtocolMonitor` sleeps until the `protocol_violation` wire of a checked
+module rises and then fails the test with the broken rules, so checking
+costs no Python wakeups while the protocol holds. Reset clears the bits, so
+each test of a simulation is checked; bits an earlier test left high are
+ignored until they clear. The monitor also checks the bits when a test
+decorated with `dump_on_failure` returns, for violations of its last cycles.
+`AXIS_PROTOCOL_CHECK=0` simulates the sources unchanged.
+"""
+import logging
+import os
+import re
+
+import cocotb
+from cocotb.handle import HierarchyObject
+from cocotb.triggers import Edge, First, ReadOnly
+
+from .capture import END_CHECKS, dump_on_failure
+
+PROTOCOL_ENV = "AXIS_PROTOCOL_CHECK"
+
+CHECKER_SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "axis_protocol_checker.v")
+
+# Bits of the violation output of axis_protocol_checker
+RULES = [
+    "tvalid dropped before its handshake",
+    "payload changed while stalled",
+    "X or Z out of reset",
+    "tvalid rose while enable was low",
+]
+
+BUSES = ["s_axis", "m_axis"]
+
+TIE_HIGH = "1'b1"
+TIE_LOW = "1'b0"
+
+_active = []  # Monitors started by tests, the ones of finished tests are no longer running
+
+_MODULE = re.compile(r"\bmodule\s+(\w+)\s*(?:#\s*\((?P<parameters>.*?)\)\s*)?\((?P<ports>.*?)\);", re.DOTALL)
+
+
+def protocol_checks_enabled():
+    return os.getenv(PROTOCOL_ENV, "1") == "1"
+
+
+def _strip_comments(text):
+    return re.sub(r"//[^\n]*|/\*.*?\*/", "", text, flags=re.DOTALL)
+
+
+def module_interface(source):
+    """Name, parameter names and ports {name: width expression} of the first module of a Verilog source"""
+    match = _MODULE.search(_strip_comments(source))
+    if match is None:
+        return None
+    parameters = re.findall(r"(\w+)\s*=(?!=)", match.group("parameters") or "")
+    ports = {}
+    for declaration in match.group("ports").split(","):
+        name = re.search(r"(\w+)\s*$", declaration.strip())
+        if name is None:
+            continue
+        width = re.search(r"\[(.*):(.*)\]", declaration)
+        ports[name.group(1)] = f"(({width.group(1).strip()}) - ({width.group(2).strip()}) + 1)" if width else "1"
+    return match.group(1), parameters, ports
+
+
+def is_axis_module(ports):
+    return all(f"{bus}_{signal}" in ports for bus in BUSES for signal in ("tdata", "tvalid", "tready"))
+
+
+def checked_verilog(source):
+    """Source of the first module renamed `<name>_core` followed by its checked wrapper, None if it has no AXI-Stream ports"""
+    interface = module_interface(source)
+    if interface is None or not is_axis_module(interface[2]):
+        return None
+    name, parameters, ports = interface
+
+    # The wrapper copies the header of the module, comments included
+    header = _MODULE.search(source)
+    core = source[:header.start()] + re.sub(rf"\bmodule\s+{name}\b", f"module {name}_core", source[header.start():], count=1)
+
+    lines = [
+        "",
+        f"// Protocol-checked wrapper of {name}, generated by tbkit.protocol",
+        f"module {name}" + source[header.end(1):header.end()],
+        "",
+    ]
+    overrides = [f".{parameter}({parameter})" for parameter in parameters]
+    connections = [f".{port}({port})" for port in ports]
+    lines += [f"    {name}_core " + (f"#({', '.join(overrides)}) " if overrides else "") + "core ("]
+    lines += [f"        {connection}" + ("," if j < len(connections) - 1 else "") for j, connection in enumerate(connections)]
+    lines += ["    );"]
+
+    lines += ["", "    // AXI-Stream Protocol Checks"]
+    # Ports a module does not have are tied off
+    signal = lambda port, tie: port if port in ports else tie
+    for bus in BUSES:
+        lines += [
+            "",
+            f"    wire [3:0] {bus}_violation;",
+            "",
+            "    axis_protocol_checker #(",
+            f"        .DATA_WIDTH({ports[f'{bus}_tdata']}),",
+            f"        .ID_WIDTH({ports.get(f'{bus}_tid', '1')}),",
+            f"        .CHECK_ENABLE({int(bus == 'm_axis' and 'enable' in ports)})",
+            f"    ) {bus}_checker (",
+            "        .aclk(aclk),",
+            "        .aresetn(aresetn),",
+            f"        .enable({signal('enable', TIE_HIGH)}),",
+            f"        .tdata({bus}_tdata),",
+            f"        .tvalid({bus}_tvalid),",
+            f"        .tready({bus}_tready),",
+            f"        .tlast({signal(f'{bus}_tlast', TIE_LOW)}),",
+            f"        .tid({signal(f'{bus}_tid', TIE_LOW)}),",
+            f"        .violation({bus}_violation)",
+            "    );",
+        ]
+    lines += [
+        "",
+        "    wire protocol_violation;",
+        "",
+        f"    assign protocol_violation = |{{{', '.join(f'{bus}_violation' for bus in BUSES)}}};",
+        "",
+        "endmodule",
+        "",
+    ]
+    return core.rstrip("\n") + "\n" + "\n".join(lines)
+
+
+def checked_sources(verilog_sources, directory):
+    """Verilog sources with the AXI-Stream modules replaced by checked copies written to directory"""
+    sources = []
+    for path in verilog_sources:
+        with open(path) as f:
+            checked = checked_verilog(f.read())
+        if checked is None:
+            sources.append(path)
+            continue
+        name = os.path.splitext(os.path.basename(path))[0]
+        checked_path = os.path.join(directory, f"{name}_checked.v")
+        os.makedirs(directory, exist_ok=True)
+        if not os.path.isfile(checked_path) or open(checked_path).read() != checked:
+            with open(checked_path, "w") as f:
+                f.write(checked)
+        sources.append(checked_path)
+    if sources != list(verilog_sources):
+        sources.append(CHECKER_SOURCE)
+    return sources
+
+
+def checked_modules(dut):
+    """Handles of the checked wrappers at and below dut, e.g. the stages of a chain"""
+    if not hasattr(dut, "protocol_violation"):
+        return []
+    modules = [dut]
+    for child in dut.core:
+        if isinstance(child, HierarchyObject) and hasattr(child, "protocol_violation") and hasattr(child, "core"):
+            modules += checked_modules(child)
+    return modules
+
+
+class ProtocolMonitor:
+    """Fail the running test on the first violation flagged by the HDL protocol checkers"""
+    def __init__(self, modules, log=None):
+        self.modules = modules
+        self.log = log or logging.getLogger("cocotb.tb")
+        self._stale = set()  # Modules flagged before the test, see _run
+
+        _active[:] = [monitor for monitor in _active if not monitor._cr.done()]
+        _active.append(self)
+        self._cr = cocotb.start_soon(self._run())
+
+    @classmethod
+    def attach(cls, dut, log=None):
+        """Watch the checked modules of dut, None when it was built without checks"""
+        modules = checked_modules(dut)
+        return cls(modules, log) if modules else None
+
+    @staticmethod
+    def _flagged(module):
+        value = module.protocol_violation.value
+        return value.is_resolvable and int(value) == 1
+
+    @dump_on_failure
+    async def _run(self):
+        # Flagged before this test started, reported by the earlier test and cleared by the next reset
+        self._stale = {id(module) for module in self.modules if self._flagged(module)}
+        change = First(*(Edge(module.protocol_violation) for module in self.modules))
+        while True:
+            await change
+            await ReadOnly()
+            self._stale = {id(module) for module in self.modules if id(module) in self._stale and self._flagged(module)}
+            self.check()
+
+    def check(self):
+        """Fail with the violations flagged so far"""
+        violations = self.violations()
+        for violation in violations:
+            self.log.error(f"AXI-Stream protocol violation: {violation}")
+        if violations:
+            raise AssertionError(f"AXI-Stream protocol violation: {'; '.join(violations)}")
+
+    def violations(self):
+        """Broken rules, as `<module path>.<bus>: <rule>`"""
+        messages = []
+        for module in self.modules:
+            if id(module) in self._stale:
+                continue
+            for bus in BUSES:
+                value = getattr(module, f"{bus}_violation").value
+                if not value.is_resolvable:
+                    continue
+                for bit, rule in enumerate(RULES):
+                    if int(value) >> bit & 1:
+                        messages.append(f"{module._path}.{bus}: {rule}")
+        return messages
+
+
+def check_protocol():
+    """Check the monitors of the running test, e.g. for violations of its last cycles"""
+    for monitor in _active:
+        if not monitor._cr.done():
+            monitor.check()
+
+
+END_CHECKS.append(check_protocol)
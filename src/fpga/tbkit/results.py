@@ -0,0 +1,265 @@
+"""Machine-readable benchmark results and baseline regression gate
+
+Testbenches call `record` with the metrics of a scenario. Each record is
+appended as one JSON line to the results file of the running configuration,
+keyed by DUT, parameters and scenario. `tbkit.runner.run` points every
+configuration to its own `sim_build/<SIM>/results/<configuration>.jsonl`.
+
+The command line merges results into CSV or JSON, stores them as a baseline
+and compares new results against it, failing on regressions beyond the
+per-metric tolerance:
+
+    python -m tbkit.results csv sim_build/icarus/results -o results.csv
+    python -m tbkit.results baseline sim_build/icarus/results -o baseline.json
+    python -m tbkit.results compare sim_build/icarus/results --baseline baseline.json \\
+        --tolerance output_throughput_MBs=0.01
+    python -m tbkit.results surface sim_build/icarus/results --metric output_utilization
+"""
+import argparse
+import csv
+import glob
+import json
+import os
+import sys
+import time
+
+HIGHER = "higher"  # Higher is better, e.g. throughput
+LOWER = "lower"  # Lower is better, e.g. latency
+
+# Direction and default relative tolerance of the metrics reported by the testbenches
+METRICS = {
+    "input_throughput_MBs": (HIGHER, 0.02),
+    "output_throughput_MBs": (HIGHER, 0.02),
+    "input_utilization": (HIGHER, 0.02),
+    "output_utilization": (HIGHER, 0.02),
+    "total_time_ns": (LOWER, 0.02),
+    "startup_latency_ns": (LOWER, 0.0),
+    "latency_min_ns": (LOWER, 0.05),
+    "latency_p50_ns": (LOWER, 0.05),
+    "latency_p99_ns": (LOWER, 0.10),
+    "latency_max_ns": (LOWER, 0.10),
+}
+
+RESULTS_ENV = "SIM_RESULTS"
+PARAMETERS_ENV = "SIM_PARAMETERS"
+
+
+def record(scenario, metrics, dut=None, parameters=None, point=None):
+    """Append the metrics of a scenario to the results file of the running simulation
+
+    `point` holds the coordinates of a sweep scenario, e.g. its input and
+    output throughput, from which `surfaces` builds its tables.
+    """
+    entry = {
+        "dut": dut or os.getenv("TOPLEVEL", ""),
+        "parameters": parameters if parameters is not None else json.loads(os.getenv(PARAMETERS_ENV, "{}")),
+        "scenario": scenario,
+        "simulator": os.getenv("SIM", "icarus"),
+        "seed": os.getenv("RANDOM_SEED"),
+        "timestamp": time.time(),
+        "metrics": {key: float(value) for key, value in metrics.items()},
+    }
+    if point is not None:
+        entry["point"] = point
+    path = os.getenv(RESULTS_ENV, "results.jsonl")
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a") as f:
+        f.write(json.dumps(entry) + "\n")
+    return entry
+
+
+def latency_metrics(summary):
+    """Metrics of a `LatencyTracker.summary`"""
+    if summary is None:
+        return {}
+    return {f"latency_{key}_ns": value for key, value in summary.items()}
+
+
+def result_key(entry):
+    return (entry["dut"], json.dumps(entry["parameters"], sort_keys=True), entry["scenario"])
+
+
+def load_results(paths):
+    """Load result entries from JSON lines files, directories of them, JSON baselines or sweep reports
+
+    When a key appears more than once, the last entry wins.
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, "*.jsonl"))))
+        else:
+            files.append(path)
+
+    entries = {}
+    for path in files:
+        with open(path) as f:
+            if path.endswith(".json"):
+                data = json.load(f)
+                items = data["benchmarks"] if "benchmarks" in data else data["results"]  # Sweep report or baseline
+            else:
+                items = [json.loads(line) for line in f if line.strip()]
+        for entry in items:
+            entries[result_key(entry)] = entry
+    return list(entries.values())
+
+
+def write_json(entries, path, tolerances=None):
+    """Store entries as a JSON baseline, with optional per-metric tolerance overrides"""
+    with open(path, "w") as f:
+        json.dump({"tolerances": tolerances or {}, "results": entries}, f, indent=2)
+
+
+def write_csv(entries, path):
+    """One row per entry, one column per metric"""
+    metrics = sorted({key for entry in entries for key in entry["metrics"]})
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["dut", "parameters", "scenario"] + metrics)
+        for entry in entries:
+            writer.writerow([entry["dut"], json.dumps(entry["parameters"], sort_keys=True), entry["scenario"]]
+                            + [entry["metrics"].get(key, "") for key in metrics])
+
+
+def compare(entries, baseline, tolerances=None):
+    """Regressions of entries against baseline entries, as (key, metric, baseline, value, limit)
+
+    A metric regresses when it is worse than the baseline by more than its
+    relative tolerance. Metrics without a known direction are not compared.
+    """
+    tolerances = tolerances or {}
+    baseline = {result_key(entry): entry for entry in baseline}
+
+    regressions = []
+    for entry in entries:
+        reference = baseline.get(result_key(entry))
+        if reference is None:
+            continue
+        for metric, value in entry["metrics"].items():
+            if metric not in METRICS or metric not in reference["metrics"]:
+                continue
+            direction, tolerance = METRICS[metric]
+            tolerance = tolerances.get(metric, tolerance)
+            expected = reference["metrics"][metric]
+            if direction == HIGHER:
+                limit = expected - abs(expected) * tolerance
+                regressed = value < limit
+            else:
+                limit = expected + abs(expected) * tolerance
+                regressed = value > limit
+            if regressed:
+                regressions.append((result_key(entry), metric, expected, value, limit))
+    return regressions
+
+
+def surfaces(entries, metric):
+    """Text tables of a metric over the sweep points of each DUT and parameter set
+
+    Two-dimensional sweeps give a table with the first coordinate as rows and
+    the second as columns, one-dimensional sweeps a single column. Parameters
+    that vary within the sweep of a DUT, e.g. DATA_WIDTH in a scaling sweep,
+    are coordinates and do not split its table.
+    """
+    points = [entry for entry in entries if "point" in entry and metric in entry["metrics"]]
+    varying = {}
+    for entry in points:
+        for key, value in entry["parameters"].items():
+            varying.setdefault(entry["dut"], {}).setdefault(key, set()).add(value)
+
+    groups = {}
+    for entry in points:
+        parameters = {key: value for key, value in entry["parameters"].items()
+                      if len(varying[entry["dut"]][key]) == 1}
+        groups.setdefault((entry["dut"], json.dumps(parameters, sort_keys=True), tuple(sorted(entry["point"]))),
+                          []).append(entry)
+
+    tables = []
+    for (dut, parameters, _), group in sorted(groups.items()):
+        axes = sorted(group[0]["point"])
+        values = {tuple(entry["point"][axis] for axis in axes): entry["metrics"][metric] for entry in group}
+        rows = sorted({point[0] for point in values})
+        columns = sorted({point[1] for point in values}) if len(axes) > 1 else [None]
+
+        header = f"{axes[0]} \\ {axes[1]}" if len(axes) > 1 else axes[0]
+        lines = [f"{header:>32}" + "".join(f"{column if column is not None else metric:>12}" for column in columns)]
+        for row in rows:
+            cells = []
+            for column in columns:
+                value = values.get((row,) if column is None else (row, column))
+                cells.append(f"{value:>12.2f}" if value is not None else f"{'-':>12}")
+            lines.append(f"{row:>32}" + "".join(cells))
+
+        title = dut if parameters == "{}" else f"{dut} {parameters}"
+        tables.append((title, "\n".join(lines)))
+    return tables
+
+
+def _parse_tolerances(items):
+    tolerances = {}
+    for item in items:
+        metric, _, value = item.partition("=")
+        if metric not in METRICS:
+            raise argparse.ArgumentTypeError(f"Unknown metric {metric}")
+        tolerances[metric] = float(value)
+    return tolerances
+
+
+def main(argv=None):
+    """Command line entry, returns the exit status"""
+    parser = argparse.ArgumentParser(description="Export benchmark results and compare them against a baseline")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    for command, description in [("csv", "merge results into a CSV file"),
+                                 ("baseline", "store results as a JSON baseline")]:
+        subparser = subparsers.add_parser(command, help=description)
+        subparser.add_argument("results", nargs="+", help="results files or directories")
+        subparser.add_argument("-o", "--output", required=True)
+        subparser.add_argument("--tolerance", action="append", default=[], metavar="METRIC=REL",
+                               help="tolerance stored in the baseline")
+
+    subparser = subparsers.add_parser("compare", help="fail on regressions against a baseline")
+    subparser.add_argument("results", nargs="+", help="results files or directories")
+    subparser.add_argument("--baseline", required=True)
+    subparser.add_argument("--tolerance", action="append", default=[], metavar="METRIC=REL",
+                           help="relative tolerance of a metric, overrides the baseline")
+
+    subparser = subparsers.add_parser("surface", help="print sweep results as tables per DUT")
+    subparser.add_argument("results", nargs="+", help="results files or directories")
+    subparser.add_argument("--metric", action="append", default=[],
+                           help="metric to tabulate (default: output_utilization and latency_p50_ns)")
+
+    args = parser.parse_args(argv)
+    entries = load_results(args.results)
+
+    if args.command == "surface":
+        for metric in args.metric or ["output_utilization", "latency_p50_ns"]:
+            for title, table in surfaces(entries, metric):
+                print(f"==== {title}: {metric} ====")
+                print(table)
+        return 0
+
+    if args.command == "csv":
+        write_csv(entries, args.output)
+        print(f"{len(entries)} results written to {args.output}")
+        return 0
+
+    if args.command == "baseline":
+        write_json(entries, args.output, _parse_tolerances(args.tolerance))
+        print(f"{len(entries)} results stored in {args.output}")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    tolerances = dict(baseline.get("tolerances", {}), **_parse_tolerances(args.tolerance))
+    regressions = compare(entries, baseline["results"], tolerances)
+
+    compared = {result_key(entry) for entry in baseline["results"]} & {result_key(entry) for entry in entries}
+    for (dut, parameters, scenario), metric, expected, value, limit in regressions:
+        print(f"REGRESSION {dut} {parameters} {scenario}: {metric} {value:.2f} (baseline {expected:.2f}, limit {limit:.2f})")
+    print(f"Compared {len(compared)} results, {len(regressions)} regressions")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
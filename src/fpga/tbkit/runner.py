@@ -0,0 +1,404 @@
+"""Run cocotb-test simulations in per-configuration build directories
+
+Every configuration builds in the content-addressed cache entry of its
+compile inputs (see `tbkit.cache`), or in its own
+`sim_build/<SIM>/<toplevel>/<parameters>` directory with `SIM_CACHE=0`, so
+parallel runs never share stale images or results files. With the cache,
+that directory is the working directory of the run and receives its
+outputs, e.g. the waveforms of `WAVES=1`. Benchmark results
+recorded by the testbenches (see `tbkit.results`) go to
+`sim_build/<SIM>/results/<configuration>.jsonl`, stimulus traces (see
+`tbkit.trace`) to the `traces` directory of the configuration and failure
+captures (see `tbkit.capture`) to its `captures` directory. `main` runs
+a list of configurations on a process pool and merges pass/fail and timing
+into one report:
+
+    python test_q_format_converter.py -j 32
+
+`SIM=verilator` builds every configuration as an optimized, multithreaded
+Verilator model (`VERILATOR_THREADS`, default 1) with `WAVES=1` tracing to
+FST on its own threads:
+
+    SIM=verilator VERILATOR_THREADS=4 python -m pytest -q test_throughput.py
+
+Every test module runs its configurations through `run`, which applies
+these arguments (see `simulation_args`), so no module sets up a simulator
+of its own.
+
+`--shard I/N` runs one of N shards of the configurations, balanced by the
+durations of a previous report (`--history`), so build nodes can split a
+sweep without a coordinator. Each shard writes its own report, including
+its benchmark results, and `--merge` combines them into one:
+
+    python test_throughput.py --shard 2/4 --history merged_report.json
+    python test_throughput.py --merge shard_reports/*.json --report merged_report.json
+
+Modules with s_axis and m_axis ports are simulated with HDL protocol
+checkers on both interfaces (see `tbkit.protocol`), unless
+`AXIS_PROTOCOL_CHECK=0`.
+"""
+import argparse
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, asdict
+
+import cocotb_test.simulator
+
+from .cache import BuildCache
+from .results import RESULTS_ENV, PARAMETERS_ENV, load_results, surfaces
+from .capture import DIR_ENV as CAPTURE_DIR_ENV
+from .protocol import checked_sources, protocol_checks_enabled
+from .trace import DIR_ENV as TRACE_DIR_ENV
+
+
+def simulator_name():
+    """Simulator selected through the `SIM` environment variable"""
+    return os.getenv("SIM", "icarus")
+
+
+def verilator_args(**kwargs):
+    """Arguments of `cocotb_test.simulator.run` for an optimized Verilator model build"""
+    threads = int(os.getenv("VERILATOR_THREADS", 1))
+    waves = bool(kwargs.get("waves", int(os.getenv("WAVES", 0))))
+
+    compile_args = ["-O3", "-Wno-fatal", "--x-assign", "fast"]
+    if threads > 1:
+        compile_args += ["--threads", str(threads)]
+        if waves:
+            compile_args += ["--trace-threads", "2"]
+
+    return dict(
+        kwargs,
+        compile_args=list(kwargs.get("compile_args") or []) + compile_args,
+        make_args=list(kwargs.get("make_args") or []) + [f"-j{os.cpu_count()}", "OPT_FAST=-O2"],
+        timescale=kwargs.get("timescale") or "1ns/1ps",  # Icarus default of cocotb-test
+    )
+
+
+def build_root():
+    """Root directory of all simulation builds"""
+    return os.path.abspath(os.getenv("SIM_BUILD", "sim_build"))
+
+
+def config_name(toplevel, parameters=None, variant=None):
+    """Readable, unique name of a configuration
+
+    `variant` tells apart runs of the same build, e.g. the points of a
+    throughput sweep selected through `extra_env`.
+    """
+    name = toplevel
+    if parameters:
+        name += "-" + "-".join(f"{key}_{value}" for key, value in parameters.items())
+    if variant:
+        name += "-" + variant
+    return name
+
+
+def build_dir(toplevel, parameters=None, variant=None):
+    """Build directory of a configuration"""
+    return os.path.join(build_root(), simulator_name(), toplevel, config_name(toplevel, parameters, variant))
+
+
+def results_file(toplevel, parameters=None, variant=None):
+    """Benchmark results file of a configuration"""
+    return os.path.join(build_root(), simulator_name(), "results", config_name(toplevel, parameters, variant) + ".jsonl")
+
+
+def simulation_args(**kwargs):
+    """Arguments of a configuration with the protocol checkers and the settings of the selected simulator"""
+    if protocol_checks_enabled():
+        kwargs["verilog_sources"] = checked_sources(kwargs["verilog_sources"], os.path.join(build_root(), "protocol"))
+    if simulator_name() == "verilator":
+        kwargs = verilator_args(**kwargs)
+    return kwargs
+
+
+def run(**kwargs):
+    """`cocotb_test.simulator.run` with a cached or isolated build directory"""
+    __tracebackhide__ = True  # Hide the traceback when using PyTest.
+
+    variant = kwargs.pop("variant", None)
+    kwargs = simulation_args(**kwargs)
+
+    path = results_file(kwargs["toplevel"], kwargs.get("parameters"), variant)
+    if os.path.exists(path):
+        os.remove(path)  # Results of a previous run
+    kwargs["extra_env"] = dict(kwargs.get("extra_env") or {}, **{
+        RESULTS_ENV: path,
+        PARAMETERS_ENV: json.dumps({key: str(value) for key, value in (kwargs.get("parameters") or {}).items()}),
+        TRACE_DIR_ENV: os.getenv(TRACE_DIR_ENV) or os.path.join(build_dir(kwargs["toplevel"], kwargs.get("parameters"), variant), "traces"),
+        CAPTURE_DIR_ENV: os.getenv(CAPTURE_DIR_ENV) or os.path.join(build_dir(kwargs["toplevel"], kwargs.get("parameters"), variant), "captures"),
+    })
+
+    if "sim_build" in kwargs:
+        return cocotb_test.simulator.run(**kwargs)
+
+    cache = BuildCache.from_env(build_root())
+    if cache is not None:
+        # Waveforms and other run outputs stay with the configuration, not in the shared entry
+        work_dir = kwargs.setdefault("work_dir", build_dir(kwargs["toplevel"], kwargs.get("parameters"), variant))
+        os.makedirs(work_dir, exist_ok=True)
+        return cache.run(simulator_name(), **kwargs)
+
+    kwargs["sim_build"] = build_dir(kwargs["toplevel"], kwargs.get("parameters"), variant)
+    return cocotb_test.simulator.run(**kwargs)
+
+
+@dataclass
+class SweepResult:
+    """Outcome of one configuration of a sweep"""
+    name: str
+    toplevel: str
+    parameters: dict
+    passed: bool
+    duration_s: float
+    log_file: str
+    error: str = ""
+
+
+def run_configuration(kwargs):
+    """Run one configuration, logging into its build directory"""
+    toplevel = kwargs["toplevel"]
+    parameters = kwargs.get("parameters") or {}
+    variant = kwargs.get("variant")
+    log_file = os.path.join(build_dir(toplevel, parameters, variant), "sim.log")
+    os.makedirs(os.path.dirname(log_file), exist_ok=True)
+
+    # Keep the output of concurrent simulations apart
+    logger = logging.getLogger("cocotb")
+    logger.propagate = False
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        handler.close()
+    logger.addHandler(logging.FileHandler(log_file, mode="w"))
+
+    error = ""
+    start_time = time.perf_counter()
+    try:
+        run(**kwargs)
+    except (SystemExit, Exception) as e:
+        error = str(e) or type(e).__name__
+    duration_s = time.perf_counter() - start_time
+
+    return SweepResult(
+        name=config_name(toplevel, parameters, variant),
+        toplevel=toplevel,
+        parameters=parameters,
+        passed=not error,
+        duration_s=duration_s,
+        log_file=log_file,
+        error=error,
+    )
+
+
+def run_sweep(configurations, jobs=None, log=print):
+    """Run configurations on a process pool and return their results in order"""
+    results = {}
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(run_configuration, kwargs): i for i, kwargs in enumerate(configurations)}
+        for future in as_completed(futures):
+            result = future.result()
+            results[futures[future]] = result
+            log(f"[{len(results)}/{len(futures)}] {'PASS' if result.passed else 'FAIL'} "
+                f"{result.name} ({result.duration_s:.1f} s)")
+    return [results[i] for i in range(len(configurations))]
+
+
+def write_report(results, path, wall_time_s, benchmarks=(), shard=None):
+    """Merge the results of a sweep into one JSON report
+
+    `benchmarks` holds the `tbkit.results` entries recorded by the
+    configurations, so the report of a shard is complete on its own.
+    """
+    report = {
+        "simulator": simulator_name(),
+        "wall_time_s": wall_time_s,
+        "cpu_time_s": sum(result.duration_s for result in results),
+        "passed": sum(result.passed for result in results),
+        "failed": sum(not result.passed for result in results),
+        "results": [asdict(result) for result in results],
+        "benchmarks": list(benchmarks),
+    }
+    if shard is not None:
+        report["shard"] = list(shard)
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    return report
+
+
+def parse_shard(text):
+    """`I/N` with 1 <= I <= N, as (I, N)"""
+    try:
+        index, count = (int(part) for part in text.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected I/N, got {text}")
+    if not 1 <= index <= count:
+        raise argparse.ArgumentTypeError(f"shard {text} out of range, expected 1 <= I <= N")
+    return index, count
+
+
+def load_durations(paths):
+    """Duration of each configuration in previous reports, the last report winning"""
+    durations = {}
+    for path in paths:
+        if not os.path.isfile(path):
+            continue
+        with open(path) as f:
+            for result in json.load(f).get("results", []):
+                durations[result["name"]] = result["duration_s"]
+    return durations
+
+
+def assign_shards(names, count, durations):
+    """Shard (from 0) of each configuration name and the estimated duration of each shard
+
+    Longest configurations first, each onto the least loaded shard, with
+    configurations missing from `durations` estimated at the median. The
+    assignment only depends on the names and durations, so every node
+    computes the same one from the same history.
+    """
+    known = sorted(durations[name] for name in names if name in durations)
+    default = known[len(known) // 2] if known else 1.0
+    estimates = {name: durations.get(name, default) for name in names}
+
+    loads = [0.0] * count
+    shards = {}
+    for name in sorted(names, key=lambda name: (-estimates[name], name)):
+        shard = min(range(count), key=lambda i: (loads[i], i))
+        shards[name] = shard
+        loads[shard] += estimates[name]
+    return shards, loads
+
+
+def merge_reports(paths):
+    """Combine the reports of the shards of a sweep, the last result of a configuration winning"""
+    reports = []
+    for path in paths:
+        with open(path) as f:
+            reports.append(json.load(f))
+
+    results = {}
+    for report in reports:
+        for result in report["results"]:
+            results[result["name"]] = result
+    results = [SweepResult(**result) for result in results.values()]
+
+    merged = {
+        "simulator": reports[0]["simulator"] if reports else simulator_name(),
+        "wall_time_s": max((report["wall_time_s"] for report in reports), default=0.0),  # Shards run side by side
+        "cpu_time_s": sum(result.duration_s for result in results),
+        "passed": sum(result.passed for result in results),
+        "failed": sum(not result.passed for result in results),
+        "results": [asdict(result) for result in results],
+        "benchmarks": load_results(paths),
+    }
+    counts = {report["shard"][1] for report in reports if "shard" in report}
+    merged["shards"] = sorted(report["shard"][0] for report in reports if "shard" in report)
+    if len(counts) > 1:
+        raise ValueError(f"Reports of different shard counts: {', '.join(map(str, sorted(counts)))}")
+    if counts:
+        count = counts.pop()
+        merged["missing_shards"] = [i for i in range(1, count + 1) if i not in merged["shards"]]
+    return merged, results
+
+
+def main(configurations, argv=None, sweeps=None, surface_metrics=("output_utilization", "latency_p50_ns")):
+    """Command line entry of a test module sweep, returns the exit status
+
+    `sweeps` maps names to alternative lists of configurations, selected with
+    `--sweep`; the surfaces of their benchmark results are printed at the end.
+    """
+    parser = argparse.ArgumentParser(description="Run a cocotb parameter sweep on a process pool")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(),
+                        help="number of parallel simulations (default: all cores)")
+    parser.add_argument("-k", "--filter", default="",
+                        help="only run configurations whose name contains this string")
+    parser.add_argument("--report", default=None,
+                        help="JSON report path (default: sim_build/<SIM>/<module>_report.json, "
+                             "with a .shard-I-of-N suffix for a shard)")
+    parser.add_argument("--shard", type=parse_shard, default=None, metavar="I/N",
+                        help="only run shard I of N, balanced by the durations of the history reports")
+    parser.add_argument("--history", nargs="+", default=None, metavar="REPORT",
+                        help="reports of previous runs to balance the shards with (default: the report of the module); "
+                             "every node must use the same ones")
+    parser.add_argument("--merge", nargs="+", default=None, metavar="REPORT",
+                        help="merge the reports of the shards into one instead of running")
+    if sweeps:
+        parser.add_argument("--sweep", choices=sorted(sweeps),
+                            help="run a benchmark sweep instead of the test configurations")
+    args = parser.parse_args(argv)
+
+    sweep = getattr(args, "sweep", None)
+    if sweep is not None:
+        configurations = sweeps[sweep]
+
+    configurations = [kwargs for kwargs in configurations
+                      if args.filter in config_name(kwargs["toplevel"], kwargs.get("parameters"), kwargs.get("variant"))]
+    if not configurations:
+        print("No configuration selected")
+        return 1
+
+    module = configurations[0]["module"]
+    default_report_path = os.path.join(build_root(), simulator_name(), f"{module}_report.json")
+    report_path = args.report or default_report_path
+    names = [config_name(kwargs["toplevel"], kwargs.get("parameters"), kwargs.get("variant")) for kwargs in configurations]
+
+    if args.merge:
+        report, results = merge_reports(args.merge)
+        if os.path.dirname(report_path):
+            os.makedirs(os.path.dirname(report_path), exist_ok=True)
+        with open(report_path, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"==== {module} Merged Results of {len(args.merge)} Reports ====")
+        missing = sorted(set(names) - {result.name for result in results})
+        for name in missing:
+            print(f"MISSING {name}")
+        if report.get("missing_shards"):
+            print(f"Missing Shards: {', '.join(map(str, report['missing_shards']))}")
+        status = print_summary(results, report, report_path)
+        print_surfaces(report["benchmarks"], surface_metrics if sweep is not None else ())
+        return 1 if status or missing else 0
+
+    if args.shard is not None:
+        index, count = args.shard
+        shards, loads = assign_shards(names, count, load_durations(args.history or [default_report_path]))
+        configurations = [kwargs for kwargs, name in zip(configurations, names) if shards[name] == index - 1]
+        print(f"Shard {index}/{count}: {len(configurations)} of {len(names)} configurations, "
+              f"estimated {loads[index - 1]:.1f} s of {sum(loads):.1f} s")
+        if args.report is None:
+            report_path = os.path.splitext(default_report_path)[0] + f".shard-{index}-of-{count}.json"
+
+    start_time = time.perf_counter()
+    results = run_sweep(configurations, jobs=args.jobs)
+    paths = [results_file(kwargs["toplevel"], kwargs.get("parameters"), kwargs.get("variant"))
+             for kwargs in configurations]
+    benchmarks = load_results([path for path in paths if os.path.isfile(path)])
+    report = write_report(results, report_path, time.perf_counter() - start_time, benchmarks, shard=args.shard)
+
+    print(f"==== {module} Sweep Results ====")
+    status = print_summary(results, report, report_path)
+    print_surfaces(benchmarks, surface_metrics if sweep is not None else ())
+    return status
+
+
+def print_summary(results, report, report_path):
+    """Print the failures and totals of a report, returns the exit status"""
+    for result in results:
+        if not result.passed:
+            print(f"FAIL {result.name}: {result.error} (see {result.log_file})")
+    print(f"Passed: {report['passed']}, Failed: {report['failed']}")
+    print(f"Wall Time: {report['wall_time_s']:.1f} s, Simulation Time: {report['cpu_time_s']:.1f} s")
+    print(f"Report: {report_path}")
+    return 1 if report["failed"] else 0
+
+
+def print_surfaces(entries, metrics):
+    for metric in metrics:
+        for title, table in surfaces(entries, metric):
+            print(f"==== {title}: {metric} ====")
+            print(table)
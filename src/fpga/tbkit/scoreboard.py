@@ -0,0 +1,125 @@
+"""Scoreboard matching AXI-Stream frames received from a DUT against the sent ones"""
+from collections import deque, namedtuple
+
+Expected = namedtuple("Expected", ["seq", "data", "tid", "context"])
+
+
+class AxisScoreboard:
+    """Match received frames with expected frames in O(1)
+
+    By default frames must come back in the order they were sent, each with
+    the tid it was sent with. A lossy scoreboard keeps one queue per tid and
+    matches a received frame with the oldest pending frame of its tid sent
+    after the previous match; every frame sent before that match and never
+    received counts as dropped. `context` is carried along with the frame,
+    e.g. its ingress beat for latency tracking.
+    """
+    def __init__(self, width_bytes, lossy=False, check_data=True, log=None):
+        self.width_bytes = width_bytes
+        self.lossy = lossy
+        self.check_data = check_data
+        self.log = log
+
+        self.in_order = deque()
+        self.by_tid = {}
+
+        self.sent = 0
+        self.matched = 0
+        self.truncated = 0
+        self.last_seq = -1
+
+    @property
+    def pending(self):
+        """Frames sent after the last match"""
+        return self.sent - self.last_seq - 1
+
+    @property
+    def dropped(self):
+        """Frames sent before the last match that never came back"""
+        return self.last_seq + 1 - self.matched
+
+    def empty(self):
+        return self.pending == 0
+
+    def expect(self, data, tid=None, context=None):
+        """Record a frame sent to the DUT"""
+        entry = Expected(self.sent, data, tid, context)
+        if self.lossy and tid is not None:
+            queue = self.by_tid.get(tid)
+            if queue is None:
+                queue = self.by_tid[tid] = deque()
+            queue.append(entry)
+        else:
+            self.in_order.append(entry)
+        self.sent += 1
+        return entry
+
+    def drop_pending(self):
+        """Count every pending frame as dropped, e.g. once a lossy DUT is idle without outputting them"""
+        self.last_seq = self.sent - 1
+        self.in_order.clear()
+        for queue in self.by_tid.values():
+            queue.clear()
+
+    @staticmethod
+    def frame_tid(frame):
+        """tid of a received frame, after checking all its beats carry the same one"""
+        tid = frame.tid
+        if type(tid) is not list:
+            return tid
+        if not tid:
+            return None
+        first = tid[0]
+        if tid.count(first) != len(tid):  # One pass in C instead of a Python loop
+            id = next(id for id in tid if id != first)
+            raise ValueError(f"Received frame ID {id} does not match the first ID {first}")
+        return first
+
+    def match(self, frame):
+        """Find the expected frame of a received frame"""
+        tid = self.frame_tid(frame)
+
+        if self.lossy and tid is not None:
+            queue = self.by_tid.get(tid)
+            while queue and queue[0].seq <= self.last_seq:
+                queue.popleft()  # Dropped by the DUT
+            if not queue:
+                raise RuntimeError(f"Received frame ID {tid} without a corresponding sent frame")
+            entry = queue.popleft()
+        else:
+            if not self.in_order:
+                raise RuntimeError("Received frame without a corresponding sent frame")
+            entry = self.in_order.popleft()
+            if entry.tid is not None and tid != entry.tid:
+                raise ValueError(f"Received frame ID {tid} does not match expected ID {entry.tid}")
+
+        self.last_seq = entry.seq
+        self.matched += 1
+        return entry
+
+    def check(self, frame, allow_truncation=False):
+        """Match a received frame and compare its data, return the expected frame"""
+        entry = self.match(frame)
+        exp_data = entry.data
+
+        if len(exp_data) > len(frame.tdata):
+            self.truncated += 1
+
+        if self.check_data and exp_data != frame.tdata:
+            if allow_truncation:
+                if len(exp_data) > len(frame.tdata) and self.log is not None:
+                    self.log.info(f"Overflow detected: expected {len(exp_data)} bytes, received {len(frame.tdata)} bytes")
+                exp_data = exp_data[:len(frame.tdata) - self.width_bytes]  # Truncate expected data to match received frame size
+                data = frame.tdata[:len(exp_data)]
+                if exp_data != data:
+                    raise ValueError(f"Received frame does not match expected frame:"\
+                                     f"{exp_data.hex()} != {data.hex()}")
+            else:
+                raise ValueError(f"Received frame does not match expected frame:"\
+                                 f"{exp_data.hex()} != {frame.tdata.hex()}")
+
+        return entry
+
+    def log_summary(self, log):
+        log.info(f"Frames Sent: {self.sent}, Matched: {self.matched}, Dropped: {self.dropped}, "
+                 f"Truncated: {self.truncated}, Pending: {self.pending}")
@@ -0,0 +1,22 @@
+"""Random AXI-Stream stimulus"""
+import itertools
+import random
+
+
+def iter_random_frames(num=1, size=1, width_bytes=4, seed=None):
+    """Lazily yield random frames of `size` beats of `width_bytes` each
+
+    Payloads are drawn in bulk with `randbytes`. Without a seed the global
+    `random` state is used, which cocotb seeds from RANDOM_SEED, so a run is
+    reproduced by rerunning with the seed it logged. `num=None` yields frames
+    forever, for soak tests that should not hold their stimulus in memory.
+    """
+    rng = random.Random(seed) if seed is not None else random
+    frame_bytes = size * width_bytes
+    for _ in (range(num) if num is not None else itertools.count()):
+        yield rng.randbytes(frame_bytes)
+
+
+def generate_random_frames(num=1, size=1, width_bytes=4, seed=None):
+    """Generate a list of random frames with the specified size and width in bytes"""
+    return list(iter_random_frames(num, size, width_bytes, seed))
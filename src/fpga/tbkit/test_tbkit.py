@@ -0,0 +1,558 @@
+"""Unit tests of the simulator independent parts of tbkit"""
+import asyncio
+import csv
+import itertools
+import logging
+import os
+import time
+from array import array
+from collections import deque
+from types import SimpleNamespace
+
+import numpy as np
+import cocotb
+import cocotb.utils
+import pytest
+from cocotb.binary import BinaryValue
+from cocotb.triggers import Event, ReadOnly
+from cocotbext.axi import AxiStreamFrame
+
+from tbkit.axis import AxisHandshakeMonitor, AxisTB
+from tbkit import results
+from tbkit.cache import BuildCache, cache_key, fcntl
+from tbkit.capture import SignalCapture, dump_on_failure
+from tbkit.chain import chain_verilog
+from tbkit.coverage import (AXIS_BINS, GATE_BINS, AxisCoverage, ENABLE, IN_RESET, M_LAST, M_READY, M_VALID,
+                            S_LAST, S_READY, S_VALID, until_covered)
+from tbkit.models import estimate
+from tbkit.pauses import PAUSE_MODELS, PausePattern, pause_pattern
+from tbkit import profiler
+from tbkit.profiler import SimProfiler
+from tbkit.protocol import CHECKER_SOURCE, ProtocolMonitor, checked_sources, checked_verilog
+from tbkit.runner import SweepResult, assign_shards, load_durations, merge_reports, write_report
+from tbkit.scoreboard import AxisScoreboard
+from tbkit.stimulus import generate_random_frames, iter_random_frames
+from tbkit.trace import TraceRecorder, TraceReplay
+
+
+def test_cache_key(tmp_path):
+    header = tmp_path / "defs.vh"
+    header.write_text("`define WIDTH 8\n")
+    source = tmp_path / "dut.v"
+    source.write_text('`include "defs.vh"\nmodule dut; endmodule\n')
+
+    kwargs = dict(verilog_sources=[str(source)], toplevel="dut", parameters={"WIDTH": 8})
+    key, _ = cache_key("icarus", **kwargs)
+
+    # Touching a file without changing it keeps the key
+    os.utime(source)
+    assert cache_key("icarus", **kwargs)[0] == key
+
+    # Parameters, sim_args and included files are part of the key
+    assert cache_key("icarus", **dict(kwargs, parameters={"WIDTH": 16}))[0] != key
+    assert cache_key("icarus", **dict(kwargs, sim_args=["-L", "xpm"]))[0] != key
+    header.write_text("`define WIDTH 16\n")
+    assert cache_key("icarus", **kwargs)[0] != key
+
+
+def test_cache_eviction(tmp_path):
+    cache = BuildCache(str(tmp_path), max_size_bytes=2500, max_age_s=3600)
+    now = time.time()
+    for i, age in enumerate([7200, 300, 200, 100]):
+        entry = tmp_path / f"entry{i}"
+        entry.mkdir()
+        (entry / "image").write_bytes(bytes(1000))
+        os.utime(entry / "image", (now - age, now - age))
+        os.utime(entry, (now - age, now - age))
+
+    cache.evict(keep=str(tmp_path / "entry3"))
+
+    # entry0 is too old, entry1 is the least recently used above the size limit
+    assert sorted(os.listdir(tmp_path)) == ["entry2", "entry3"]
+
+
+@pytest.mark.skipif(fcntl is None, reason="entries are not locked without fcntl")
+def test_cache_eviction_locked(tmp_path):
+    cache = BuildCache(str(tmp_path), max_size_bytes=0, max_age_s=0)
+    for i in range(2):
+        (tmp_path / f"entry{i}").mkdir()
+        (tmp_path / f"entry{i}" / "image").write_bytes(bytes(1000))
+
+    # A running simulation holds a shared lock, eviction leaves its entry alone
+    with cache._lock(str(tmp_path / "entry0"), shared=True) as locked:
+        assert locked
+        with cache._lock(str(tmp_path / "entry0"), shared=True, blocking=False) as also:
+            assert also  # Other simulations of the same entry
+        cache.evict()
+        assert os.path.isdir(tmp_path / "entry0") and not os.path.exists(tmp_path / "entry1")
+
+    cache.evict()
+    assert sorted(os.listdir(tmp_path)) == []
+
+
+@pytest.mark.skipif(fcntl is None, reason="entries are not locked without fcntl")
+def test_cache_run_lock(tmp_path, monkeypatch):
+    source = tmp_path / "dut.v"
+    source.write_text("module dut; endmodule\n")
+    cache = BuildCache(str(tmp_path / "cache"))
+    shared = []
+
+    def run(**kwargs):
+        os.makedirs(kwargs["sim_build"], exist_ok=True)
+        if not kwargs.get("compile_only"):
+            with cache._lock(kwargs["sim_build"], shared=True, blocking=False) as also:
+                shared.append(also)
+    monkeypatch.setattr("cocotb_test.simulator.run", run)
+
+    # Waveforms land in the working directory: a shared entry is only simulated concurrently with one per run
+    kwargs = dict(verilog_sources=[str(source)], toplevel="dut", waves=True)
+    cache.run("icarus", **kwargs, work_dir=str(tmp_path))
+    cache.run("icarus", **kwargs)
+    cache.run("icarus", **dict(kwargs, waves=False))
+    cache.run("verilator", **kwargs, work_dir=str(tmp_path))
+    assert shared == [True, False, True, False]
+
+
+def test_handshake_timeline():
+    # Timeline queries only, without starting the monitor coroutine
+    monitor = AxisHandshakeMonitor.__new__(AxisHandshakeMonitor)
+    monitor.clk_period_ns = 10
+    monitor.times = array("d", [0, 50, 80, 200])
+    monitor.states = array("B", [monitor.IDLE, monitor.HANDSHAKE, monitor.VALID, monitor.HANDSHAKE])
+    monitor._beats_before = array("q")
+
+    # Beats on the edges 50, 60, 70 and from 200 on
+    assert monitor.handshakes(0, 200) == 3
+    assert monitor.handshakes(60, 230) == 5
+    assert monitor.cycles(monitor.VALID, 0, 300) == 12
+    assert monitor.last_handshake(150) == 70
+    assert monitor.last_handshake(235) == 230
+    assert monitor.last_handshake(40) is None
+    assert [monitor.beat_time(n) for n in range(3)] == [50, 60, 70]
+    assert [monitor.beats(end) for end in (45, 70, 150, 200, 230)] == [0, 3, 3, 4, 7]
+
+
+def test_signal_capture(tmp_path):
+    # Ring buffer and dump only, without starting the capture coroutine
+    capture = SignalCapture.__new__(SignalCapture)
+    capture.clock = SimpleNamespace(_name="aclk")
+    capture.names = ["tvalid", "tdata"]
+    capture.widths = [1, 4]
+    capture.clk_period_ns = 10
+    capture.depth = 4
+    capture.samples = deque()
+
+    for time, values in [(0, ("0", "0000")), (10, ("1", "0001")), (20, ("1", "0001")), (30, ("1", "0010")),
+                         (60, ("0", "0010"))]:
+        capture._record(time, values)
+    # The repeated values are not stored, the changes before the last 4 cycles are dropped
+    assert [time for time, _ in capture.samples] == [30, 60]
+
+    path = capture.write_vcd(str(tmp_path / "capture.vcd"), end=70)
+    with open(path) as f:
+        vcd = f.read()
+    header, body = vcd.split("$enddefinitions $end\n")
+    assert "$var wire 1 ! aclk $end" in header and "$var wire 4 # tdata $end" in header
+    # Cycles 40 to 70 with the clock rebuilt, values written where they change
+    assert body.split("\n")[:6] == ["#40000", '1!', '1"', "b0010 #", "#45000", '0!']
+    assert body.count("\n1!\n") == 4 and body.count("b0010 #") == 1
+    assert '#60000\n1!\n0"\n' in body
+
+
+def test_drain_timeout(monkeypatch):
+    # Timeline queries only, without starting the monitor coroutine
+    monitor = AxisHandshakeMonitor.__new__(AxisHandshakeMonitor)
+    monitor.clk_period_ns = 10
+    monitor.times = array("d", [0, 100, 200])
+    monitor.states = array("B", [monitor.IDLE, monitor.HANDSHAKE, monitor.VALID])
+    monitor._beats_before = array("q")
+    tb = AxisTB.__new__(AxisTB)
+    tb.clk_period_ns = 10
+    tb.output_monitor = monitor
+    tb.input_throughput, tb.output_throughput = 1.0, 0.25
+    sim_time = lambda now: monkeypatch.setattr(cocotb.utils, "get_sim_time", lambda units="ns": now)
+
+    # Before the first beat, from the configured throughputs
+    sim_time(50)
+    assert tb.drain_timeout_ns(beats=8) == (4 * 8 / 0.25 + 100) * 10
+    # 10 beats over 40 cycles observed, no faster than the configured rate
+    sim_time(490)
+    assert tb.drain_timeout_ns(beats=8) == (4 * 8 / 0.25 + 100) * 10
+    tb.output_throughput = 1.0
+    assert tb.drain_timeout_ns(beats=8) == (4 * 8 / 0.25 + 100) * 10
+    sim_time(1090)  # 10 beats over 100 cycles
+    assert tb.drain_timeout_ns(beats=8) == pytest.approx((4 * 8 / 0.1 + 100) * 10)
+
+    # A sink staying empty fails after the last budget, a frame arriving in time does not
+    class Sink:
+        def __init__(self, arrival):
+            self.arrival, self.waited = arrival, 0
+
+        async def wait(self, timeout, units):
+            self.waited += 1
+
+        def empty(self):
+            return self.waited < self.arrival
+
+    tb.log = logging.getLogger("test")
+    tb.sink = Sink(arrival=3)
+    asyncio.run(tb.wait_sink(beats=8))
+    tb.sink = Sink(arrival=5)
+    with pytest.raises(RuntimeError, match="Timeout waiting for frame"):
+        asyncio.run(tb.wait_sink(beats=8))
+    assert tb.sink.waited == 4
+
+
+def test_profiler(monkeypatch):
+    class Scheduler:
+        """Reacts like cocotb's, Python triggers fired by a coroutine react inside the event loop"""
+        def _react(self, trigger):
+            self._schedule(trigger.task, trigger)
+            for fired in getattr(trigger, "fires", []):
+                self._react(fired)
+
+        def _schedule(self, coroutine, trigger=None):
+            pass
+
+    class Test(profiler._RunningTest):
+        def __init__(self, done):
+            self._done = done
+
+        def done(self):
+            return self._done
+
+    scheduler = Scheduler()
+    monkeypatch.setattr(cocotb, "scheduler", scheduler)
+    monkeypatch.setattr(cocotb.utils, "get_sim_time", lambda units="ns": 1000)
+    edge, event = ReadOnly(), Event().wait()
+    edge.task, event.task = "monitor", "driver"
+    edge.fires = [event]
+
+    # A second TB in the same test shares the hooks, which are removed with the last profiler
+    first, second = SimProfiler(10).start(), SimProfiler(10).start()
+    scheduler._react(edge)
+    second.stop()
+    assert scheduler.__dict__.get("_react") is profiler._timed_react
+    scheduler._react(edge)
+    scheduler._schedule(Test(done=False))
+    assert first._scheduler is not None
+    scheduler._schedule(Test(done=True))
+    assert first._scheduler is None and "_react" not in scheduler.__dict__ and not profiler._running
+
+    # Only the GPI trigger is a simulator callback, the event set by its coroutine is not
+    assert (second.callbacks, second.triggers["ReadOnly"][0], second.triggers["_Event"][0]) == (1, 1, 1)
+    assert (first.callbacks, first.triggers["ReadOnly"][0], first.coroutines["Test"][0]) == (2, 2, 2)
+
+    # Without the private hooks, e.g. after a cocotb update, nothing is wrapped
+    monkeypatch.setattr(profiler, "_RunningTest", None)
+    unavailable = SimProfiler(10).start()
+    assert unavailable._scheduler is None and "_react" not in scheduler.__dict__ and unavailable.stop() is None
+
+def test_random_frames():
+    frames = generate_random_frames(num=3, size=16, width_bytes=8, seed=1)
+    assert [len(frame) for frame in frames] == [128] * 3
+    assert frames == generate_random_frames(num=3, size=16, width_bytes=8, seed=1)
+
+    # Unbounded generators are lazy
+    frames = iter_random_frames(num=None, size=1, width_bytes=4, seed=1)
+    assert [next(frames) for _ in range(3)] == generate_random_frames(num=3, size=1, width_bytes=4, seed=1)
+
+
+def test_scoreboard():
+    def received(data, tid):
+        return AxiStreamFrame(bytearray(data), tid=[tid] * len(data))
+
+    scoreboard = AxisScoreboard(width_bytes=2)
+    scoreboard.expect(b"\x01\x02", tid=1, context=0)
+    scoreboard.expect(b"\x03\x04\x05\x06", tid=2, context=1)
+    assert scoreboard.check(received(b"\x01\x02", 1)).context == 0
+    with pytest.raises(ValueError):
+        scoreboard.check(received(b"\x03\x04\x05\x07", 2))
+    with pytest.raises(RuntimeError):
+        scoreboard.check(received(b"\x01\x02", 1))
+
+    # Truncated frames keep their last beat
+    scoreboard.expect(b"\x01\x02\x03\x04\x05\x06", tid=3)
+    scoreboard.check(received(b"\x01\x02\x05\x06", 3), allow_truncation=True)
+    assert scoreboard.truncated == 1
+
+    # A lossy scoreboard matches by ID and counts the frames skipped as dropped
+    scoreboard = AxisScoreboard(width_bytes=2, lossy=True, check_data=False)
+    for seq, tid in enumerate([0, 1, 0, 2, 1]):
+        scoreboard.expect(bytes(2), tid=tid, context=seq)
+    assert scoreboard.check(received(bytes(2), 0)).context == 0
+    assert scoreboard.check(received(bytes(2), 2)).context == 3
+    assert scoreboard.check(received(bytes(2), 1)).context == 4
+    assert (scoreboard.matched, scoreboard.dropped, scoreboard.pending) == (3, 2, 0)
+    assert scoreboard.empty()
+
+    # Frames an idle lossy DUT never output stop counting as pending
+    for tid in [0, 1]:
+        scoreboard.expect(bytes(2), tid=tid)
+    scoreboard.drop_pending()
+    assert (scoreboard.dropped, scoreboard.pending) == (4, 0)
+    scoreboard.expect(bytes(2), tid=1, context=7)
+    assert scoreboard.check(received(bytes(2), 1)).context == 7
+
+    frame = received(bytes(4), 1)
+    frame.tid[-1] = 2
+    with pytest.raises(ValueError, match="ID 2 does not match the first ID 1"):
+        AxisScoreboard.frame_tid(frame)
+
+
+def test_results_baseline(tmp_path, monkeypatch):
+    monkeypatch.setenv(results.RESULTS_ENV, str(tmp_path / "run" / "axis_skid_buffer.jsonl"))
+    monkeypatch.setenv(results.PARAMETERS_ENV, '{"DATA_WIDTH": "32"}')
+    results.record("Continuous", {"output_throughput_MBs": 380.0, "latency_p50_ns": 20}, dut="axis_skid_buffer")
+    baseline = results.load_results([str(tmp_path / "run")])
+    results.write_json(baseline, str(tmp_path / "baseline.json"))
+
+    # The last entry of a key wins
+    results.record("Continuous", {"output_throughput_MBs": 370.0, "latency_p50_ns": 20}, dut="axis_skid_buffer")
+    entries = results.load_results([str(tmp_path / "run")])
+    assert len(entries) == 1
+
+    regressions = results.compare(entries, baseline)
+    assert [metric for _, metric, *_ in regressions] == ["output_throughput_MBs"]
+    assert results.compare(entries, baseline, {"output_throughput_MBs": 0.05}) == []
+
+    assert results.main(["compare", str(tmp_path / "run"), "--baseline", str(tmp_path / "baseline.json")]) == 1
+    assert results.main(["compare", str(tmp_path / "run"), "--baseline", str(tmp_path / "baseline.json"),
+                         "--tolerance", "output_throughput_MBs=0.05"]) == 0
+
+    assert results.main(["csv", str(tmp_path / "run"), "-o", str(tmp_path / "results.csv")]) == 0
+    with open(tmp_path / "results.csv") as f:
+        rows = list(csv.DictReader(f))
+    assert rows[0]["scenario"] == "Continuous" and float(rows[0]["output_throughput_MBs"]) == 370.0
+
+
+def test_surfaces():
+    entries = []
+    for input_throughput in [0.5, 1.0]:
+        for output_throughput in [0.5, 1.0]:
+            entries.append({
+                "dut": "axis_half_buffer",
+                "parameters": {},
+                "scenario": f"Sweep {input_throughput}/{output_throughput}",
+                "point": {"input_throughput": input_throughput, "output_throughput": output_throughput},
+                "metrics": {"output_utilization": 100 * min(input_throughput, output_throughput)},
+            })
+
+    [(title, table)] = results.surfaces(entries, "output_utilization")
+    assert title == "axis_half_buffer"
+    rows = [line.split() for line in table.splitlines()[1:]]
+    assert rows == [["0.5", "50.00", "50.00"], ["1.0", "50.00", "100.00"]]
+
+    # Swept parameters are coordinates of one table
+    for width in [32, 512]:
+        entries.append({
+            "dut": "axis_half_buffer",
+            "parameters": {"DATA_WIDTH": str(width)},
+            "scenario": "Scaling",
+            "point": {"DATA_WIDTH": width},
+            "metrics": {"output_utilization": 50.0},
+        })
+    tables = results.surfaces(entries, "output_utilization")
+    assert len(tables) == 2
+    assert [line.split() for line in tables[0][1].splitlines()[1:]] == [["32", "50.00"], ["512", "50.00"]]
+
+
+@pytest.mark.parametrize("model", sorted(PAUSE_MODELS))
+def test_pause_patterns(model):
+    cycles = 50000
+    for throughput in [0.0, 0.25, 0.7, 1.0]:
+        bitmap = np.array(list(itertools.islice(pause_pattern(model, throughput, seed=7), cycles)))
+        assert abs((1.0 - bitmap.mean()) - throughput) < 0.02
+
+        # Runs replay the same seeded bitmap
+        replay = []
+        for pause, length in pause_pattern(model, throughput, seed=7).runs():
+            replay.extend([pause] * length)
+            if len(replay) >= cycles:
+                break
+        replay = np.array(replay[:cycles])
+        assert (replay == bitmap).all()
+
+    # Markov pauses come in bursts, Bernoulli pauses mostly alone
+    def mean_pause_run(model):
+        runs = itertools.islice(pause_pattern(model, 0.5, seed=7).runs(), 1000)
+        return np.mean([length for pause, length in runs if pause])
+    assert mean_pause_run("markov") > 4 * mean_pause_run("bernoulli")
+
+    class Unfinished(PausePattern):
+        pass
+    with pytest.raises(TypeError, match="generate"):
+        Unfinished(0.5)  # At creation, not when the simulation first draws a block
+
+
+def test_trace_replay(tmp_path):
+    path = str(tmp_path / "run_test_pause.trace")
+    batches = [[(bytes([i] * 8), i % 3) for i in range(5)], [(bytes(4), None)]]
+
+    recorder = TraceRecorder(path, meta={"seed": "42"})
+    recorded = [list(recorder.frames(f"frames.{i}", iter(batch))) for i, batch in enumerate(batches)]
+    pattern = recorder.pauses("input.0", pause_pattern("markov", 0.3, seed=3, block_cycles=1000))
+    bitmap = np.array(list(itertools.islice(pattern, 2500)))
+    recorder.close()
+    assert recorded == batches
+
+    def never_run():
+        raise AssertionError("Replay generated stimulus")
+        yield
+
+    replay = TraceReplay(path)
+    assert replay.meta == {"seed": "42"}
+    assert [list(replay.frames(f"frames.{i}", never_run())) for i in range(2)] == batches
+
+    # Same bitmap whatever the pattern replaced, no pauses once the trace ends
+    pattern = replay.pauses("input.0", pause_pattern("bernoulli", 0.9, block_cycles=1000))
+    replayed = np.array(list(itertools.islice(pattern, 4000)))
+    assert (replayed[:2500] == bitmap).all()
+    assert not replayed[3000:].any()
+
+    # Writes are buffered until the decorated test ends, even when it fails
+    recorder = TraceRecorder(path)
+    frames = recorder.frames("frames.0", iter(batches[0]))
+
+    @dump_on_failure
+    async def failing_test():
+        next(frames)
+        assert os.path.getsize(path) == 0
+        raise AssertionError("Mismatch")
+
+    with pytest.raises(AssertionError, match="Mismatch"):
+        asyncio.run(failing_test())
+    assert recorder.file.closed and list(TraceReplay(path).frames("frames.0")) == batches[0][:1]
+
+    # Random frames of a testbench go through its trace
+    tb = AxisTB.__new__(AxisTB)
+    tb.width_bytes, tb._trace_calls = 4, {}
+    tb.trace = TraceRecorder(path)
+    recorded = list(tb.random_frames(num=3, size=2))
+    tb.trace.close()
+    tb.trace, tb._trace_calls = TraceReplay(path), {}
+    assert list(tb.random_frames(num=3, size=2)) == recorded and len(recorded[0]) == 8
+
+
+
+def test_models():
+    frames = [64] * 8
+    assert estimate("axis_half_buffer", frames)["output_utilization"] == pytest.approx(50, abs=1)
+    assert estimate("axis_prefetch", frames)["output_utilization"] == pytest.approx(100, abs=1)
+    assert estimate("axis_skid_buffer", frames, output_throughput=0.7, model="periodic")["output_utilization"] \
+        == pytest.approx(70, abs=1)
+    assert estimate("axis_gating", frames, gate_throughput=0.5, seed=1)["output_utilization"] == pytest.approx(50, abs=5)
+    assert estimate(["axis_skid_buffer", "axis_half_buffer"], frames)["output_utilization"] == pytest.approx(50, abs=1)
+
+    # Frames longer than the buffer keep 16 of their 64 beats
+    metrics = estimate("axis_circular_buffer", frames, buffer_size=16)
+    assert metrics["output_utilization"] == pytest.approx(25, abs=1)
+    assert metrics["input_utilization"] == pytest.approx(100, abs=1)
+
+
+def test_chain_verilog():
+    source = chain_verilog("chain_test", ["axis_skid_buffer", ("axis_fifo_pipeline", {"FIFO_DEPTH": 32})])
+    assert source.startswith("module chain_test #(") and "input wire enable" not in source
+    assert ".m_axis_tready(axis_1_tready)" in source and ".s_axis_tready(axis_1_tready)" in source
+    assert ".OUTPUT_WIDTH(DATA_WIDTH),\n        .FIFO_DEPTH(32)\n" in source
+    assert ".enable(enable)" in chain_verilog("chain_gated", ["axis_gating", "axis_prefetch"])
+    with pytest.raises(ValueError):
+        chain_verilog("chain_lossy", ["axis_circular_buffer"])
+
+
+def test_coverage():
+    # Bin bookkeeping only, without a handshake monitor sampling it
+    coverage = AxisCoverage.__new__(AxisCoverage)
+    coverage._init_counters(AXIS_BINS + GATE_BINS, goal=2, clk_period_ns=10)
+    stall = S_VALID | M_VALID
+    handshake = S_VALID | S_READY | M_VALID | M_READY
+
+    coverage._enter(IN_RESET | ENABLE, 0)
+    for time, state in [(20, handshake | ENABLE),  # Beat without tlast, the input enters a frame
+                        (50, stall | ENABLE),
+                        (70, stall),  # Gate closes inside the frame
+                        (90, handshake | ENABLE | S_LAST),  # Gate reopens, the frame ends
+                        (100, stall | ENABLE | M_LAST)]:
+        coverage._advance(time)
+        coverage._enter(state, time)
+
+    summary = coverage.summary(130)
+    assert summary["cycles"] == 11  # Reset cycles are not counted
+    bins = summary["bins"]
+    assert bins["both_stalled"] == {"episodes": 2, "cycles": 7}
+    assert bins["buffer_full"] == bins["full_under_backpressure"] == {"episodes": 2, "cycles": 7}
+    assert bins["output_tlast_stall"] == {"episodes": 1, "cycles": 3}
+    assert bins["gate_closed_mid_frame"] == {"episodes": 1, "cycles": 1}
+    assert bins["gate_opened_mid_frame"] == {"episodes": 1, "cycles": 1}
+    assert bins["input_tlast_stall"]["episodes"] == 0
+    assert "both_stalled" not in coverage.missing() and not coverage.covered
+
+    for time, state in [(130, handshake | ENABLE), (140, S_READY | M_READY | ENABLE), (150, handshake | ENABLE),
+                        (160, S_READY | M_READY | ENABLE)]:
+        coverage._enter(state, time)
+    assert coverage.episodes[[b.name for b in coverage.bins].index("output_starved")] == 2
+
+    # Stimulus stops as soon as every bin is saturated
+    coverage._pending = 0
+    assert list(until_covered(iter(range(5)), coverage)) == []
+    assert list(until_covered(iter(range(5)), None)) == list(range(5))
+
+
+def test_checked_verilog(tmp_path):
+    pipeline = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "pipeline")
+    with open(os.path.join(pipeline, "axis_gating.v")) as f:
+        source = checked_verilog(f.read())
+    # Same name and ports as the DUT, with the DUT renamed and checkers on both interfaces
+    assert "module axis_gating_core #(" in source and "\nmodule axis_gating #(" in source
+    assert "axis_gating_core #(.DATA_WIDTH(DATA_WIDTH)) core (" in source and ".enable(enable)," in source
+    assert source.count("axis_protocol_checker #(") == 2 and ".CHECK_ENABLE(1)\n    ) m_axis_checker" in source
+    assert "assign protocol_violation = |{s_axis_violation, m_axis_violation};" in source
+
+    with open(os.path.join(pipeline, "axis_circular_buffer.v")) as f:
+        source = checked_verilog(f.read())
+    assert ".ID_WIDTH(((TID_WIDTH-1) - (0) + 1))" in source and ".tid(m_axis_tid)" in source
+
+    sources = [os.path.join(pipeline, "axis_skid_buffer.v"), os.path.join(pipeline, "xpm_fifo_sync.v")]
+    checked = checked_sources(sources, str(tmp_path))
+    assert checked == [str(tmp_path / "axis_skid_buffer_checked.v"), sources[1], CHECKER_SOURCE]
+
+    # Modules flagged before the test are skipped until their reset clears them
+    def module(path, s_axis, m_axis):
+        return SimpleNamespace(_path=path, s_axis_violation=SimpleNamespace(value=BinaryValue(s_axis)),
+                               m_axis_violation=SimpleNamespace(value=BinaryValue(m_axis)),
+                               protocol_violation=SimpleNamespace(value=BinaryValue("1" if "1" in s_axis + m_axis else "0")))
+    monitor = ProtocolMonitor.__new__(ProtocolMonitor)
+    monitor.modules = [module("top", "0000", "0010"), module("top.core.stage_1_inst", "0001", "0000")]
+    monitor.log = logging.getLogger("test")
+    monitor._stale = {id(monitor.modules[1])}
+    assert monitor.violations() == ["top.m_axis: payload changed while stalled"]
+    with pytest.raises(AssertionError, match="payload changed"):
+        monitor.check()
+
+
+def test_shards(tmp_path):
+    names = [f"config_{i}" for i in range(10)]
+    durations = {name: float(i + 1) for i, name in enumerate(names[:8])}  # The last two are estimated
+
+    shards, loads = assign_shards(names, 3, durations)
+    assert (shards, loads) == assign_shards(list(reversed(names)), 3, dict(reversed(durations.items())))
+    assert sorted(set(shards.values())) == [0, 1, 2] and max(loads) - min(loads) <= 1.0
+    assert shards["config_7"] != shards["config_6"]  # The longest ones are spread first
+
+    # Each shard reports its results and benchmarks, the merge adds them back up
+    paths = []
+    for shard in range(3):
+        results = [SweepResult(name, "dut", {}, name != "config_2", durations.get(name, 4.0), f"{name}.log")
+                   for name in names if shards[name] == shard]
+        benchmarks = [{"dut": "dut", "parameters": {}, "scenario": name, "metrics": {"cycles": 1}}
+                      for name in names if shards[name] == shard]
+        paths.append(str(tmp_path / f"report.shard-{shard + 1}-of-3.json"))
+        write_report(results, paths[-1], loads[shard], benchmarks, shard=(shard + 1, 3))
+
+    merged, results = merge_reports(paths)
+    assert (merged["passed"], merged["failed"]) == (9, 1)
+    assert merged["wall_time_s"] == max(loads) and merged["missing_shards"] == []
+    assert len(merged["benchmarks"]) == 10 and load_durations(paths).keys() == set(names)
+
+    merged, _ = merge_reports(paths[:2])
+    assert merged["missing_shards"] == [3]
\ No newline at end of file
@@ -0,0 +1,174 @@
+"""Binary stimulus traces for deterministic replay of a test
+
+With `TRACE=record`, every frame sent by a test (data and tid) and every
+pause bitmap it drives (source, sink, gate enable) is appended to
+`<TRACE_DIR>/<test>.trace` as it is generated. Writes are buffered and the
+recorder is closed when a test decorated with `tbkit.capture.dump_on_failure`
+ends, failing or not, or when the simulator exits, so the trace of a failing
+run is complete up to the failure. With `TRACE=replay`, the trace is
+memory-mapped and drives the same frames and cycle-exact pause sequences
+back, without generating any stimulus.
+
+The file is a magic string followed by chunks:
+
+    u8 type, u16 name length, u64 payload length, name, payload
+
+    META    JSON metadata of the run
+    FRAME   i64 tid (-1 without tid), frame data
+    PAUSES  u64 cycles, pause bitmap packed with numpy.packbits
+
+Chunk names tell apart the stimulus calls of a test, e.g. `frames.2` for
+the third batch of frames or `input.0` for the first source pause pattern.
+"""
+import atexit
+import json
+import mmap
+import os
+import struct
+
+import cocotb
+import numpy as np
+
+MAGIC = b"TBTRACE\x01"
+CHUNK = struct.Struct("<BHQ")
+TID = struct.Struct("<q")
+CYCLES = struct.Struct("<Q")
+
+META = 0
+FRAME = 1
+PAUSES = 2
+
+MODE_ENV = "TRACE"
+DIR_ENV = "TRACE_DIR"
+
+BUFFER_BYTES = 1 << 20
+
+_recorders = []  # Open recorders, closed at the end of their test
+
+
+def current_test_name():
+    """Name of the running cocotb test"""
+    test = getattr(cocotb.regression_manager, "_test", None)
+    return getattr(test, "__qualname__", "test")
+
+
+def trace_path(name):
+    return os.path.join(os.getenv(DIR_ENV, "traces"), f"{name}.trace")
+
+
+class TraceRecorder:
+    """Append the stimulus of a test to a trace file"""
+    def __init__(self, path, meta=None):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.file = open(path, "wb", buffering=BUFFER_BYTES)
+        self.file.write(MAGIC)
+        self._write(META, "", json.dumps(meta or {}).encode())
+        _recorders.append(self)
+
+    def _write(self, type, name, payload):
+        name = name.encode()
+        self.file.write(CHUNK.pack(type, len(name), len(payload)))
+        self.file.write(name)
+        self.file.write(payload)
+
+    def frames(self, name, frames):
+        """Record (data, tid) pairs while passing them through"""
+        for data, tid in frames:
+            self._write(FRAME, name, TID.pack(-1 if tid is None else tid) + bytes(data))
+            yield data, tid
+
+    def pauses(self, name, pattern):
+        """Record the blocks of a pause pattern as they are generated"""
+        blocks = pattern.blocks
+
+        def recorded_blocks():
+            for block in blocks():
+                self._write(PAUSES, name, CYCLES.pack(len(block)) + np.packbits(block).tobytes())
+                yield block
+
+        pattern.blocks = recorded_blocks
+        return pattern
+
+    def close(self):
+        self.file.close()
+        if self in _recorders:
+            _recorders.remove(self)
+
+
+def close_traces():
+    """Write out and close the open recorders"""
+    while _recorders:
+        _recorders[-1].close()
+
+
+atexit.register(close_traces)  # The simulator ending before the test, e.g. on a fatal error
+
+
+class TraceReplay:
+    """Memory-mapped trace driving recorded stimulus back"""
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.map[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a stimulus trace")
+
+        self.meta = {}
+        self.frame_chunks = {}
+        self.pause_chunks = {}
+        offset = len(MAGIC)
+        while offset < len(self.map):
+            type, name_length, length = CHUNK.unpack_from(self.map, offset)
+            offset += CHUNK.size
+            name = self.map[offset:offset + name_length].decode()
+            offset += name_length
+            if type == META:
+                self.meta = json.loads(self.map[offset:offset + length])
+            elif type == FRAME:
+                self.frame_chunks.setdefault(name, []).append((offset, length))
+            elif type == PAUSES:
+                self.pause_chunks.setdefault(name, []).append(offset)
+            offset += length
+
+    def frames(self, name, frames=None):
+        """Recorded (data, tid) pairs
+
+        `frames` is ignored, a lazy generator passed there is never run.
+        """
+        for offset, length in self.frame_chunks.get(name, []):
+            tid, = TID.unpack_from(self.map, offset)
+            yield self.map[offset + TID.size:offset + length], (None if tid < 0 else tid)
+
+    def pauses(self, name, pattern):
+        """Replace the blocks of a pattern by the recorded ones, never pausing after them"""
+        chunks = self.pause_chunks.get(name, [])
+        block_cycles = pattern.block_cycles
+
+        def recorded_blocks():
+            for offset in chunks:
+                cycles, = CYCLES.unpack_from(self.map, offset)
+                packed = np.frombuffer(self.map, dtype=np.uint8, count=(cycles + 7) // 8, offset=offset + CYCLES.size)
+                yield np.unpackbits(packed, count=cycles).astype(bool)
+            while True:
+                yield np.zeros(block_cycles, dtype=bool)
+
+        pattern.blocks = recorded_blocks
+        return pattern
+
+    def close(self):
+        self.map.close()
+
+
+def open_trace(name=None):
+    """Recorder or replay of a test selected by the `TRACE` environment variable, None if unset"""
+    mode = os.getenv(MODE_ENV, "")
+    if not mode:
+        return None
+    path = trace_path(name or current_test_name())
+    if mode == "record":
+        return TraceRecorder(path, meta={"test": name or current_test_name(), "seed": os.getenv("RANDOM_SEED")})
+    if mode == "replay":
+        return TraceReplay(path)
+    raise ValueError(f"Unknown {MODE_ENV} mode {mode}, expected record or replay")